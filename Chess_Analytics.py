@@ -1,30 +1,31 @@
 import streamlit as st
 import warnings
 from utils_pages import bubble_chart
+from utils_pages import bubble_chart_frame_step
 from utils_pages import load_data
+from utils_pages import get_engine
+from utils_pages import get_landing_query
 warnings.filterwarnings('ignore')
 st.set_page_config(layout="wide")
 
+# Create the shared connection pool as soon as the app starts
+get_engine()
+
 # ---- QUERY ----
-query = """
-    SELECT 
-    c.country,
-    c.continent,
-    mu.Ongoing_date AS "date",
-    COUNT(CASE WHEN mu.title = 'GM' THEN 1 END) AS "count of Gm",
-    COUNT(CASE WHEN mu.title != 'NT' THEN 1 END) AS "count of titled players",
-    PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY mu.rating) AS "median of rating"
-FROM MontlhyUpdates mu
-LEFT JOIN countries c ON mu.fed = c.code    
-WHERE FED not in ('NON','FID')   
-GROUP BY c.country, mu.Ongoing_date, c.continent
-ORDER BY mu.Ongoing_date asc,"median of rating" DESC
-
-"""
+query = get_landing_query()
 df = load_data(query)
 max_date = df['date'].max()
 max_date_right_format = max_date.strftime("%Y-%m-%d")
 
+@st.fragment
+def bubble_chart_section(query):
+    # One frame per quarter first, every month once asked: only this section reruns
+    frame_step = bubble_chart_frame_step(key='landing_bubble_chart_monthly')
+    fig = bubble_chart(query= query, color_column='continent' ,text= "Median Rating vs Amount of Gms Players <br> per Country Over Time <br>",
+                       frame_step=frame_step)
+
+    st.plotly_chart(fig,use_container_width=True)
+
 # ---- PAGE TITLE ----
 st.title("♟️ Chess Analytics: A Global Perspective")
 
@@ -76,10 +77,7 @@ with expander_bubble_chart:
     )
     # Placeholder for Bubble Chart
     with st.container(border=True):
-        
-        fig = bubble_chart(query= query, color_column='continent' ,text= "Median Rating vs Amount of Gms Players <br> per Country Over Time <br>")
-
-        st.plotly_chart(fig,use_container_width=True)
+        bubble_chart_section(query)
     
 # ---- PROJECT OBJECTIVES ----
 # Project structure
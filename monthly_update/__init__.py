@@ -0,0 +1,7 @@
+"""
+Monthly update of the chess database from the FIDE rating list.
+
+Run it with `python -m monthly_update run --month YYYY-MM`. The package does not
+depend on Streamlit, and the heavy optional stages (the bar chart race video) import
+their libraries only when they run.
+"""
@@ -0,0 +1,85 @@
+import argparse
+from datetime import datetime
+
+###################################################
+# Command line
+###################################################
+
+def month(value):
+    """Check that a month is written 'YYYY-MM'."""
+    try:
+        return datetime.strptime(value, '%Y-%m').strftime('%Y-%m')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' is not a month written YYYY-MM")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m monthly_update',
+                                     description='Monthly update of the chess database.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Load the FIDE list of a month.')
+    run_parser.add_argument('--month', type=month, default=None,
+                            help='Month of the FIDE list to load (YYYY-MM), the list of --source-dir by default.')
+    run_parser.add_argument('--source-dir', default='current_month',
+                            help='Folder holding the FIDE list, open.csv is saved there too.')
+    run_parser.add_argument('--top-k', type=int, default=None,
+                            help='Number of players kept per federation.')
+    run_parser.add_argument('--stage', choices=('parse', 'validate', 'load', 'csv', 'race', 'video'), default=None,
+                            help='Run only this stage, from the checkpoint of the stage before it.')
+    run_parser.add_argument('--force', action='store_true',
+                            help='Load the list again, replacing its month, and rerun the stages even if '
+                                 'their input did not change.')
+    run_parser.add_argument('--skip-video', action='store_true',
+                            help='Do not render the video of the bar chart race (needs ffmpeg).')
+
+    backfill_parser = commands.add_parser('backfill', help='Load every FIDE list of a folder in date order.')
+    backfill_parser.add_argument('--source-dir', required=True,
+                                 help='Folder holding the FIDE lists (.txt or .zip files), one per month.')
+    backfill_parser.add_argument('--top-k', type=int, default=None,
+                                 help='Number of players kept per federation.')
+    backfill_parser.add_argument('--workers', type=int, default=None,
+                                 help='Number of processes reading the lists, the number of CPUs by default.')
+    backfill_parser.add_argument('--since', type=month, default=None,
+                                 help='First month to load (YYYY-MM), the oldest list by default.')
+    backfill_parser.add_argument('--until', type=month, default=None,
+                                 help='Last month to load (YYYY-MM), the latest list by default.')
+    backfill_parser.add_argument('--force', action='store_true',
+                                 help='Load the lists already loaded again, replacing their months.')
+
+    video_parser = commands.add_parser('render-video', help='Render the video of the bar chart race (needs ffmpeg).')
+    video_parser.add_argument('--workers', type=int, default=None,
+                              help='Number of processes rendering the segments, the number of CPUs by default.')
+
+    commands.add_parser('rebuild-age-groups',
+                        help='Rebuild the players-with-age-group table, e.g. after birth years were corrected.')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        # Imported here so that --help answers without loading pandas and SQLAlchemy
+        from monthly_update.update_data import run
+        from monthly_update.utils_update_data import TOP_PLAYERS_PER_FED
+        run(month=args.month,
+            source_dir=args.source_dir,
+            top_k=args.top_k or TOP_PLAYERS_PER_FED,
+            stage=args.stage,
+            force=args.force,
+            skip_video=args.skip_video)
+    elif args.command == 'backfill':
+        from monthly_update.update_data import backfill
+        from monthly_update.utils_update_data import TOP_PLAYERS_PER_FED
+        backfill(source_dir=args.source_dir,
+                 top_k=args.top_k or TOP_PLAYERS_PER_FED,
+                 workers=args.workers,
+                 since=args.since,
+                 until=args.until,
+                 force=args.force)
+    elif args.command == 'render-video':
+        from monthly_update.update_data import render_video
+        render_video(workers=args.workers)
+    elif args.command == 'rebuild-age-groups':
+        from monthly_update.update_data import rebuild_age_groups
+        rebuild_age_groups()
+
+if __name__ == '__main__':
+    main()
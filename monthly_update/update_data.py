@@ -1,189 +1,143 @@
-import pandas as pd
 import os
-import re
-import bar_chart_race as bcr
+import json
+import time
+import hashlib
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import pandas as pd
 from sqlalchemy import create_engine
-from monthly_update.utils_update_data import get_connection_url, update_montlhyupdates_table_sqlalchemy, refresh_materialized_view, delete_data
-from monthly_update.utils_update_data import add_column_date, clean_df, clean_names, replace_wrongcountry_code_with_right_country_code, check_column, check_country_code, load_data, update_players_table_sqlalchemy
-
-###################################################
-# Set up the variables
-###################################################
-
-url_database = get_connection_url()
-engine = create_engine(url_database)
+from monthly_update.utils_update_data import get_connection_url, update_montlhyupdates_table_sqlalchemy, create_month_partitions, archive_old_partitions, append_players_with_age_group, rebuild_players_with_age_group, delete_data, update_dataset_metadata, refresh_filter_cube, refresh_rating_sketch, refresh_leaderboard
+from monthly_update.utils_update_data import find_fide_list, find_fide_lists, read_top_players, TOP_PLAYERS_PER_FED, add_column_date, clean_df, clean_names, replace_wrongcountry_code_with_right_country_code, validate_top_players, load_data, update_players_table_sqlalchemy
+from monthly_update.utils_update_data import CHECKPOINT_DIR, fide_list_month, file_hash, frame_hash, read_manifest, write_manifest
+from monthly_update.utils_update_data import get_ingested_run, start_etl_run, finish_etl_run
 
 ###################################################
 # Load txt file into a dataframe
 ###################################################
 
-# Read the txt file and load it into a dataframe
-txt_file_path= [f for f in os.listdir('current_month') if f.endswith('.txt')][0]
-print(txt_file_path)
-txt_file_path = os.path.join('current_month', txt_file_path)
-print(txt_file_path)
-widths = [15, 61, 4, 3, 6, 4, 15, 5, 6, 4, 3, 5, 7]
-df = pd.read_fwf(txt_file_path, widths=widths, dtype = {'ID Number':str})
-print('The txt file have been loaded into a dataframe')
-
-###################################################
-# Data Cleaning
-###################################################
-# Get only the important columns and rename them
-columns = ["ID","Name","Fed","Sex","Title","Number_of_games","B-day","activity_status",'Rating','Year','Month']
-rating_column = [item for item in df.columns if re.search(r'\d', item)]
-columns_to_get = ['ID Number','Name','Fed','Sex','Tit','Gms','B-day','Flag']
-columns_to_get.extend(rating_column)
-df = df[columns_to_get]
-df = df.rename(columns={"ID Number": "ID", "Tit": "Title","Gms":"Number_of_games","Flag":"activity_status",rating_column[0]:'Rating'})
-df_sorted = df.sort_values(['Fed', 'Rating'], ascending=[True, False])
-print('The important columns have been selected and renamed')
-
-# Get the top 100 players for each country
-top_players = df_sorted.groupby('Fed').head(100)
-print('The top 100 strongest players by country have been selected and stored into the "top_players" dataframe')
-
-# Add Column date    
-top_players = add_column_date(top_players, rating_column)
-print('The column date has been added to "top_players"')
-
-# Data Cleaning
-# -> Remove null values from 'ID','Name','Fed','Sex','B-day','Rating'
-# -> Fill null values of the column Title with "NT"
-# -> Fill null values of the activity_status with "a"
-# -> Fill null values of the activity_status with "a"
-
-top_players = clean_df(top_players)
-print("Remove null values from 'ID','Name','Fed','Sex','B-day','Rating'")
-print('Fill null values of the column Title with "NT"')
-print('Fill null values of the activity_status with "a"')
-print('Fill null values of the activity_status with "a"')
-
-#Data Cleaning column name
-# Extract name part before numbers or parentheses
-# Clean trailing spaces and special chars
-top_players = clean_names(top_players)
-print("Clean players' names")
-
-# Fill the missing values in the B-day column with the median value
-top_players.loc[top_players['B-day'].astype('str').str.len() != 4,'B-day']=df['B-day'].median()
-print("Fill the missing values in the B-day column with the median value")
-
-# Replace wrong country code with the right country code
-top_players = replace_wrongcountry_code_with_right_country_code(top_players)
-print('Replace wrong country code with the right country code')
-
-# End message
-print('The dataframe contains the top 100 players for each country with the relevant columns')
-
-print("Checking the data...")
-# Check the data
-# -> ID must be numeric and have a length between 6 and 9
-print("ID must be numeric and have a length between 6 and 9")
-check_column(top_players, 'ID', is_numeric=True, min_length=6, max_length=9)
-# -> Name must not contain numbers
-print("Name must not contain numbers")
-check_column(top_players, 'Name', contains_no_numbers=True)
-# -> Fed must not contain numbers and have a length of 3
-print("Fed must not contain numbers and have a length of 3")
-check_column(top_players, 'Fed', contains_no_numbers=True, min_length=3, max_length=3)
-# Sex must be a single character and not contain numbers
-print("Sex must be a single character and not contain numbers")
-check_column(top_players, 'Sex', contains_no_numbers=True, min_length=1, max_length=1)
-# Title must not contain numbers and have a length between 2 and 3
-print("Title must not contain numbers and have a length between 2 and 3")
-check_column(top_players, 'Title', contains_no_numbers=True, min_length=2, max_length=3)
-# Number_of_games must be numeric and have a length between 1 and 2
-print("Number_of_games must be numeric and have a length between 1 and 2")
-check_column(top_players, 'Number_of_games', is_numeric=True, min_length=1, max_length=2)
-# B-day must be numeric and have a length of 4
-print("B-day must be numeric and have a length of 4")
-check_column(top_players, 'B-day', is_numeric=True, min_length=4, max_length=4)
-# activity_status must not contain numbers and have a length of 1
-print("activity_status must not contain numbers and have a length of 1")
-check_column(top_players, 'activity_status', contains_no_numbers=True, min_length=1, max_length=1)
-# Rating must be numeric and have a length of 4
-print("Rating must be numeric and have a length of 4")
-check_column(top_players, 'Rating', is_numeric=True, min_length=4, max_length=4)
-# Check the country code
-check_country_code(top_players)
+def prepare_top_players(txt_file_path, top_k=TOP_PLAYERS_PER_FED):
+    """
+    Read the FIDE list and return the cleaned top players of each federation.
+
+    Parameters:
+        txt_file_path (str): Path of the FIDE list.
+        top_k (int): Number of players kept per federation.
+    """
+    # Keep only the top 100 players of each federation while reading the file,
+    # with the important columns renamed
+    top_players, rating_column, b_day_median = read_top_players(txt_file_path, top_k=top_k)
+    print('The txt file have been read and the important columns have been selected and renamed')
+    print(f'The top {top_k} strongest players by country have been selected and stored into the "top_players" dataframe')
+
+    # Add Column date
+    top_players = add_column_date(top_players, rating_column)
+    print('The column date has been added to "top_players"')
+
+    # Data Cleaning
+    # -> Remove null values from 'ID','Name','Fed','Sex','B-day','Rating'
+    # -> Fill null values of the column Title with "NT"
+    # -> Fill null values of the activity_status with "a"
+    # -> Fill null values of the activity_status with "a"
+
+    top_players = clean_df(top_players)
+    print("Remove null values from 'ID','Name','Fed','Sex','B-day','Rating'")
+    print('Fill null values of the column Title with "NT"')
+    print('Fill null values of the activity_status with "a"')
+    print('Fill null values of the activity_status with "a"')
+
+    #Data Cleaning column name
+    # Extract name part before numbers or parentheses
+    # Clean trailing spaces and special chars
+    top_players = clean_names(top_players)
+    print("Clean players' names")
+
+    # Fill the missing values in the B-day column with the median value
+    top_players.loc[top_players['B-day'].astype('str').str.len() != 4,'B-day']=b_day_median
+    print("Fill the missing values in the B-day column with the median value")
+
+    # Replace wrong country code with the right country code
+    top_players = replace_wrongcountry_code_with_right_country_code(top_players)
+    print('Replace wrong country code with the right country code')
+
+    # End message
+    print(f'The dataframe contains the top {top_k} players for each country with the relevant columns')
+    return top_players
 
 ###################################################
 # Load data into the database
 ###################################################
 
-print(f'the shape of the dataframe is {top_players.shape}')
-top_players['ID'] = top_players['ID'].astype('str')
+def load_top_players(top_players, engine, update_metadata=True, replace_month=False):
+    """
+    Load the top players of the month into the database and refresh the tables derived from them.
 
-###################################################
-# players table
-###################################################
+    Parameters:
+        top_players (pd.DataFrame): The cleaned and validated top players.
+        engine: The SQLAlchemy engine connected to the PostgreSQL database.
+        update_metadata (bool): Bump the dataset version at the end, a backfill does it once after the last month.
+        replace_month (bool): Delete the rows of the month that are not in top_players, e.g. when a
+            corrected list of an already loaded month is loaded again.
 
-query = """
-    SELECT distinct id
-    FROM players p ;
+    Returns:
+        dict: The number of rows read and written per table.
     """
-current_unique_ids = load_data(query)
-print(f'The number of current unique Ids in table player is {current_unique_ids.shape[0]}')
-current_unique_ids = current_unique_ids['id'].to_list()
-id_to_add = top_players[~top_players['ID'].isin(current_unique_ids)]
-print(f'The number of rows to add is {id_to_add.shape[0]}')
+    print(f'the shape of the dataframe is {top_players.shape}')
+    top_players['ID'] = top_players['ID'].astype('str')
+    ongoing_date = top_players['Date'].iloc[0].date()
+    row_counts = {'top_players': len(top_players)}
 
-update_players_table_sqlalchemy(top_players, engine)
+    # players table
+    row_counts.update(update_players_table_sqlalchemy(top_players, engine))
 
-###################################################
-# montlhyupdates table
-###################################################
+    # Create the partition of the month (and the next one) before loading it
+    create_month_partitions(engine, ongoing_date)
+    # Update the 'monthlyupdates' table
+    row_counts.update(update_montlhyupdates_table_sqlalchemy(top_players, engine, replace_month=replace_month))
 
-# Update the 'monthlyupdates' table
-update_montlhyupdates_table_sqlalchemy(top_players, engine)
+    # Add the new month to the players-with-age-group table used by the dashboard
+    append_players_with_age_group(engine, ongoing_date)
 
-###################################################
-# refresh the materialized views
-###################################################
+    # Recompute the counts of the new month used by the percentage charts
+    refresh_filter_cube(engine, ongoing_date)
 
-refresh_materialized_view("montlhyupdate_open_players_with_age_group_mv", engine)
+    # Recompute the rating histograms of the new month used for the medians
+    refresh_rating_sketch(engine, ongoing_date)
+
+    # Rank the top players of the new month for the Top 5 page and the bar chart race
+    refresh_leaderboard(engine, ongoing_date)
+
+    # Archive the months that left the 5-year window
+    archive_old_partitions(engine, ongoing_date)
+
+    # Bump the dataset version so the app refreshes its cache
+    if update_metadata:
+        update_dataset_metadata(engine)
+    return row_counts
 
 ###################################################
 # save files
 ###################################################
 
-# Save the dataframe into a csv file
-dataset_date = top_players['Date'].dt.strftime("%Y-%m").unique()[0]
-print(dataset_date)
-folder = "current_month"
-os.makedirs(folder, exist_ok=True)
-top_players_path = os.path.join(folder, "open.csv")
-top_players.to_csv(top_players_path, index=False)
-print('The dataframe has been saved into a csv file')
+def save_top_players(top_players, folder="current_month"):
+    """
+    Save the top players of the month into folder/open.csv and return the path.
+    """
+    dataset_date = top_players['Date'].dt.strftime("%Y-%m").unique()[0]
+    print(dataset_date)
+    os.makedirs(folder, exist_ok=True)
+    top_players_path = os.path.join(folder, "open.csv")
+    top_players.to_csv(top_players_path, index=False)
+    print('The dataframe has been saved into a csv file')
+    return top_players_path
 
 ###################################################
 # update bar chart race - video
 ###################################################
 
-query = """SELECT *
-        FROM top_10_open_players_over_time_view
-       ;        
-        """
-# df = load_data(engine,query)
-df = load_data(query)
-
-df["date"] = pd.to_datetime(df["ongoing_date"])
-df.drop(columns=['ongoing_date'],inplace=True)
-
-pivot_df = df.pivot_table(
-    index="date", 
-    columns="name", 
-    values="rating"
-)
-pivot_df.shape
-print('The pivot table has been created')
-folder = "bar_chart_race_video"
-os.makedirs(folder, exist_ok=True)
-video_path = os.path.join(folder, "top_5_chess_players_over_time.mp4")
-# Generate the animation
-anim = bcr.bar_chart_race(
-    df=pivot_df,
+# Settings of the bar chart race, part of the key of the cached segments
+BAR_CHART_RACE_SETTINGS = dict(
     title='Top 5 Chess Players Over The last 5 Years',
     orientation='h',
     sort='desc',
@@ -196,9 +150,472 @@ anim = bcr.bar_chart_race(
     bar_size=.7,
     period_label={'x': .4, 'y': .93},
     filter_column_colors=False,
-    filename=video_path
 )
-print('The animation has been generated')
+# Folder of the rendered segments of the bar chart race, one per pair of consecutive months
+BAR_CHART_RACE_SEGMENTS_DIR = os.path.join(CHECKPOINT_DIR, 'bar_chart_race')
+
+def get_bar_chart_race_ratings(engine):
+    """
+    Return the ratings of the top players over time, one row per month and one column per player.
+    """
+    query = """SELECT *
+            FROM top_10_open_players_over_time_view
+           ;
+            """
+    df = load_data(query, engine)
+
+    df["date"] = pd.to_datetime(df["ongoing_date"])
+    df.drop(columns=['ongoing_date'],inplace=True)
+
+    pivot_df = df.pivot_table(
+        index="date",
+        columns="name",
+        values="rating"
+    )
+    print('The pivot table has been created')
+    return pivot_df
+
+def make_bar_chart_race(ratings, filename=None):
+    """
+    Return the bar chart race of ratings, set up as bar_chart_race.bar_chart_race sets it up and with
+    its first frame drawn, but not rendered yet.
+
+    Every frame is computed from the whole race (the interpolated ratings and ranks, the colors and
+    the figure size depend on all the players), so a segment is rendered from this object and not
+    from the ratings of its two months.
+    """
+    import inspect
+    import bar_chart_race as bcr
+    from bar_chart_race._make_chart import _BarChartRace
+
+    params = {name: parameter.default for name, parameter in inspect.signature(bcr.bar_chart_race).parameters.items()
+              if parameter.default is not inspect.Parameter.empty}
+    params.update(BAR_CHART_RACE_SETTINGS, df=ratings, filename=filename)
+    race = _BarChartRace(**params)
+    # The init function of the animation: it sets the lower limit of the x axis, kept by the next
+    # frames, and adds the period label and the median line that the next frames update
+    race.plot_bars(0)
+    return race
+
+def seek_bar_chart_race(race, period):
+    """
+    Bring the race to where the whole race is before the first frame of month `period` and return it.
+    """
+    steps = race.steps_per_period
+    if period == 0:
+        return race
+    # The tick labels of the bars extend the view of the axis of the bars, it never shrinks back
+    ranks = race.df_ranks.iloc[:period * steps].to_numpy()
+    drawn = ranks[(ranks > 0) & (ranks < race.n_bars + 1)]
+    axis = race.ax.yaxis if race.orientation == 'h' else race.ax.xaxis
+    axis.set_view_interval(drawn.min(), drawn.max())
+    # The previous frame, removed by the first frame of the segment
+    race.anim_func(period * steps - 1)
+    return race
+
+def bar_chart_race_segment_key(race, period):
+    """
+    Return the hash of what the frames from month `period` to the next one depend on: the ratings,
+    ranks and colors of the players drawn in them, the labels of the months, the layout of the figure
+    and the render settings.
+    """
+    seek_bar_chart_race(race, period)
+    steps = race.steps_per_period
+    rows = slice(period * steps, (period + 1) * steps + 1)
+    ranks = race.df_ranks.iloc[rows]
+    # Only the players ranked in the top n_bars in one of the frames are drawn
+    drawn = ((ranks > 0) & (ranks < race.n_bars + 1)).any().values
+    digest = hashlib.sha256(repr((
+        list(race.df_values.columns[drawn]),
+        race.bar_colors[drawn].tolist(),
+        list(race.str_index[rows]),
+        race.fig.get_size_inches().tolist(),
+        race.fig.dpi,
+        race.ax.get_position().bounds,
+        race.ax.get_xlim()[0],
+        race.ax.get_ylim(),
+        sorted(BAR_CHART_RACE_SETTINGS.items()),
+    )).encode())
+    digest.update(race.df_values.iloc[rows, drawn].to_numpy().tobytes())
+    digest.update(ranks.iloc[:, drawn].to_numpy().tobytes())
+    return digest.hexdigest()
+
+def render_bar_chart_race_segment(ratings, period, video_path):
+    """
+    Render the frames of the bar chart race of ratings from month `period` to the next one (both
+    included) into video_path, a lossless video, with the same pixels as in the whole race.
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.animation import FFMpegWriter, FuncAnimation
+
+    class SegmentWriter(FFMpegWriter):
+        # Frames saved as PNG but sized as the h264 video of the whole race (even width and height)
+        def _adjust_frame_size(self):
+            codec, self.codec = self.codec, 'h264'
+            try:
+                return super()._adjust_frame_size()
+            finally:
+                self.codec = codec
+
+    race = seek_bar_chart_race(make_bar_chart_race(ratings, video_path), period)
+    steps = race.steps_per_period
+    anim = FuncAnimation(race.fig, race.anim_func, range(period * steps, (period + 1) * steps + 1),
+                         lambda: None, interval=race.period_length / steps)
+    try:
+        anim.save(video_path, writer=SegmentWriter(fps=race.fps, codec='png'))
+    finally:
+        plt.rcParams = race.orig_rcParams
+    return video_path
+
+def concat_bar_chart_race_segments(segment_paths, video_path):
+    """
+    Concatenate the segments into video_path with ffmpeg, encoded as bar_chart_race encodes the whole
+    race. Two consecutive segments share a frame (the month between them), which is cut from the end
+    of every segment but the last one.
+    """
+    if shutil.which('ffmpeg') is None:
+        raise RuntimeError("ffmpeg is needed to concatenate the segments of the bar chart race")
+
+    steps = BAR_CHART_RACE_SETTINGS['steps_per_period']
+    fps = 1000 / BAR_CHART_RACE_SETTINGS['period_length'] * steps
+    inputs, streams = [], []
+    for i, path in enumerate(segment_paths):
+        inputs += ['-i', path]
+        trim = f'trim=end_frame={steps},' if i < len(segment_paths) - 1 else ''
+        streams.append(f'[{i}:v]{trim}setpts=PTS-STARTPTS[v{i}]')
+    graph = ';'.join(streams) + ';' + ''.join(f'[v{i}]' for i in range(len(segment_paths))) \
+        + f'concat=n={len(segment_paths)}:v=1:a=0[race]'
+    subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', *inputs, '-filter_complex', graph, '-map', '[race]',
+                    '-r', str(fps), '-vcodec', 'h264', '-pix_fmt', 'yuv420p', video_path], check=True)
+    return video_path
+
+def render_bar_chart_race(engine, folder="bar_chart_race_video", segments_dir=BAR_CHART_RACE_SEGMENTS_DIR,
+                          workers=None):
+    """
+    Render the bar chart race of the top players over time into folder/top_5_chess_players_over_time.mp4
+    and return the path. bar_chart_race (and matplotlib) is only imported when the video is rendered.
+
+    The race is rendered one pair of consecutive months at a time. The segments are cached in
+    segments_dir under the hash of what their frames depend on, so a monthly update only renders the
+    segments that changed, spread over several processes, and the video is the concatenation of the
+    segments: the same video as rendering the whole race at once.
+
+    Parameters:
+        engine: The SQLAlchemy engine connected to the PostgreSQL database.
+        folder (str): Folder of the video.
+        segments_dir (str): Folder of the cached segments.
+        workers (int): Number of processes rendering the segments, the number of CPUs by default.
+    """
+    ratings = get_bar_chart_race_ratings(engine)
+    os.makedirs(folder, exist_ok=True)
+    video_path = os.path.join(folder, "top_5_chess_players_over_time.mp4")
+    if len(ratings) < 2:
+        import bar_chart_race as bcr
+        bcr.bar_chart_race(df=ratings, filename=video_path, **BAR_CHART_RACE_SETTINGS)
+        print('The animation has been generated')
+        return video_path
+
+    race = make_bar_chart_race(ratings)
+    os.makedirs(segments_dir, exist_ok=True)
+    segment_paths, missing = [], []
+    for period in range(len(ratings) - 1):
+        path = os.path.join(segments_dir, f'{bar_chart_race_segment_key(race, period)}.mkv')
+        segment_paths.append(path)
+        if not os.path.exists(path):
+            missing.append((period, path))
+
+    print(f'{len(missing)} of the {len(segment_paths)} segments of the animation to render')
+    if missing:
+        periods, paths = zip(*missing)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(render_bar_chart_race_segment, repeat(ratings), periods, paths))
+
+    # Segments no longer in the race are not needed anymore
+    for name in set(os.listdir(segments_dir)) - {os.path.basename(path) for path in segment_paths}:
+        os.remove(os.path.join(segments_dir, name))
+
+    concat_bar_chart_race_segments(segment_paths, video_path)
+    print('The animation has been generated')
+    return video_path
+
+###################################################
+# update bar chart race - payload
+###################################################
+
+def save_bar_chart_race_payload(engine, folder="bar_chart_race_video"):
+    """
+    Save the rankings of the top players over time into folder/top_players_over_time.json, the data
+    of the bar chart race animated by the Top 5 page, and return the path.
+
+    Every player is written once, identified by their FIDE id, the name is only the label of the
+    bar. Each month holds the indexes of its top players and their ratings in ranking order:
+        {"dates": ["2020-01", ...], "ids": [...], "names": [...], "feds": [...],
+         "top": [[3, 0, 7, ...], ...], "ratings": [[2830, 2790, ...], ...]}
+    """
+    query = """SELECT *
+            FROM top_10_open_players_over_time_view
+           ;
+            """
+    df = load_data(query, engine)
+    df["date"] = pd.to_datetime(df["ongoing_date"]).dt.strftime("%Y-%m")
+
+    # One entry per player (two players may share a name), with the name and the federation of
+    # their latest month
+    df['id'] = df['id'].astype('str')
+    players = df.drop_duplicates('id', keep='last').reset_index(drop=True)
+    index = {player_id: i for i, player_id in enumerate(players['id'])}
+
+    payload = {'dates': [], 'ids': players['id'].tolist(), 'names': players['name'].tolist(),
+               'feds': players['fed'].tolist(), 'top': [], 'ratings': []}
+    # The view is ordered by date and rank
+    for date, month in df.groupby('date', sort=True):
+        payload['dates'].append(date)
+        payload['top'].append([index[player_id] for player_id in month['id']])
+        payload['ratings'].append([int(rating) for rating in month['rating']])
+
+    os.makedirs(folder, exist_ok=True)
+    payload_path = os.path.join(folder, "top_players_over_time.json")
+    with open(payload_path, 'w') as file:
+        json.dump(payload, file, separators=(',', ':'))
+    print(f'The rankings of {len(payload["dates"])} months have been saved into {payload_path}')
+    return payload_path
+
+###################################################
+# Stages
+###################################################
+
+# Each stage reads the artifact of its upstream stage from the checkpoint folder of the month,
+# so a stage can be rerun alone, and returns (outputs, output_hash).
+
+def parse_stage(context, upstream):
+    top_players = prepare_top_players(context['txt_file_path'], top_k=context['top_k'])
+    top_players_path = os.path.join(context['checkpoint_dir'], 'top_players.pkl')
+    # Pickle keeps the dtypes of the frame (no parquet engine works with the pinned numpy)
+    top_players.to_pickle(top_players_path)
+    return {'top_players': top_players_path}, frame_hash(top_players)
+
+def validate_stage(context, upstream):
+    print("Checking the data...")
+    # Check every column against the schema, abort before any write if a rule fails
+    top_players = pd.read_pickle(upstream['outputs']['top_players'])
+    validate_top_players(top_players, context['engine'])
+    return upstream['outputs'], upstream['output_hash']
+
+def load_stage(context, upstream):
+    top_players = pd.read_pickle(upstream['outputs']['top_players'])
+    row_counts = load_top_players(top_players, context['engine'], replace_month=context['force'])
+    context['row_counts'].update(row_counts)
+    return {}, upstream['output_hash']
+
+def csv_stage(context, upstream):
+    top_players = pd.read_pickle(upstream['outputs']['top_players'])
+    top_players_path = save_top_players(top_players, context['source_dir'])
+    return {'csv': top_players_path}, upstream['output_hash']
+
+def race_stage(context, upstream):
+    payload_path = save_bar_chart_race_payload(context['engine'])
+    return {'race': payload_path}, upstream['output_hash']
+
+def video_stage(context, upstream):
+    video_path = render_bar_chart_race(context['engine'])
+    return {'video': video_path}, upstream['output_hash']
+
+# Stages in running order with their upstream stage, the input of parse is the FIDE list itself
+STAGES = {
+    'parse': (None, parse_stage),
+    'validate': ('parse', validate_stage),
+    'load': ('validate', load_stage),
+    'csv': ('parse', csv_stage),
+    'race': ('load', race_stage),
+    'video': ('load', video_stage),
+}
+
+def run_stage(name, context, force=False):
+    """
+    Run one stage unless its last run had the same input hash and its outputs still exist.
+
+    Parameters:
+        name (str): Name of the stage, a key of STAGES.
+        context (dict): txt_file_path, top_k, source_dir, checkpoint_dir, engine, force and row_counts
+            of the run.
+        force (bool): Run the stage even if it is up to date.
+
+    Returns:
+        dict: The manifest of the stage.
+    """
+    upstream_name, stage = STAGES[name]
+    checkpoint_dir = context['checkpoint_dir']
+    if upstream_name is None:
+        upstream = None
+        input_hash = f"{file_hash(context['txt_file_path'])}:{context['top_k']}"
+    else:
+        upstream = read_manifest(checkpoint_dir, upstream_name)
+        if upstream is None:
+            raise RuntimeError(f"The stage '{name}' needs the output of '{upstream_name}', run it first.")
+        input_hash = upstream['output_hash']
+
+    manifest = read_manifest(checkpoint_dir, name)
+    if (not force and manifest is not None and manifest['input_hash'] == input_hash
+            and all(os.path.exists(path) for path in manifest['outputs'].values())):
+        print(f"Stage '{name}' is up to date, skipped")
+        return manifest
+
+    print(f"Running stage '{name}'")
+    outputs, output_hash = stage(context, upstream)
+    return write_manifest(checkpoint_dir, name, input_hash, outputs, output_hash)
+
+###################################################
+# Monthly update
+###################################################
+
+def run(month=None, source_dir="current_month", top_k=TOP_PLAYERS_PER_FED, stage=None, force=False,
+        checkpoint_dir=CHECKPOINT_DIR, skip_video=False):
+    """
+    Run the monthly update: read and clean the FIDE list, validate it, load it into the database,
+    save the CSV file and the rankings of the bar chart race and render its video. Every stage is
+    checkpointed under checkpoint_dir/<month>, a rerun skips the stages whose input did not change.
+
+    Each run is recorded in the 'etl_runs' table. A list already loaded with the same content is not
+    loaded again, unless force is set: the month is then replaced by the content of the list.
+
+    Parameters:
+        month (str): Month of the FIDE list to load ('YYYY-MM'), the only list of source_dir by default.
+        source_dir (str): Folder holding the FIDE list, open.csv is saved there too.
+        top_k (int): Number of players kept per federation.
+        stage (str): Run only this stage (a key of STAGES) from the checkpoints of its upstream stage.
+        force (bool): Load the list again and rerun the stages even if they are up to date.
+        checkpoint_dir (str): Folder of the checkpoints.
+        skip_video (bool): Do not render the video of the bar chart race, the page animates the rankings.
+    """
+    engine = create_engine(get_connection_url())
+
+    txt_file_path = find_fide_list(source_dir, month)
+    print(txt_file_path)
+    source_hash = file_hash(txt_file_path)
+    list_month = fide_list_month(txt_file_path)
+
+    if stage is None and not force:
+        ingested = get_ingested_run(engine, source_hash, top_k)
+        if ingested is not None:
+            print(f"The FIDE list of {ingested['snapshot_date']} was already loaded by run {ingested['id']} "
+                  f"on {ingested['finished_at']:%Y-%m-%d %H:%M}, nothing to do (force to load it again)")
+            return
+
+    context = {
+        'txt_file_path': txt_file_path,
+        'top_k': top_k,
+        'source_dir': source_dir,
+        'checkpoint_dir': os.path.join(checkpoint_dir, list_month),
+        'engine': engine,
+        'force': force,
+        'row_counts': {},
+    }
+    os.makedirs(context['checkpoint_dir'], exist_ok=True)
+
+    stages = [stage] if stage else [name for name in STAGES if not (skip_video and name == 'video')]
+    run_id = start_etl_run(engine, txt_file_path, source_hash, f'{list_month}-01', top_k, forced=force)
+    stage_durations = {}
+    try:
+        for name in stages:
+            start = time.perf_counter()
+            run_stage(name, context, force=force)
+            stage_durations[name] = time.perf_counter() - start
+    except Exception:
+        finish_etl_run(engine, run_id, 'failed', stage_durations, context['row_counts'])
+        raise
+    finish_etl_run(engine, run_id, 'succeeded', stage_durations, context['row_counts'])
+
+###################################################
+# Backfill
+###################################################
+
+def backfill(source_dir, top_k=TOP_PLAYERS_PER_FED, workers=None, since=None, until=None, force=False):
+    """
+    Load every FIDE list of a folder, e.g. the 60 lists of the last 5 years to rebuild the database.
+    The lists are read and cleaned in parallel processes and loaded one after the other in date
+    order as soon as they are ready. Every load is recorded in the 'etl_runs' table and the lists
+    already loaded with the same content are skipped, so a backfill stopped by a list that breaks
+    the validation rules can be run again once the list is fixed.
+
+    Parameters:
+        source_dir (str): Folder holding the FIDE lists (.txt or .zip files), one per month.
+        top_k (int): Number of players kept per federation.
+        workers (int): Number of processes reading the lists, the number of CPUs by default.
+        since (str): First month to load ('YYYY-MM'), the oldest list by default.
+        until (str): Last month to load ('YYYY-MM'), the latest list by default.
+        force (bool): Load the lists already loaded again, replacing their months.
+    """
+    fide_lists = [(month, path) for month, path in find_fide_lists(source_dir)
+                  if (since is None or month >= since) and (until is None or month <= until)]
+    if not fide_lists:
+        raise FileNotFoundError(f"No FIDE list between {since or 'the start'} and {until or 'the end'} in '{source_dir}'")
+
+    engine = create_engine(get_connection_url())
+    hashes = {path: file_hash(path) for _, path in fide_lists}
+    if not force:
+        fide_lists = [(month, path) for month, path in fide_lists
+                      if get_ingested_run(engine, hashes[path], top_k) is None]
+        if not fide_lists:
+            print('All the FIDE lists were already loaded, nothing to do')
+            return
+    print(f'{len(fide_lists)} FIDE lists to load, from {fide_lists[0][0]} to {fide_lists[-1][0]}')
+    # The workers must not inherit the connections of the pool
+    engine.dispose()
+
+    paths = [path for _, path in fide_lists]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # map keeps the order of the lists, so each month is loaded after the previous ones
+        # while the next lists are still being read
+        months = pool.map(prepare_top_players, paths, repeat(top_k))
+        for (month, path), top_players in zip(fide_lists, months):
+            run_id = start_etl_run(engine, path, hashes[path], f'{month}-01', top_k, forced=force)
+            stage_durations, row_counts = {}, {}
+            try:
+                start = time.perf_counter()
+                validate_top_players(top_players, engine)
+                stage_durations['validate'] = time.perf_counter() - start
+                start = time.perf_counter()
+                row_counts = load_top_players(top_players, engine, update_metadata=False, replace_month=force)
+                stage_durations['load'] = time.perf_counter() - start
+            except Exception:
+                finish_etl_run(engine, run_id, 'failed', stage_durations, row_counts)
+                raise
+            finish_etl_run(engine, run_id, 'succeeded', stage_durations, row_counts)
+            print(f'The FIDE list of {month} has been loaded')
+
+    update_dataset_metadata(engine)
+
+###################################################
+# Bar chart race video
+###################################################
+
+def render_video(folder="bar_chart_race_video", workers=None):
+    """
+    Render the video of the bar chart race from the database, apart from the monthly update (which
+    only saves the rankings animated by the Top 5 page). It needs ffmpeg.
+
+    Parameters:
+        folder (str): Folder of the video.
+        workers (int): Number of processes rendering the segments, the number of CPUs by default.
+    """
+    engine = create_engine(get_connection_url())
+    return render_bar_chart_race(engine, folder, workers=workers)
+
+###################################################
+# Rebuild the players with age group table
+###################################################
+
+def rebuild_age_groups():
+    """
+    Rebuild the whole players-with-age-group table, e.g. after birth years were corrected in
+    'players', and bump the dataset version so the app refreshes its cache.
+    """
+    engine = create_engine(get_connection_url())
+    rebuild_players_with_age_group(engine)
+    update_dataset_metadata(engine)
+
+if __name__ == "__main__":
+    run()
 
 # #########################################################
 # # Delete Data
@@ -206,9 +623,3 @@ print('The animation has been generated')
 
 # delete_data(table_name='montlhyupdates', where_condition="ongoing_date='2025-03-01'")
 # delete_data(table_name='players', where_condition="id in ('00000001', '00000002','0000003','0000004')")
-
-# ###################################################
-# # refresh the materialized views
-# ###################################################
-
-# refresh_materialized_view("montlhyupdate_open_players_with_age_group_mv", engine)
\ No newline at end of file
@@ -1,9 +1,14 @@
 import pandas as pd
-import streamlit as st
-from sqlalchemy import create_engine, select, Table, MetaData, text
+import numpy as np
+from sqlalchemy import create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
 #import zipfile
+import io
 import os
+import json
+import hashlib
+import re
+from collections import Counter
 from datetime import datetime
 import warnings
 #from utils_pages import get_connection_url
@@ -31,12 +36,12 @@ def get_connection_url() -> str:
     
     return connection_string       
 
-@st.cache_data
-def load_data(query: str) -> pd.DataFrame:
+def load_data(query: str, engine=None) -> pd.DataFrame:
     """
-    Test the connection to the database, then execute a SQL query and return the results as a pandas DataFrame.
+    Execute a SQL query and return the results as a pandas DataFrame.
     Args:
         query (str): The SQL query to execute.
+        engine: The SQLAlchemy engine to use, a new one connected with get_connection_url() by default.
     Returns:
         pd.DataFrame: Query results as a DataFrame.
     Raises:
@@ -44,11 +49,11 @@ def load_data(query: str) -> pd.DataFrame:
     """
     try:
         # Create the engine and execute the query
-        engine = create_engine(get_connection_url())
+        engine = engine or create_engine(get_connection_url())
         with engine.connect() as conn:
             print("Connection successful!")
             # Execute the query
-            df = pd.read_sql_query(query, conn)
+            df = pd.read_sql_query(text(query), conn)
             
             if 'date' in df.columns:
                 df["date"] = pd.to_datetime(df["date"])
@@ -72,95 +77,270 @@ def load_data(query: str) -> pd.DataFrame:
 # Check integrity dataset loaded
 ###################################################
 
-def is_null(df,column):
-    # Check if a column contains null values
-    total_null_values = df[column].isnull().sum()
-    if total_null_values > 0:
-        print(f'Atention!!!! The column {column} contains {total_null_values} null values')
-        return True
-    else:
-        print(f'The column {column} does not contain null values')
-        return False            
+# Rules of each column of the top players frame:
+# - not_null: no missing value (True by default)
+# - numeric: every value is a number
+# - no_numbers: no value contains a digit
+# - min_length / max_length: bounds of the length of the values written as text
+# - regex: every value matches the pattern
+# - allowed: name of the set of allowed values passed to validate_frame
+TOP_PLAYERS_SCHEMA = {
+    'ID': {'numeric': True, 'min_length': 6, 'max_length': 9},
+    'Name': {'no_numbers': True},
+    'Fed': {'no_numbers': True, 'min_length': 3, 'max_length': 3, 'allowed': 'country_codes'},
+    'Sex': {'no_numbers': True, 'min_length': 1, 'max_length': 1},
+    'Title': {'no_numbers': True, 'min_length': 2, 'max_length': 3},
+    'Number_of_games': {'numeric': True, 'min_length': 1, 'max_length': 2},
+    'B-day': {'numeric': True, 'min_length': 4, 'max_length': 4},
+    'activity_status': {'no_numbers': True, 'min_length': 1, 'max_length': 1},
+    'Rating': {'numeric': True, 'min_length': 4, 'max_length': 4},
+}
 
-# Function to check if a column contains only numeric values
-def is_numeric_column(df,column):
-    try:
-        pd.to_numeric(df[column])
-        print(f'The column {column} is numeric')
-        return True
-        
-    except ValueError:
-        print(f'The column {column} contains not numeric values')
-        return False
-        
-def max_and_min_length(df, column):
-    # Get the maximum and minimum length of the columns
-    lengths = df[column].astype('str').str.len()
-    max_length = lengths.max()
-    min_length = lengths.min()    
-    print(f'The minimum and maximum length of column {column} is {min_length} and {max_length} respectively')
-    
-    return min_length, max_length
+# Share of the rows allowed to break a rule before the load is aborted. Keys are
+# 'column.rule' or 'rule', the default applies to the other rules.
+DEFAULT_MAX_VIOLATION_RATE = 0.01
+VALIDATION_THRESHOLDS = {
+    'Name.not_null': 0.05,  # Names clean_names cannot parse are left empty
+    'Fed.allowed': 0.05,  # New federations are added to 'countries' by hand
+}
+# Number of offending rows shown per rule in the report
+VALIDATION_SAMPLES = 5
 
-# Function to check if a column does not contain numeric values or alphanumeric strings
-def contains_numeric_values(df,column):
-    if df[column].astype('str').str.contains(r'\d').any():
-        print(f'The column {column} contains numeric values')
-        return True
-    else:
-        print(f'The column {column} does not contain numeric values')
-        return False
+def as_text(series):
+    """
+    Write the values of a column as text, whole numbers stored as floats without decimals.
+    """
+    if pd.api.types.is_float_dtype(series) and (series.dropna() == series.dropna().round()).all():
+        series = series.astype('Int64')
+    return series.astype('string')
 
-def check_column(df, column_name, is_numeric=False, contains_no_numbers=False, min_length=None, max_length=None):
+def validate_frame(df, schema, allowed_values=None, thresholds=None, default_threshold=DEFAULT_MAX_VIOLATION_RATE):
     """
-    General function to check and validate a column in a DataFrame.
-    
+    Check a DataFrame against a schema in one vectorized pass over each column.
+
     Parameters:
         df (pd.DataFrame): The DataFrame to check.
-        column_name (str): The name of the column to validate.
-        is_numeric (bool): If True, check if the column contains only numeric values.
-        contains_no_numbers (bool): If True, check if the column does not contain numeric values.
-        min_length (int): Minimum allowed length of values in the column.
-        max_length (int): Maximum allowed length of values in the column.
-    """
-    # Check for null values
-    null_check = is_null(df, column_name)
-    if null_check:
-    #    df.dropna(subset=[column_name], inplace=True)
-        print(f"**Handle null values in column {column_name}")
-    # Check if the column should contain only numeric values
-    if is_numeric:
-        numeric_check = is_numeric_column(df, column_name)
-        if not numeric_check:
-            print(f"**Verify values in column {column_name}: not all are numeric.")
-    
-    # Check if the column should not contain numeric values
-    if contains_no_numbers:
-        contains_numeric_values_check = contains_numeric_values(df, column_name)
-        if contains_numeric_values_check:
-            print(f"**Verify values in column {column_name}: contains numeric values.")
-    
-    # Check for length constraints
-    if min_length is not None or max_length is not None:
-        min_length_val, max_length_val = max_and_min_length(df, column_name)
-        if min_length is not None and min_length_val < min_length:
-            print(f"**Verify values in column {column_name}: minimum length is below {min_length}.")
-        if max_length is not None and max_length_val > max_length:
-            print(f"**Verify values in column {column_name}: maximum length exceeds {max_length}.")
-            
-def check_country_code(df):
-    query = """
-    SELECT distinct  c.code
-    FROM countries c
-    """
-    df_historic_fed = load_data(query)
-    historic_fed_list = df_historic_fed['code'].to_list()
-    check_codes = df[~df['Fed'].isin(historic_fed_list)]['Fed'].unique()
-    if len(check_codes) > 0:
-        print(f'** The following country codes are not in the database country codes list: {check_codes}')
-    else:
-        print('All country codes are in the database country codes list')
-        
+        schema (dict): The rules of each column, see TOP_PLAYERS_SCHEMA.
+        allowed_values (dict): The sets of values referenced by the 'allowed' rules.
+        thresholds (dict): Share of the rows allowed to break a rule, by 'column.rule' or 'rule'.
+        default_threshold (float): Share of the rows allowed to break the other rules.
+
+    Returns:
+        pd.DataFrame: One row per rule with the column, the rule, the number and share of violations,
+            the threshold, whether it failed and a sample of the offending values (index: value).
+    """
+    allowed_values = allowed_values or {}
+    thresholds = VALIDATION_THRESHOLDS if thresholds is None else thresholds
+    report = []
+
+    for column, rules in schema.items():
+        values = df[column]
+        present = values.notna()
+        text_values = as_text(values)
+        masks = {}
+
+        if rules.get('not_null', True):
+            masks['not_null'] = ~present
+        if rules.get('numeric'):
+            masks['numeric'] = present & pd.to_numeric(values, errors='coerce').isna()
+        if rules.get('no_numbers'):
+            masks['no_numbers'] = present & text_values.str.contains(r'\d', na=False)
+        if 'min_length' in rules or 'max_length' in rules:
+            lengths = text_values.str.len()
+            if 'min_length' in rules:
+                masks['min_length'] = present & (lengths < rules['min_length'])
+            if 'max_length' in rules:
+                masks['max_length'] = present & (lengths > rules['max_length'])
+        if 'regex' in rules:
+            masks['regex'] = present & ~text_values.str.fullmatch(rules['regex'], na=False)
+        if 'allowed' in rules:
+            masks['allowed'] = present & ~values.isin(allowed_values.get(rules['allowed'], ()))
+
+        for rule, mask in masks.items():
+            violations = int(mask.sum())
+            rate = violations / len(df) if len(df) else 0.0
+            threshold = thresholds.get(f'{column}.{rule}', thresholds.get(rule, default_threshold))
+            report.append({
+                'column': column,
+                'rule': rule,
+                'violations': violations,
+                'rate': round(rate, 4),
+                'threshold': threshold,
+                'failed': rate > threshold,
+                'samples': values[mask].head(VALIDATION_SAMPLES).to_dict(),
+            })
+
+    return pd.DataFrame(report)
+
+def get_country_codes(engine):
+    """
+    Return the set of the country codes of the 'countries' table.
+
+    Parameters:
+        engine: The SQLAlchemy engine connected to the PostgreSQL database.
+    """
+    with engine.connect() as connection:
+        return set(connection.execute(text("SELECT DISTINCT code FROM countries;")).scalars())
+
+def validate_top_players(df, engine, thresholds=None):
+    """
+    Check the top players frame against TOP_PLAYERS_SCHEMA and print the report. Raise before anything
+    is written to the database when a rule is broken by more rows than its threshold allows.
+
+    Parameters:
+        df (pd.DataFrame): The cleaned top players.
+        engine: The SQLAlchemy engine connected to the PostgreSQL database.
+        thresholds (dict): Share of the rows allowed to break a rule, VALIDATION_THRESHOLDS by default.
+
+    Returns:
+        pd.DataFrame: The validation report.
+
+    Raises:
+        ValueError: If a rule fails.
+    """
+    report = validate_frame(df, TOP_PLAYERS_SCHEMA,
+                            allowed_values={'country_codes': get_country_codes(engine)},
+                            thresholds=thresholds)
+    print(report[report['violations'] > 0].to_string(index=False) if report['violations'].any()
+          else 'All the rules are respected')
+
+    failed = report[report['failed']]
+    if not failed.empty:
+        rules = ", ".join(f"{row.column}.{row.rule} ({row.violations} rows)" for row in failed.itertuples())
+        raise ValueError(f"The data breaks the following rules, nothing was loaded: {rules}")
+    return report
+
+###################################################
+# Read the FIDE list
+###################################################
+
+# Widths of the columns of the FIDE fixed-width list
+FIDE_LIST_WIDTHS = [15, 61, 4, 3, 6, 4, 15, 5, 6, 4, 3, 5, 7]
+# Number of players kept per federation
+TOP_PLAYERS_PER_FED = 100
+# Number of lines of the list parsed at a time
+FIDE_LIST_CHUNK_SIZE = 100_000
+
+# Extensions of the FIDE lists, plain or zipped as downloaded from the FIDE website
+FIDE_LIST_EXTENSIONS = ('.txt', '.zip')
+
+def fide_list_compression(txt_file_path):
+    """
+    Return the compression of a FIDE list for pd.read_fwf, which does not infer zip archives.
+    """
+    return 'zip' if txt_file_path.endswith('.zip') else None
+
+def fide_list_month(txt_file_path):
+    """
+    Return the month of a FIDE list ('YYYY-MM'), read from the name of its rating column (e.g. 'OCT25').
+    """
+    header = pd.read_fwf(txt_file_path, widths=FIDE_LIST_WIDTHS, nrows=0,
+                         compression=fide_list_compression(txt_file_path)).columns
+    rating_column = [item for item in header if re.search(r'\d', item)][0]
+    return datetime.strptime(rating_column[:3] + rating_column[-2:], '%b%y').strftime('%Y-%m')
+
+def find_fide_list(source_dir, month=None):
+    """
+    Return the path of the FIDE list of a month in source_dir.
+
+    Parameters:
+        source_dir (str): Folder holding the FIDE lists (.txt or .zip files).
+        month (str): The month of the list ('YYYY-MM'), the first list of the folder by default.
+
+    Raises:
+        FileNotFoundError: If there is no list (of that month) in the folder.
+    """
+    paths = sorted(os.path.join(source_dir, f) for f in os.listdir(source_dir) if f.endswith(FIDE_LIST_EXTENSIONS))
+    if month is not None:
+        paths = [path for path in paths if fide_list_month(path) == month]
+    if not paths:
+        raise FileNotFoundError(f"No FIDE list{' of ' + month if month else ''} found in '{source_dir}'")
+    return paths[0]
+
+def find_fide_lists(source_dir):
+    """
+    Return the paths of all the FIDE lists of source_dir sorted by month, as (month, path) pairs.
+
+    Raises:
+        FileNotFoundError: If there is no list in the folder.
+        ValueError: If two lists are of the same month.
+    """
+    paths = [os.path.join(source_dir, f) for f in os.listdir(source_dir) if f.endswith(FIDE_LIST_EXTENSIONS)]
+    if not paths:
+        raise FileNotFoundError(f"No FIDE list found in '{source_dir}'")
+    lists = sorted((fide_list_month(path), path) for path in paths)
+    months = Counter(month for month, _ in lists)
+    duplicated = sorted(month for month, count in months.items() if count > 1)
+    if duplicated:
+        raise ValueError(f"Several FIDE lists of the same month in '{source_dir}': {', '.join(duplicated)}")
+    return lists
+
+def median_from_counts(counts):
+    """
+    Return the median of the values counted in a Counter, as pandas computes it (mean of the two
+    middle values when the number of values is even).
+    """
+    values = sorted(counts)
+    n = sum(counts.values())
+    if n == 0:
+        return np.nan
+    middle = [(n - 1) // 2, n // 2]
+    found, seen = [], 0
+    for value in values:
+        seen += counts[value]
+        while len(found) < 2 and middle[len(found)] < seen:
+            found.append(value)
+    return np.float64((found[0] + found[1]) / 2)
+
+def read_top_players(txt_file_path, top_k=TOP_PLAYERS_PER_FED, chunksize=FIDE_LIST_CHUNK_SIZE):
+    """
+    Read the FIDE fixed-width list chunk by chunk and keep the `top_k` highest rated players of each
+    federation, so the memory used does not depend on the size of the file. Only the needed columns
+    are parsed.
+
+    The result is the same frame as reading the whole file with pd.read_fwf, sorting it by
+    ['Fed', 'Rating'] (rating descending) and taking groupby('Fed').head(top_k): same rows, order,
+    index and dtypes.
+
+    Parameters:
+        txt_file_path (str): Path of the FIDE list, plain or zipped.
+        top_k (int): Number of players kept per federation.
+        chunksize (int): Number of lines parsed at a time.
+
+    Returns:
+        tuple: The top players with the columns ID, Name, Fed, Sex, Title, Number_of_games, B-day,
+            activity_status and Rating, the list of the rating column names of the file (e.g. ['OCT25'])
+            and the median of the B-day column over the whole file.
+    """
+    compression = fide_list_compression(txt_file_path)
+    header = pd.read_fwf(txt_file_path, widths=FIDE_LIST_WIDTHS, nrows=0, compression=compression).columns
+    rating_column = [item for item in header if re.search(r'\d', item)]
+    columns_to_get = ['ID Number','Name','Fed','Sex','Tit','Gms','B-day','Flag'] + rating_column
+    rating = rating_column[0]
+
+    top_players = None
+    dtypes = {}
+    birth_years = Counter()
+    chunks = pd.read_fwf(txt_file_path, widths=FIDE_LIST_WIDTHS, dtype={'ID Number': str},
+                         usecols=columns_to_get, chunksize=chunksize, compression=compression)
+    for chunk in chunks:
+        chunk = chunk[columns_to_get]
+        # Dtype a single read of the whole file would have inferred
+        for column, dtype in chunk.dtypes.items():
+            dtypes[column] = np.result_type(dtypes[column], dtype) if column in dtypes else dtype
+        birth_years.update(chunk['B-day'].dropna().tolist())
+
+        # The kept rows come before the chunk in the file, so the sort (stable) keeps the order of
+        # the file between players with the same federation and rating
+        candidates = chunk if top_players is None else pd.concat([top_players, chunk])
+        top_players = (candidates.sort_values(['Fed', rating], ascending=[True, False])
+                       .groupby('Fed').head(top_k))
+
+    top_players = top_players.astype(dtypes)
+    top_players = top_players.rename(columns={"ID Number": "ID", "Tit": "Title","Gms":"Number_of_games",
+                                              "Flag":"activity_status", rating:'Rating'})
+    return top_players, rating_column, median_from_counts(birth_years)
+
 ###################################################
 # Preprocessing data
 ###################################################
@@ -290,13 +470,59 @@ def replace_wrongcountry_code_with_right_country_code(df):
 # Load data into the dataset
 ###################################################
 
+def copy_to_staging(connection, df, target_table):
+    """
+    Stream a DataFrame into a temporary staging table with COPY. The staging table has the columns
+    of the DataFrame, typed as in `target_table` but without its constraints (a NOT NULL column
+    of the target that the DataFrame does not fill must not fail the COPY), and a staging_row
+    column numbering the rows in the order of the DataFrame. It is dropped at the end of the
+    transaction.
+
+    Parameters:
+        connection: A SQLAlchemy connection inside a transaction (engine.begin()).
+        df (pd.DataFrame): The rows to stage, its columns named as the columns of the target table.
+        target_table (str): The table the staging table copies the column types from.
+
+    Returns:
+        str: The name of the staging table.
+    """
+    staging_table = f"staging_{target_table}"
+    columns = ", ".join(df.columns)
+    connection.execute(text(f"""
+        CREATE TEMP TABLE {staging_table} ON COMMIT DROP AS
+        SELECT {columns} FROM {target_table} WITH NO DATA;
+    """))
+    # Filled in the order of the rows by COPY
+    connection.execute(text(f"ALTER TABLE {staging_table} ADD COLUMN staging_row BIGSERIAL;"))
+
+    # Whole numbers stored as floats (because of missing values) are written without decimals,
+    # so COPY can parse them into integer columns
+    df = df.copy()
+    for column in df.select_dtypes('float').columns:
+        values = df[column].dropna()
+        if (values == values.round()).all():
+            df[column] = df[column].astype('Int64')
+
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    cursor.copy_expert(f"COPY {staging_table} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+    print(f"{cursor.rowcount} rows copied into the '{staging_table}' staging table.")
+    return staging_table
+
 def update_players_table_sqlalchemy(df, engine):
     """
-    Update the 'players' table with new rows from the DataFrame using SQLAlchemy.
+    Add the new players of the DataFrame to the 'players' table. The rows are copied into a staging
+    table and the players already known are skipped by the database (ON CONFLICT DO NOTHING), so the
+    existing ids are never read into Python.
 
     Parameters:
         df (pd.DataFrame): The DataFrame containing the data to insert.
         engine: The SQLAlchemy engine connected to the PostgreSQL database.
+
+    Returns:
+        dict: The number of players added.
     """
     # Select relevant columns from the DataFrame
     print("Renaming and selecting relevant columns from the DataFrame...")
@@ -304,53 +530,36 @@ def update_players_table_sqlalchemy(df, engine):
         columns={'ID': 'id', 'Name': 'name', 'Sex': 'sex', 'B-day': 'b_day'}
     )
 
-    # Initialize metadata
-    print("Initializing metadata and reflecting database schema...")
-    metadata = MetaData()
-    metadata.reflect(bind=engine)
-
-    # Access the 'players' table
-    print("Accessing the 'players' table...")
-    players_table = Table('players', metadata, autoload_with=engine)
-
-    # Start a session
-    with engine.connect() as connection:
-        print("Querying existing IDs in the 'players' table...")
-        # Query existing IDs in the 'players' table
-        existing_ids = connection.execute(select(players_table.c.id)).fetchall()
-        #existing_ids = [i[0] for i in existing_ids]
-        existing_ids = {row[0] for row in existing_ids}  # Convert to set
-        print(f"Converted existing IDs to set...")
-
-        # Filter DataFrame to only include new IDs
-        print("Filtering DataFrame to exclude existing IDs...")
-        new_rows = player_data[~player_data['id'].isin(existing_ids)]
-        print(f"Filtered rows to insert: {len(new_rows)}")
-
-        # Prepare rows to insert
-        rows_to_insert = new_rows.to_dict(orient='records')
-        print(f"Prepared rows for insertion...")
-        
-        # Insert new rows into the table
-        if rows_to_insert:
-            
-            try:
-                print("Inserting new rows into the 'players' table...")
-                with engine.begin() as connection:
-                    connection.execute(players_table.insert(), rows_to_insert)
-                    print(f"{len(rows_to_insert)} rows added to the 'players' table.")
-            except Exception as e:
-                print(f"Error inserting rows: {e}")            
-        else:
-            print("No new rows to add to the 'players' table.")             
+    try:
+        with engine.begin() as connection:
+            staging_table = copy_to_staging(connection, player_data, 'players')
+            print("Inserting new rows into the 'players' table...")
+            result = connection.execute(text(f"""
+                INSERT INTO players (id, name, sex, b_day)
+                SELECT id, name, sex, b_day
+                FROM {staging_table}
+                ON CONFLICT (id) DO NOTHING;
+            """))
+            print(f"{result.rowcount} rows added to the 'players' table.")
+    except SQLAlchemyError as e:
+        print(f"Error inserting rows: {e}")
+        raise
+    return {'players_added': result.rowcount}
             
-def update_montlhyupdates_table_sqlalchemy(df, engine):
+def update_montlhyupdates_table_sqlalchemy(df, engine, replace_month=False):
     """
-    Update the 'montlhyupdates' table with new rows or update existing rows from the DataFrame.
+    Insert the rows of the DataFrame into the 'montlhyupdates' table, or update the existing rows
+    (same id and ongoing_date) whose values changed. The rows are copied into a staging table and
+    matched by the database on the primary key, so the time does not depend on the history loaded.
 
     Parameters:
         df (pd.DataFrame): The DataFrame containing the data to update or insert.
         engine: The SQLAlchemy engine connected to the PostgreSQL database.
+        replace_month (bool): Also delete the rows of the months of the DataFrame that are not in it,
+            so those months hold exactly the DataFrame. The other months are not touched.
+
+    Returns:
+        dict: The number of rows added, updated and deleted.
     """
     # Select relevant columns from the DataFrame
     print("Renaming and selecting relevant columns from the DataFrame...")
@@ -365,44 +574,130 @@ def update_montlhyupdates_table_sqlalchemy(df, engine):
             'Date': 'ongoing_date'
         }
     )
-    # Initialize metadata
-    print("Initializing metadata and reflecting database schema...")
-    metadata = MetaData()
-    metadata.reflect(bind=engine)
 
-    # Access the 'montlhyupdates' table
-    print("Accessing the 'montlhyupdates' table...")
-    montlhyupdates_table = Table('montlhyupdates', metadata, autoload_with=engine)
-
-    # Start a session
-    with engine.connect() as connection:
-        # Fetch existing rows based on primary keys
-        print("Querying existing primary keys in the 'montlhyupdates' table...")
-        existing_rows = connection.execute(
-            select(montlhyupdates_table.c.id, montlhyupdates_table.c.ongoing_date)
-)           .fetchall()
-        existing_keys = {(row[0], row[1]) for row in existing_rows}
-        # Split rows into new and existing
-        new_rows = month_data[~month_data.apply(
-            lambda row: (row['id'], row['ongoing_date']) in existing_keys, axis=1
-        )]
-        existing_rows = month_data[month_data.apply(
-            lambda row: (row['id'], row['ongoing_date']) in existing_keys, axis=1
-        )]
-        # Insert new rows
-        if not new_rows.empty:
-            print(f"Prepared rows for insertion...")
-            rows_to_insert = new_rows.to_dict(orient='records')            
-            try:
-                print("Inserting new rows into the 'montlhyupdates' table...")
-                with engine.begin() as connection:
-                    connection.execute(montlhyupdates_table.insert(), rows_to_insert)
-                    print(f"{len(rows_to_insert)} rows added to the 'montlhyupdates' table.")
-            except Exception as e:
-                print(f"Error inserting rows: {e}")                      
-        else:
-            print("No new rows to add to the 'montlhyupdates' table.")     
+    try:
+        with engine.begin() as connection:
+            staging_table = copy_to_staging(connection, month_data, 'montlhyupdates')
+            deleted = 0
+            if replace_month:
+                result = connection.execute(text(f"""
+                    DELETE FROM montlhyupdates mu
+                    WHERE mu.ongoing_date IN (SELECT DISTINCT ongoing_date FROM {staging_table})
+                    AND NOT EXISTS (SELECT 1 FROM {staging_table} s
+                                    WHERE s.id = mu.id AND s.ongoing_date = mu.ongoing_date);
+                """))
+                deleted = result.rowcount
+                print(f"{deleted} rows no longer in the month deleted from the 'montlhyupdates' table.")
+            # Rows of keys not loaded yet, the others are updates (xmax cannot tell them apart in
+            # the RETURNING of a partitioned table)
+            inserted = connection.execute(text(f"""
+                SELECT COUNT(*)
+                FROM (SELECT DISTINCT id, ongoing_date FROM {staging_table}) s
+                WHERE NOT EXISTS (SELECT 1 FROM montlhyupdates mu
+                                  WHERE mu.id = s.id AND mu.ongoing_date = s.ongoing_date);
+            """)).scalar()
+            print("Inserting or updating rows of the 'montlhyupdates' table...")
+            result = connection.execute(text(f"""
+                INSERT INTO montlhyupdates (id, fed, title, number_of_games, activity_status, rating, ongoing_date)
+                SELECT DISTINCT ON (id, ongoing_date)
+                    id, fed, title, number_of_games, activity_status, rating, ongoing_date
+                FROM {staging_table}
+                -- A player listed twice in the month keeps their last row of the list
+                ORDER BY id, ongoing_date, staging_row DESC
+                ON CONFLICT (id, ongoing_date) DO UPDATE
+                SET fed = EXCLUDED.fed,
+                    title = EXCLUDED.title,
+                    number_of_games = EXCLUDED.number_of_games,
+                    activity_status = EXCLUDED.activity_status,
+                    rating = EXCLUDED.rating
+                WHERE (montlhyupdates.fed, montlhyupdates.title, montlhyupdates.number_of_games,
+                       montlhyupdates.activity_status, montlhyupdates.rating)
+                    IS DISTINCT FROM
+                      (EXCLUDED.fed, EXCLUDED.title, EXCLUDED.number_of_games,
+                       EXCLUDED.activity_status, EXCLUDED.rating);
+            """))
+            updated = result.rowcount - inserted
+            print(f"{inserted} rows added to and {updated} rows updated in the 'montlhyupdates' table.")
+    except SQLAlchemyError as e:
+        print(f"Error inserting rows: {e}")
+        raise
+    return {'montlhyupdates_added': inserted,
+            'montlhyupdates_updated': updated,
+            'montlhyupdates_deleted': deleted}
             
+###################################################
+# Partitions of montlhyupdates
+###################################################
+
+# Number of months kept in montlhyupdates, the app shows the last 5 years
+RETENTION_MONTHS = 60
+# Schema receiving the partitions that left the retention window
+ARCHIVE_SCHEMA = 'archive'
+
+def partition_name(month_start) -> str:
+    """
+    Return the name of the partition of 'montlhyupdates' holding a month, e.g. 'montlhyupdates_2025_03'.
+    """
+    return f"montlhyupdates_{month_start:%Y_%m}"
+
+def create_month_partitions(engine, ongoing_date, months_ahead=1):
+    """
+    Create the partitions of 'montlhyupdates' for the month of ongoing_date and the following
+    `months_ahead` months, if they do not exist yet. Each month is loaded into its own small partition.
+
+    Parameters:
+        engine: The SQLAlchemy engine connected to the PostgreSQL database.
+        ongoing_date: A date of the month being loaded.
+        months_ahead (int): Number of later months to create in advance.
+    """
+    first_month = pd.Timestamp(ongoing_date).to_period('M')
+    with engine.begin() as connection:
+        for month in pd.period_range(first_month, periods=months_ahead + 1, freq='M'):
+            start, end = month.start_time.date(), (month + 1).start_time.date()
+            connection.execute(text(f"""
+                CREATE TABLE IF NOT EXISTS {partition_name(start)}
+                PARTITION OF montlhyupdates
+                FOR VALUES FROM ('{start}') TO ('{end}');
+            """))
+            print(f"Partition '{partition_name(start)}' ready for [{start}, {end}).")
+
+def archive_old_partitions(engine, ongoing_date, retention_months=RETENTION_MONTHS):
+    """
+    Detach the partitions of 'montlhyupdates' older than the retention window and move them to the
+    archive schema, then delete the rows of those months from the tables derived from 'montlhyupdates'.
+    Dropping a whole partition replaces deleting its rows one by one.
+
+    Parameters:
+        engine: The SQLAlchemy engine connected to the PostgreSQL database.
+        ongoing_date: The latest month loaded.
+        retention_months (int): Number of months kept, the latest one included.
+    """
+    cutoff = (pd.Timestamp(ongoing_date).to_period('M') - (retention_months - 1)).start_time.date()
+    with engine.begin() as connection:
+        partitions = connection.execute(text("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'montlhyupdates'::regclass;
+        """)).scalars().all()
+
+        old_partitions = [name for name in partitions
+                          if datetime.strptime(name[-7:], "%Y_%m").date() < cutoff]
+        if not old_partitions:
+            print(f"No partition of 'montlhyupdates' older than {cutoff}.")
+            return
+
+        connection.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA};"))
+        for name in sorted(old_partitions):
+            connection.execute(text(f"ALTER TABLE montlhyupdates DETACH PARTITION {name};"))
+            connection.execute(text(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA};"))
+            print(f"Partition '{name}' detached and moved to the '{ARCHIVE_SCHEMA}' schema.")
+
+        for table in ('montlhyupdate_open_players_with_age_group', 'player_filter_cube', 'rating_sketch', 'leaderboard'):
+            result = connection.execute(text(f"DELETE FROM {table} WHERE ongoing_date < :cutoff;"),
+                                        {'cutoff': cutoff})
+            print(f"Deleted {result.rowcount} row(s) older than {cutoff} from {table}.")
+
 ###################################################
 # Refresh matrialized view
 ###################################################
@@ -427,6 +722,326 @@ def refresh_materialized_view(view_name, engine):
         except Exception as e:
             print(f"Failed to refresh materialized view '{view_name}': {e}")
             
+###################################################
+# Players with age group
+###################################################
+
+PLAYERS_WITH_AGE_GROUP_SELECT = """
+    SELECT 
+        mu.*,
+        EXTRACT(YEAR FROM mu.ongoing_date) - p.b_day AS age,
+        CASE 
+            WHEN EXTRACT(YEAR FROM mu.ongoing_date) - p.b_day <= 18 THEN 'Less than 19'
+            WHEN EXTRACT(YEAR FROM mu.ongoing_date) - p.b_day BETWEEN 19 AND 30 THEN '19-30'
+            WHEN EXTRACT(YEAR FROM mu.ongoing_date) - p.b_day BETWEEN 31 AND 40 THEN '31-40'
+            WHEN EXTRACT(YEAR FROM mu.ongoing_date) - p.b_day BETWEEN 41 AND 50 THEN '41-50'
+            WHEN EXTRACT(YEAR FROM mu.ongoing_date) - p.b_day BETWEEN 51 AND 65 THEN '51-65'
+            ELSE 'More than 66'
+        END AS age_category
+    FROM montlhyupdates mu
+    LEFT JOIN players p on mu.ID = p.ID
+"""
+
+def append_players_with_age_group(engine, ongoing_date):
+    """
+    Write the rows of one month into the 'montlhyupdate_open_players_with_age_group' table.
+    The age category only depends on the month and the birth year of the player, so the
+    months already loaded never change and only the new one is computed. The month is
+    replaced in a single transaction, so the dashboard keeps reading the table meanwhile.
+
+    Parameters:
+        engine: The SQLAlchemy engine connected to the PostgreSQL database.
+        ongoing_date: The month to write.
+    """
+    params = {'ongoing_date': ongoing_date}
+    with engine.begin() as connection:
+        connection.execute(text("""
+            DELETE FROM montlhyupdate_open_players_with_age_group WHERE ongoing_date = :ongoing_date;
+        """), params)
+        result = connection.execute(text(f"""
+            INSERT INTO montlhyupdate_open_players_with_age_group
+            {PLAYERS_WITH_AGE_GROUP_SELECT}
+            WHERE mu.ongoing_date = :ongoing_date;
+        """), params)
+        print(f"{result.rowcount} rows of {ongoing_date} written into the 'montlhyupdate_open_players_with_age_group' table.")
+
+def rebuild_players_with_age_group(engine):
+    """
+    Rebuild the whole 'montlhyupdate_open_players_with_age_group' table, e.g. after birth years
+    were corrected in 'players'. The new table is built next to the current one, which the
+    dashboard keeps reading, and replaces it with a rename at the end.
+
+    Parameters:
+        engine: The SQLAlchemy engine connected to the PostgreSQL database.
+    """
+    table = 'montlhyupdate_open_players_with_age_group'
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP TABLE IF EXISTS {table}_new;"))
+        connection.execute(text(f"CREATE TABLE {table}_new AS {PLAYERS_WITH_AGE_GROUP_SELECT};"))
+        connection.execute(text(f"CREATE INDEX idx_o_rating_new ON {table}_new (rating);"))
+        connection.execute(text(f"CREATE INDEX idx_o_ongoing_date_new ON {table}_new (ongoing_date);"))
+    print(f"Table '{table}_new' built, swapping it with '{table}'...")
+
+    # Only the renames take a lock on the table, for a moment
+    with engine.begin() as connection:
+        connection.execute(text(f"ALTER TABLE {table} RENAME TO {table}_old;"))
+        connection.execute(text("ALTER INDEX idx_o_rating RENAME TO idx_o_rating_old;"))
+        connection.execute(text("ALTER INDEX idx_o_ongoing_date RENAME TO idx_o_ongoing_date_old;"))
+        connection.execute(text(f"ALTER TABLE {table}_new RENAME TO {table};"))
+        connection.execute(text("ALTER INDEX idx_o_rating_new RENAME TO idx_o_rating;"))
+        connection.execute(text("ALTER INDEX idx_o_ongoing_date_new RENAME TO idx_o_ongoing_date;"))
+        connection.execute(text(f"DROP TABLE {table}_old;"))
+    print(f"Table '{table}' rebuilt successfully.")
+
+###################################################
+# Filter cube
+###################################################
+
+# Width of the rating buckets of player_filter_cube, it must match RATING_BUCKET_WIDTH in utils_pages
+RATING_BUCKET_WIDTH = 100
+
+FILTER_CUBE_SELECT = """
+    SELECT
+        muomv.ongoing_date,
+        muomv.fed,
+        c.continent,
+        p.sex,
+        muomv.activity_status,
+        CASE
+            WHEN muomv.title = 'GM' THEN 'GM'
+            WHEN muomv.title = 'NT' THEN 'NT'
+            WHEN muomv.title IN ('CM','FM','IM','WCM','WFM','WGM','WH','WIM') THEN 'other_titles'
+        END AS title_group,
+        muomv.age_category,
+        CAST(FLOOR(muomv.rating / :bucket_width) * :bucket_width AS INT) AS rating_bucket,
+        COUNT(*) AS player_count
+    FROM montlhyupdate_open_players_with_age_group muomv
+    LEFT JOIN players p ON muomv.ID = p.ID
+    LEFT JOIN countries c ON muomv.fed = c.code
+    WHERE muomv.ongoing_date = :ongoing_date
+    GROUP BY 1, 2, 3, 4, 5, 6, 7, 8
+"""
+
+def refresh_filter_cube(engine, ongoing_date):
+    """
+    Recompute the rows of one month in the 'player_filter_cube' table, which holds the number of
+    players per (ongoing_date, fed, continent, sex, activity_status, title group, age_category, rating bucket).
+    The percentage charts of the app are sums over this table.
+
+    Parameters:
+        engine: The SQLAlchemy engine connected to the PostgreSQL database.
+        ongoing_date: The month to recompute.
+    """
+    params = {'ongoing_date': ongoing_date, 'bucket_width': RATING_BUCKET_WIDTH}
+    # Replace the month in a single transaction, readers see either the old or the new rows
+    with engine.begin() as connection:
+        connection.execute(text("DELETE FROM player_filter_cube WHERE ongoing_date = :ongoing_date;"), params)
+        result = connection.execute(text(f"""
+            INSERT INTO player_filter_cube (ongoing_date, fed, continent, sex, activity_status,
+                                            title_group, age_category, rating_bucket, player_count)
+            {FILTER_CUBE_SELECT};
+        """), params)
+        print(f"{result.rowcount} rows of {ongoing_date} written into the 'player_filter_cube' table.")
+
+###################################################
+# Rating sketch
+###################################################
+
+# Width of the rating bins of rating_sketch, it must match RATING_HISTOGRAM_BIN_WIDTH in utils_pages
+RATING_SKETCH_BIN_WIDTH = 10
+
+RATING_SKETCH_SELECT = """
+    SELECT
+        muomv.ongoing_date,
+        muomv.fed,
+        p.sex,
+        muomv.activity_status,
+        muomv.title,
+        muomv.age_category,
+        CAST(FLOOR(muomv.rating / :bin_width) * :bin_width AS INT) AS rating_bin,
+        COUNT(*) AS player_count
+    FROM montlhyupdate_open_players_with_age_group muomv
+    LEFT JOIN players p ON muomv.ID = p.ID
+    WHERE muomv.ongoing_date = :ongoing_date
+    GROUP BY 1, 2, 3, 4, 5, 6, 7
+"""
+
+def refresh_rating_sketch(engine, ongoing_date):
+    """
+    Recompute the rows of one month in the 'rating_sketch' table, the histogram of the ratings
+    per (ongoing_date, fed, sex, activity_status, title, age_category). The app merges these
+    histograms to compute the medians of any selection of filters.
+
+    Parameters:
+        engine: The SQLAlchemy engine connected to the PostgreSQL database.
+        ongoing_date: The month to recompute.
+    """
+    params = {'ongoing_date': ongoing_date, 'bin_width': RATING_SKETCH_BIN_WIDTH}
+    # Replace the month in a single transaction, readers see either the old or the new rows
+    with engine.begin() as connection:
+        connection.execute(text("DELETE FROM rating_sketch WHERE ongoing_date = :ongoing_date;"), params)
+        result = connection.execute(text(f"""
+            INSERT INTO rating_sketch (ongoing_date, fed, sex, activity_status,
+                                       title, age_category, rating_bin, player_count)
+            {RATING_SKETCH_SELECT};
+        """), params)
+        print(f"{result.rowcount} rows of {ongoing_date} written into the 'rating_sketch' table.")
+
+###################################################
+# Leaderboard
+###################################################
+
+# Number of players ranked per month in each scope of the 'leaderboard' table
+LEADERBOARD_TOP_N = 10
+
+def refresh_leaderboard(engine, ongoing_date, top_n=LEADERBOARD_TOP_N):
+    """
+    Rank the active players of one month into the 'leaderboard' table: the top `top_n` worldwide,
+    per continent and per federation. The Top 5 page and the bar chart race read this table.
+
+    Parameters:
+        engine: The SQLAlchemy engine connected to the PostgreSQL database.
+        ongoing_date: The month to rank.
+        top_n (int): Number of players kept in each scope.
+    """
+    params = {'ongoing_date': ongoing_date, 'top_n': top_n}
+    # Replace the month in a single transaction, readers see either the old or the new rows
+    with engine.begin() as connection:
+        connection.execute(text("DELETE FROM leaderboard WHERE ongoing_date = :ongoing_date;"), params)
+        result = connection.execute(text("""
+            INSERT INTO leaderboard (ongoing_date, scope, scope_value, rank, id, name, fed, rating)
+            WITH ranked AS (
+                SELECT
+                    mu.ongoing_date,
+                    mu.id,
+                    p.name,
+                    mu.fed,
+                    c.continent,
+                    mu.rating,
+                    ROW_NUMBER() OVER (ORDER BY mu.rating DESC, mu.id) AS global_rank,
+                    ROW_NUMBER() OVER (PARTITION BY c.continent ORDER BY mu.rating DESC, mu.id) AS continent_rank,
+                    ROW_NUMBER() OVER (PARTITION BY mu.fed ORDER BY mu.rating DESC, mu.id) AS federation_rank
+                FROM montlhyupdates mu
+                LEFT JOIN players p ON mu.ID = p.ID
+                LEFT JOIN countries c ON mu.fed = c.code
+                WHERE mu.ongoing_date = :ongoing_date
+                AND mu.fed NOT IN ('NON', 'FID')
+                AND mu.activity_status = 'a'
+            )
+            SELECT ongoing_date, 'global', 'world', global_rank, id, name, fed, rating
+            FROM ranked WHERE global_rank <= :top_n
+            UNION ALL
+            SELECT ongoing_date, 'continent', continent, continent_rank, id, name, fed, rating
+            FROM ranked WHERE continent_rank <= :top_n AND continent IS NOT NULL
+            UNION ALL
+            SELECT ongoing_date, 'federation', fed, federation_rank, id, name, fed, rating
+            FROM ranked WHERE federation_rank <= :top_n;
+        """), params)
+        print(f"{result.rowcount} rows of {ongoing_date} written into the 'leaderboard' table.")
+
+###################################################
+# Dataset metadata
+###################################################
+
+def update_dataset_metadata(engine):
+    """
+    Record a new load in the 'dataset_metadata' table: the snapshot dates, the latest ongoing_date,
+    its month and year, and a load counter. The app compares (latest_date, load_counter) with the
+    version it serves to refresh its cache after an update, and filters on the snapshot dates.
+
+    Parameters:
+        engine: The SQLAlchemy engine connected to the PostgreSQL database.
+    """
+    sql = text("""
+        WITH snapshots AS (
+            SELECT ARRAY_AGG(DISTINCT ongoing_date ORDER BY ongoing_date) AS snapshot_dates,
+                MAX(ongoing_date) AS latest_date
+            FROM montlhyupdates
+        )
+        UPDATE dataset_metadata
+        SET snapshot_dates = snapshots.snapshot_dates,
+            latest_date = snapshots.latest_date,
+            latest_month = EXTRACT(MONTH FROM snapshots.latest_date),
+            latest_year = EXTRACT(YEAR FROM snapshots.latest_date),
+            load_counter = load_counter + 1,
+            updated_at = now()
+        FROM snapshots;
+    """)
+    with engine.begin() as connection:
+        connection.execute(sql)
+        print("The dataset metadata has been updated")
+
+###################################################
+# ETL runs
+###################################################
+
+def get_ingested_run(engine, source_hash, top_k):
+    """
+    Return the last successful run that loaded a FIDE list with the same content and top_k,
+    None if the list was never loaded.
+
+    Parameters:
+        engine: The SQLAlchemy engine connected to the PostgreSQL database.
+        source_hash (str): SHA-256 of the FIDE list.
+        top_k (int): Number of players kept per federation.
+    """
+    with engine.connect() as connection:
+        row = connection.execute(text("""
+            SELECT id, source_file, snapshot_date, finished_at
+            FROM etl_runs
+            WHERE source_hash = :source_hash
+            AND top_k = :top_k
+            AND status = 'succeeded'
+            AND stage_durations ? 'load'
+            ORDER BY finished_at DESC
+            LIMIT 1;
+        """), {'source_hash': source_hash, 'top_k': top_k}).mappings().first()
+    return dict(row) if row is not None else None
+
+def start_etl_run(engine, source_file, source_hash, snapshot_date, top_k, forced=False):
+    """
+    Record the start of a run in the 'etl_runs' table and return its id.
+
+    Parameters:
+        engine: The SQLAlchemy engine connected to the PostgreSQL database.
+        source_file (str): Path of the FIDE list.
+        source_hash (str): SHA-256 of the FIDE list.
+        snapshot_date: The month of the list.
+        top_k (int): Number of players kept per federation.
+        forced (bool): Whether the list is loaded again even if it was already loaded.
+    """
+    with engine.begin() as connection:
+        return connection.execute(text("""
+            INSERT INTO etl_runs (source_file, source_hash, snapshot_date, top_k, forced, status)
+            VALUES (:source_file, :source_hash, :snapshot_date, :top_k, :forced, 'running')
+            RETURNING id;
+        """), {'source_file': os.path.basename(source_file), 'source_hash': source_hash,
+               'snapshot_date': snapshot_date, 'top_k': top_k, 'forced': forced}).scalar_one()
+
+def finish_etl_run(engine, run_id, status, stage_durations, row_counts):
+    """
+    Record the end of a run in the 'etl_runs' table.
+
+    Parameters:
+        engine: The SQLAlchemy engine connected to the PostgreSQL database.
+        run_id (int): The id returned by start_etl_run.
+        status (str): 'succeeded' or 'failed'.
+        stage_durations (dict): Seconds spent in each stage that ran.
+        row_counts (dict): Rows written per table.
+    """
+    with engine.begin() as connection:
+        connection.execute(text("""
+            UPDATE etl_runs
+            SET status = :status,
+                stage_durations = CAST(:stage_durations AS JSONB),
+                row_counts = CAST(:row_counts AS JSONB),
+                finished_at = now()
+            WHERE id = :run_id;
+        """), {'run_id': run_id, 'status': status,
+               'stage_durations': json.dumps({name: round(seconds, 3) for name, seconds in stage_durations.items()}),
+               'row_counts': json.dumps({name: int(count) for name, count in row_counts.items()})})
+    print(f"Run {run_id} {status}")
+
 ###################################################
 # Delete Data
 ###################################################
@@ -454,6 +1069,58 @@ def delete_data(table_name: str, where_condition: str) -> None:
         result = connection.execute(query)
         print(f"Deleted {result.rowcount} row(s) from {table_name}.")
 
+###################################################
+# Checkpoints
+###################################################
+
+# Folder of the artifacts and manifests of the stages of the monthly update
+CHECKPOINT_DIR = '.etl_cache'
+
+def file_hash(path):
+    """
+    Return the SHA-256 of the content of a file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def frame_hash(df):
+    """
+    Return a SHA-256 of the content of a DataFrame: values, index, column names and dtypes.
+    """
+    digest = hashlib.sha256(repr(list(df.dtypes.items())).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return digest.hexdigest()
+
+def read_manifest(checkpoint_dir, stage):
+    """
+    Return the manifest written by the last successful run of a stage, None if it never ran.
+    """
+    path = os.path.join(checkpoint_dir, f'{stage}.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+def write_manifest(checkpoint_dir, stage, input_hash, outputs, output_hash):
+    """
+    Record a successful run of a stage: the hash of its inputs, the paths of its outputs and the
+    hash of its result, which is the input hash of the stages depending on it.
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    manifest = {
+        'stage': stage,
+        'input_hash': input_hash,
+        'outputs': outputs,
+        'output_hash': output_hash,
+        'finished_at': datetime.now().isoformat(timespec='seconds'),
+    }
+    with open(os.path.join(checkpoint_dir, f'{stage}.json'), 'w') as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
 ###################################################
 # Move files
 ###################################################
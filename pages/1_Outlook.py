@@ -1,18 +1,19 @@
 import streamlit as st
 import warnings
 warnings.filterwarnings('ignore')
-from utils_pages import load_data
+from utils_pages import load_data_batch
 from utils_pages import get_min_rating
 from utils_pages import get_max_rating
 from utils_pages import get_main_query
-from utils_pages import get_average_of_median_rating_over_time
-from utils_pages import get_count_unique_countries
+from utils_pages import get_average_of_median_rating_query
+from utils_pages import get_count_unique_countries_query
 from utils_pages import get_rating_query
 from utils_pages import filter_gender
 from utils_pages import filter_activity_status
 from utils_pages import filter_title
 from utils_pages import filter_age_group
 from utils_pages import filter_rating
+from utils_pages import build_filters
 from utils_pages import gender_bar_chart
 from utils_pages import activity_status_bar_chart
 from utils_pages import continents_line_chart
@@ -36,70 +37,27 @@ option_title, title_header, selected_title = filter_title()
 option_age, age_header, selected_age = filter_age_group()
 rating_header, slider_rating = filter_rating(min_rating, max_rating)
 
-filters = ["EXTRACT(MONTH FROM muomv.ongoing_date) = (SELECT get_last_month())"]
-
-if selected_gender:
-    
-    if len(selected_gender) > 1:
-    
-        filters.append(f"sex in {tuple(selected_gender)}")
-        
-    else:
-        filters.append(f"sex in ('{selected_gender[0]}')")
-
-if selected_activity_Status:
-    
-    if len(selected_activity_Status) > 1:
-    
-        filters.append(f"activity_status in {tuple(selected_activity_Status)}")
-        
-    else:
-        filters.append(f"activity_status in ('{selected_activity_Status[0]}')")
-     
-other_titles_list = ['CM','FM','IM','WCM','WFM','WGM','WH','WIM'] 
-        
-if selected_title:
-    
-    if 'other_titles' in selected_title:
-        
-        if len(selected_title) == 1:
-                
-            filters.append(f"title in {tuple(other_titles_list)}")
-
-        else:
-            option_to_consider_title = [i for i in selected_title if i != 'other_titles']
-            option_to_consider_title.extend(other_titles_list)
-            
-            filters.append(f"title in {tuple(option_to_consider_title)}")
-            
-    else:
-        
-        if len(selected_title) > 1:
-    
-            filters.append(f"title in {tuple(selected_title)}")
-        
-        else:
-            filters.append(f"title in ('{selected_title[0]}')")
-
-if selected_age:
-    
-    if len(selected_age) > 1:
-    
-        filters.append(f"age_category in {tuple(selected_age)}")
-        
-    else:
-        filters.append(f"age_category in ('{selected_age[0]}')")     
-
-if slider_rating:
-    
-    filters.append(f"muomv.rating >= {slider_rating[0]} AND muomv.rating <= {slider_rating[1]}")   
+filters = build_filters(selected_gender,
+                        selected_activity_Status,
+                        selected_title,
+                        selected_age,
+                        rating_range=slider_rating or None)
 
 main_query = get_main_query(filters=filters)
 query_rating = get_rating_query(filters=filters)
 
 #st.write(query_rating)
-df = load_data(main_query)
-df_rating = load_data(query_rating)
+# The four queries of the page run at the same time
+frames = load_data_batch({
+    'main': main_query,
+    'rating': query_rating,
+    'average_of_median_rating': get_average_of_median_rating_query(filters=filters),
+    'unique_countries': get_count_unique_countries_query(filters=filters),
+})
+df = frames['main']
+df_rating = frames['rating']
+average_of_median_rating_over_time = frames['average_of_median_rating']['avg_median_rating'].values[0]
+count_unique_countries = frames['unique_countries']['unique_countries'].values[0]
 #st.write(df_rating.head())
 
 fig_gender = gender_bar_chart(
@@ -182,7 +140,7 @@ with placeholder:
             f"""
             <div style="border: 2px solid #ccc; border-radius: 10px; padding: 0px;  margin: 25px; text-align: center;">
                 <h4>Average of median rating over time</h4>
-                <p style="font-size: 20px;">{get_average_of_median_rating_over_time(filters=filters)}</p>
+                <p style="font-size: 20px;">{average_of_median_rating_over_time}</p>
             </div>
             """,
             unsafe_allow_html=True)
@@ -195,7 +153,7 @@ with placeholder:
             f"""
             <div style="border: 2px solid #ccc; border-radius: 10px; padding: 0px; margin: 25px; text-align: center;">
                 <h4>Total Countries considered</h4>
-                <p style="font-size: 20px;">{get_count_unique_countries(filters=filters)}</p>
+                <p style="font-size: 20px;">{count_unique_countries}</p>
             </div>
             """,
             unsafe_allow_html=True)
@@ -12,7 +12,7 @@ from utils_pages import filter_activity_status
 from utils_pages import filter_title
 from utils_pages import filter_age_group
 from utils_pages import filters_for_comparison_tool
-from utils_pages import load_data
+from utils_pages import load_data_batch
 from utils_pages import gender_bar_chart
 from utils_pages import activity_status_bar_chart
 from utils_pages import title_line_chart
@@ -20,6 +20,7 @@ from utils_pages import age_group_heat_map
 from utils_pages import rating_violin_chart_for_comparison_tool
 from utils_pages import get_metrics_comparison
 from utils_pages import filters_for_metrics_comparison_tool
+from utils_pages import lazy_expander
 
 st.set_page_config(layout="wide")
 # Title and subtitle
@@ -28,11 +29,6 @@ st.title("Comparison Tool 	:toolbox:")
 selectbox_container = st.container(border=True)
 bubble_chart_container = st.container(border=True)
 metrics_container = st.container()
-gender_expander = st.expander(label='Gender', icon='👫')
-activity_status_expander = st.expander(label='Activity Status', icon='🚥')
-title_expander = st.expander(label='Title', icon='👨‍🎓')
-age_expander = st.expander(label='Age', icon='👴')
-rating_expander = st.expander(label='Rating', icon='📈')
 
 with selectbox_container:
     col1, col2 = st.columns([1, 1])
@@ -78,11 +74,6 @@ second_query = get_country_query_for_comparison_tool(filters_second_country)
 rating_query_first_country = get_rating_query(filters=filters_first_country)
 rating_query_second_country = get_rating_query(filters=filters_second_country)
 
-df_first_country = load_data(first_query)
-df_second_country = load_data(second_query)
-df_rating_first_country = load_data(rating_query_first_country)
-df_rating_second_country = load_data(rating_query_second_country)
-
 last_date, first_country_count_titled_players, first_country_median_rating, first_country_count_gms, second_country_count_titled_players, second_country_median_rating, second_country_count_gms = get_metrics_comparison(query=query_comparison_country_bubble_chart, first_country=first_country, second_country=second_country)
 
 
@@ -90,72 +81,6 @@ fig_bubble_chart_comparison = bubble_chart(query_comparison_country_bubble_chart
                                         color_column='country',
                                         text= f'Median Rating vs Amount of Gms Players Over Time')
 
-gender_bar_chart_first_country = gender_bar_chart(df =df_first_country,
-                                                  text=  f"Trends in Gender Distribution Among Top Players <br>{first_country}<br>",
-                                                subtitle= dict(
-                                                    text="Gender percentages among the strongest 100 players <br> per country over the last 5 years <br>",
-                                                    font=dict(color="gray", size=12))
-                                            )
-
-gender_bar_chart_second_country = gender_bar_chart(df =df_second_country,
-                                                  text=  f"Trends in Gender Distribution Among Top Players <br>{second_country}<br>",
-                                                subtitle= dict(
-                                                    text="Gender percentages among the strongest 100 players <br> per country over the last 5 years <br>",
-                                                    font=dict(color="gray", size=12))
-                                            )
-
-activity_status_bar_chart_first_country = activity_status_bar_chart(df =df_first_country,
-                                                                    text= f"Percentage of activity status of players Over Time <br>{first_country}<br>",
-                                                                    subtitle=dict(
-                                                                        text="activity status percentages among the strongest 100 players <br> per country over the last 5 years <br>",
-                                                                        font=dict(color="gray", size=12))
-                                                                    )
-
-activity_status_bar_chart_second_country = activity_status_bar_chart(df =df_second_country,
-                                                                    text= f"Percentage of activity status of players Over Time <br>{second_country}<br>",
-                                                                    subtitle=dict(
-                                                                        text="activity status percentages among the strongest 100 players <br> per country over the last 5 years <br>",
-                                                                        font=dict(color="gray", size=12))
-                                                                    )
-
-title_line_chart_first_country = title_line_chart(df =df_first_country,
-                                                  text= f"Percentage of titled players Over Time <br>{first_country}<br>",
-                                                  selected_title=selected_title,
-                                                  subtitle= dict(
-                                                      text="title percentages among the strongest 100 players <br> per country over the last 5 years <br>",
-                                                      font=dict(color="gray", size=12))
-                                                  )
-title_line_chart_second_country = title_line_chart(df =df_second_country,
-                                                   text= f"Percentage of titled players Over Time <br>{second_country}<br>",
-                                                   selected_title=selected_title,
-                                                   subtitle= dict(
-                                                       text="title percentages among the strongest 100 players <br> per country over the last 5 years <br>",
-                                                       font=dict(color="gray", size=12))
-                                                   )
-age_group_heat_map_first_country = age_group_heat_map(df=df_first_country,
-                                                      values_group_age= list(option_age.values()),
-                                                        text=f"Age Group Distribution of Players Over Time <br>{first_country}<br>",
-                                                        subtitle= dict(
-                                                            text="Age group percentages among the strongest 100 players <br> per country over the last 5 years <br>",
-                                                            font=dict(color="gray", size=12))
-                                                        )      
-
-age_group_heat_map_second_country = age_group_heat_map(df=df_second_country,
-                                                      values_group_age= list(option_age.values()),
-                                                        text=f"Age Group Distribution of Players Over Time <br>{second_country}<br>",
-                                                        subtitle= dict(
-                                                            text="Age group percentages among the strongest 100 players <br> per country over the last 5 years <br>",
-                                                            font=dict(color="gray", size=12))
-                                                        )   
-
-fig_rating = rating_violin_chart_for_comparison_tool(first_country=first_country,
-                                                     second_country=second_country,
-                                                    df_first_country= df_rating_first_country,
-                                                    df_second_country= df_rating_second_country,
-                                                        text="Rating Distribution of Players Over Time",
-                                                        subtitle=dict(text="Rating distribution among the strongest 100 players <br> per country over the last 5 years <br>",
-                                                        font=dict(color="gray", size=12)))                                                        
-
 with bubble_chart_container:
     st.plotly_chart(fig_bubble_chart_comparison, use_container_width=True)
 
@@ -199,42 +124,74 @@ with metrics_container:
             with col3_nested:
                 st.metric(label='Number of Gms', value=second_country_count_gms)
 
-with gender_expander:
+###################################
+# Sections
+###################################
+
+# Charts drawn side by side for the two countries, from the comparison queries
+COUNTRY_SECTIONS = {
+    'gender': dict(label='Gender', icon='👫', chart=gender_bar_chart,
+                   text="Trends in Gender Distribution Among Top Players",
+                   subtitle="Gender percentages among the strongest 100 players <br> per country over the last 5 years <br>"),
+    'activity_status': dict(label='Activity Status', icon='🚥', chart=activity_status_bar_chart,
+                            text="Percentage of activity status of players Over Time",
+                            subtitle="activity status percentages among the strongest 100 players <br> per country over the last 5 years <br>"),
+    'title': dict(label='Title', icon='👨‍🎓', chart=title_line_chart,
+                  text="Percentage of titled players Over Time",
+                  subtitle="title percentages among the strongest 100 players <br> per country over the last 5 years <br>",
+                  chart_kwargs=dict(selected_title=selected_title)),
+    'age': dict(label='Age', icon='👴', chart=age_group_heat_map,
+                text="Age Group Distribution of Players Over Time",
+                subtitle="Age group percentages among the strongest 100 players <br> per country over the last 5 years <br>",
+                chart_kwargs=dict(values_group_age=list(option_age.values()))),
+}
+
+def country_charts_section(name, chart, text, subtitle, first_query, second_query, first_country, second_country, chart_kwargs):
+    # The sections share the two queries, the first one opened runs them and the others read the cache
+    frames = load_data_batch({'first_country': first_query, 'second_country': second_query})
     col1, col2 = st.columns([1, 1])
-    
-    with  col1:
-        st.plotly_chart(gender_bar_chart_first_country, use_container_width=True, key=f"plot_gender{1}")
-    
-    with  col2:
-        st.plotly_chart(gender_bar_chart_second_country, use_container_width=True, key=f"plot_gender{2}")
-
-with activity_status_expander:
-    col1, col2 = st.columns([1, 1])
-    
-    with  col1:
-        st.plotly_chart(activity_status_bar_chart_first_country, use_container_width=True, key=f"plot_activity_status{1}")
-    
-    with  col2:
-        st.plotly_chart(activity_status_bar_chart_second_country, use_container_width=True, key=f"plot_activity_status{2}")
-
-with title_expander:
-    col1, col2 = st.columns([1, 1])
-    
-    with  col1:
-        st.plotly_chart(title_line_chart_first_country, use_container_width=True, key=f"plot_title{1}")
-    
-    with  col2:
-        st.plotly_chart(title_line_chart_second_country, use_container_width=True, key=f"plot_title{2}")
-        
-with age_expander:
-    col1, col2 = st.columns([1, 1])
-    
-    with  col1:
-        st.plotly_chart(age_group_heat_map_first_country, use_container_width=True, key=f"plot_age{1}")
-    
-    with  col2:
-        st.plotly_chart(age_group_heat_map_second_country, use_container_width=True, key=f"plot_age{2}")
-
-with rating_expander:
+    for i, (col, country, df) in enumerate([(col1, first_country, frames['first_country']),
+                                            (col2, second_country, frames['second_country'])], start=1):
+        fig = chart(df=df,
+                    text=f"{text} <br>{country}<br>",
+                    subtitle=dict(text=subtitle, font=dict(color="gray", size=12)),
+                    **chart_kwargs)
+        with col:
+            st.plotly_chart(fig, use_container_width=True, key=f"plot_{name}{i}")
+
+def rating_section(first_country, second_country, rating_query_first_country, rating_query_second_country):
+    frames = load_data_batch({'rating_first_country': rating_query_first_country,
+                              'rating_second_country': rating_query_second_country})
+    fig_rating = rating_violin_chart_for_comparison_tool(first_country=first_country,
+                                                         second_country=second_country,
+                                                        df_first_country= frames['rating_first_country'],
+                                                        df_second_country= frames['rating_second_country'],
+                                                            text="Rating Distribution of Players Over Time",
+                                                            subtitle=dict(text="Rating distribution among the strongest 100 players <br> per country over the last 5 years <br>",
+                                                            font=dict(color="gray", size=12)))
     st.plotly_chart(fig_rating, use_container_width=True)
 
+# The sections are only computed once opened, each one reruns alone
+for name, section in COUNTRY_SECTIONS.items():
+    lazy_expander(section['label'],
+                  icon=section['icon'],
+                  key=f"section_{name}",
+                  render=country_charts_section,
+                  name=name,
+                  chart=section['chart'],
+                  text=section['text'],
+                  subtitle=section['subtitle'],
+                  first_query=first_query,
+                  second_query=second_query,
+                  first_country=first_country,
+                  second_country=second_country,
+                  chart_kwargs=section.get('chart_kwargs', {}))
+
+lazy_expander('Rating',
+              icon='📈',
+              key="section_rating",
+              render=rating_section,
+              first_country=first_country,
+              second_country=second_country,
+              rating_query_first_country=rating_query_first_country,
+              rating_query_second_country=rating_query_second_country)
@@ -6,18 +6,16 @@ from utils_pages import variation_rating_player_line_chart
 from utils_pages import variation_games_played_line_chart
 from utils_pages import get_avg_rating_player_current_year
 from utils_pages import get_avg_games_played_monthly
+from utils_pages import get_top_players_query
+from utils_pages import get_player_profile
+from utils_pages import load_bar_chart_race_payload
+from utils_pages import bar_chart_race_chart
 
 st.set_page_config(layout="wide")
 # Title and subtitle
 st.title("Current Top 5 Chess Players 	:crown:")
 
-query = """
-SELECT name,
-    rating,
-    fed
-FROM top_10_open_players_view topv
-LIMIT 5
-"""
+query = get_top_players_query(top_n=5)
 top_5 = [1,2,3,4,5]
 container_1 = st.container(border=True)
 container_2 = st.container(border=True
@@ -33,6 +31,7 @@ with container_1:
         event = st.dataframe(
             st.session_state.df,
             #hide_index=True,
+            column_order=('name', 'rating', 'fed'),
             key="data",
             on_select="rerun",
             selection_mode='single-row',
@@ -44,22 +43,28 @@ if len(player) > 0:
     player[0] +=1    
     player_selected = st.session_state.df['name'].loc[player].values    
     player_selected = player_selected[0]
+    player_id = st.session_state.df['id'].loc[player].values[0]
     
-    avg_rating_metric = get_avg_rating_player_current_year(player_selected=player_selected)['avg'].values[0]
+    # Monthly series and aggregates of the player, in one query
+    profile = get_player_profile(player_id=player_id)
+    
+    avg_rating_metric = get_avg_rating_player_current_year(profile=profile)
     avg_rating_metric = round(avg_rating_metric,2)
     
-    avg_games_played = get_avg_games_played_monthly(player_selected=player_selected)['avg'].values[0]
+    avg_games_played = get_avg_games_played_monthly(profile=profile)
     avg_games_played = round(avg_games_played,2)
     
     col2_c1.metric(label="Ongoing Year's Average Rating", value= avg_rating_metric)
     col3_c1.metric(label= "Monthly Average of Games Played", value=avg_games_played)
     
     fig_player_rating =  variation_rating_player_line_chart(player_selected=player_selected,
+                                     profile=profile,
                                      text=f" Rating Variations of {player_selected} ",
                                       subtitle=dict(text="Tracking the Professional Chess Rating <br> over the last 5 years <br>",
                                                       font=dict(color="gray", size=12)))
 
     fig_games = variation_games_played_line_chart(player_selected=player_selected,
+                                                profile=profile,
                                                 text=f'Annual Number of Games Played by {player_selected}',
                                               subtitle=dict(text="Yearly Game Count <br> over the last 5 years <br>",
                                                       font=dict(color="gray", size=12))
@@ -77,5 +82,18 @@ else:
      col2_c1.markdown("No player selected.")
 # Add current year games played so far
 
-expander_video = st.expander(label='Bar Chart Race video - Top 5 Chess Players Over Time', icon='📊')
-expander_video.video(data = 'bar_chart_race_video/top_5_chess_players_over_time.mp4')
+expander_video = st.expander(label='Bar Chart Race - Top Chess Players Over Time', icon='📊')
+with expander_video:
+    payload = load_bar_chart_race_payload()
+    # Without the rankings file only the video can be shown
+    show_video = payload is None or st.toggle('Show the video', value=False)
+    if show_video:
+        st.video(data = 'bar_chart_race_video/top_5_chess_players_over_time.mp4')
+    else:
+        n_bars = st.slider('Number of players', min_value=3, max_value=10, value=5)
+        fig_race = bar_chart_race_chart(payload=payload,
+                                        n_bars=n_bars,
+                                        text=f'Top {n_bars} Chess Players Over Time',
+                                        subtitle=dict(text="Press play or move the slider <br> over the last 5 years <br>",
+                                                      font=dict(color="gray", size=12)))
+        st.plotly_chart(fig_race, use_container_width=True)
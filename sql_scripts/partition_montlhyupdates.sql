@@ -0,0 +1,118 @@
+------------------------------------------------------------------------------------------
+-- Partitioning of MontlhyUpdates (migration, run once)
+------------------------------------------------------------------------------------------
+
+-- Converts MontlhyUpdates into a table partitioned by month on ongoing_date: queries on some
+-- months only scan their partitions and the monthly update writes into one small partition.
+-- The monthly update creates the partitions of the new months (create_month_partitions) and
+-- moves the months older than 5 years to the 'archive' schema (archive_old_partitions).
+--
+-- Run it once on a database holding the unpartitioned MontlhyUpdates table, before
+-- 'views and functions.sql'. Everything runs in one transaction: if a step fails, the
+-- database is left as it was.
+--
+-- The views (and materialized views) reading MontlhyUpdates, directly or through other views,
+-- would follow the renamed table and block its DROP, so they are dropped first and created
+-- again, from their saved definitions and indexes, on the partitioned table. Their grants are
+-- not kept.
+
+BEGIN;
+
+-- Views reading MontlhyUpdates, directly (depth 1) or through other views (depth 2 and more),
+-- with their definitions before the rename. A view reached by several paths keeps its longest
+-- one, so it comes after every view it reads.
+CREATE TEMP TABLE montlhyupdates_dependent_views ON COMMIT DROP AS
+WITH RECURSIVE dependents AS (
+    SELECT CAST('montlhyupdates'::regclass AS oid) AS oid, 0 AS depth
+    UNION ALL
+    SELECT v.oid, dependents.depth + 1
+    FROM dependents
+    JOIN pg_depend d ON d.refobjid = dependents.oid
+    JOIN pg_rewrite r ON r.oid = d.objid
+    JOIN pg_class v ON v.oid = r.ev_class
+    WHERE d.classid = 'pg_rewrite'::regclass
+    AND d.refclassid = 'pg_class'::regclass
+    AND v.oid <> dependents.oid  -- The rule of a view also depends on the view itself.
+)
+SELECT
+    v.oid,
+    n.nspname AS schema_name,
+    v.relname AS view_name,
+    v.relkind,  -- 'v' for a view, 'm' for a materialized view.
+    MAX(dependents.depth) AS depth,
+    regexp_replace(pg_get_viewdef(v.oid), ';\s*$', '') AS definition
+FROM dependents
+JOIN pg_class v ON v.oid = dependents.oid
+JOIN pg_namespace n ON n.oid = v.relnamespace
+WHERE dependents.depth > 0
+GROUP BY v.oid, n.nspname, v.relname, v.relkind;
+
+-- Indexes of the materialized views among them.
+CREATE TEMP TABLE montlhyupdates_dependent_indexes ON COMMIT DROP AS
+SELECT i.indexdef
+FROM pg_indexes i
+JOIN montlhyupdates_dependent_views v ON i.schemaname = v.schema_name AND i.tablename = v.view_name;
+
+DO $$
+DECLARE
+    dependent RECORD;
+BEGIN
+    -- Deepest first, a view is dropped before the views it reads.
+    FOR dependent IN SELECT * FROM montlhyupdates_dependent_views ORDER BY depth DESC, oid DESC
+    LOOP
+        EXECUTE format(CASE WHEN dependent.relkind = 'm' THEN 'DROP MATERIALIZED VIEW %I.%I'
+                            ELSE 'DROP VIEW %I.%I' END,
+                       dependent.schema_name, dependent.view_name);
+    END LOOP;
+END;
+$$;
+
+ALTER TABLE MontlhyUpdates RENAME TO montlhyupdates_unpartitioned;
+
+CREATE TABLE MontlhyUpdates (LIKE montlhyupdates_unpartitioned INCLUDING DEFAULTS)
+PARTITION BY RANGE (ongoing_date);
+
+-- The primary key also serves the player lookups of the Top 5 page (WHERE id = ... ORDER BY ongoing_date).
+ALTER TABLE MontlhyUpdates ADD PRIMARY KEY (id, ongoing_date);
+
+-- One partition per month already loaded, named montlhyupdates_YYYY_MM.
+DO $$
+DECLARE
+    month_start DATE;
+BEGIN
+    FOR month_start IN
+        SELECT DISTINCT CAST(DATE_TRUNC('month', ongoing_date) AS DATE) FROM montlhyupdates_unpartitioned
+    LOOP
+        EXECUTE format('CREATE TABLE %I PARTITION OF MontlhyUpdates FOR VALUES FROM (%L) TO (%L)',
+                       'montlhyupdates_' || to_char(month_start, 'YYYY_MM'),
+                       month_start,
+                       CAST(month_start + INTERVAL '1 month' AS DATE));
+    END LOOP;
+END;
+$$;
+
+INSERT INTO MontlhyUpdates SELECT * FROM montlhyupdates_unpartitioned;
+DROP TABLE montlhyupdates_unpartitioned;
+
+CREATE SCHEMA IF NOT EXISTS archive;
+
+-- The dropped views, created again on the partitioned table, a view after the views it reads.
+DO $$
+DECLARE
+    dependent RECORD;
+    dependent_index RECORD;
+BEGIN
+    FOR dependent IN SELECT * FROM montlhyupdates_dependent_views ORDER BY depth ASC, oid ASC
+    LOOP
+        EXECUTE format(CASE WHEN dependent.relkind = 'm' THEN 'CREATE MATERIALIZED VIEW %I.%I AS %s'
+                            ELSE 'CREATE VIEW %I.%I AS %s' END,
+                       dependent.schema_name, dependent.view_name, dependent.definition);
+    END LOOP;
+    FOR dependent_index IN SELECT indexdef FROM montlhyupdates_dependent_indexes
+    LOOP
+        EXECUTE dependent_index.indexdef;
+    END LOOP;
+END;
+$$;
+
+COMMIT;
@@ -1,120 +1,114 @@
+------------------------------------------------------------------------------------------
+-- Partitioning of MontlhyUpdates
+------------------------------------------------------------------------------------------
+
+-- MontlhyUpdates is partitioned by month on ongoing_date, one montlhyupdates_YYYY_MM partition
+-- per month. The monthly update creates the partitions of the new months (create_month_partitions)
+-- and moves the months older than 5 years to the 'archive' schema (archive_old_partitions).
+-- An unpartitioned MontlhyUpdates table is converted once by partition_montlhyupdates.sql,
+-- run before this script.
+CREATE SCHEMA IF NOT EXISTS archive;
+
+-----------------------------------------------------------------------------
+-- Table leaderboard
+-----------------------------------------------------------------------------
+
+-- Top players of each month, ranked by rating among the active players, worldwide
+-- (scope 'global', scope_value 'world'), per continent (scope 'continent') and per
+-- federation (scope 'federation'). The monthly update ranks the new month once
+-- (refresh_leaderboard) instead of the views below ranking the whole history on every read.
+CREATE TABLE leaderboard (
+    ongoing_date DATE NOT NULL,
+    scope VARCHAR(10) NOT NULL,  -- 'global', 'continent' or 'federation'.
+    scope_value VARCHAR(20) NOT NULL,  -- 'world', the continent or the federation code.
+    rank INT NOT NULL,  -- 1 for the highest rating.
+    id VARCHAR(9) NOT NULL,
+    name VARCHAR(100),
+    fed VARCHAR(3),
+    rating INT,
+    PRIMARY KEY (ongoing_date, scope, scope_value, rank)
+);
+
+-- Initial load of the whole history, top 10 of each scope.
+INSERT INTO leaderboard (ongoing_date, scope, scope_value, rank, id, name, fed, rating)
+WITH ranked AS (
+    SELECT
+        mu.ongoing_date,
+        mu.id,
+        p.name,
+        mu.fed,
+        c.continent,
+        mu.rating,
+        ROW_NUMBER() OVER (PARTITION BY mu.ongoing_date ORDER BY mu.rating DESC, mu.id) AS global_rank,
+        ROW_NUMBER() OVER (PARTITION BY mu.ongoing_date, c.continent ORDER BY mu.rating DESC, mu.id) AS continent_rank,
+        ROW_NUMBER() OVER (PARTITION BY mu.ongoing_date, mu.fed ORDER BY mu.rating DESC, mu.id) AS federation_rank
+    FROM MontlhyUpdates mu
+    LEFT JOIN players p ON mu.ID = p.ID
+    LEFT JOIN countries c ON mu.fed = c.code
+    WHERE mu.FED NOT IN ('NON', 'FID')  -- Exclude federations 'NON' (non-existent) and 'FID' (FIDE).
+    AND mu.activity_status = 'a'  -- Include only active players ('a').
+)
+SELECT ongoing_date, 'global', 'world', global_rank, id, name, fed, rating
+FROM ranked WHERE global_rank <= 10
+UNION ALL
+SELECT ongoing_date, 'continent', continent, continent_rank, id, name, fed, rating
+FROM ranked WHERE continent_rank <= 10 AND continent IS NOT NULL
+UNION ALL
+SELECT ongoing_date, 'federation', fed, federation_rank, id, name, fed, rating
+FROM ranked WHERE federation_rank <= 10;
+
 ------------------------------------------------------------------------------------------
 --top_10_open_players_view
 ------------------------------------------------------------------------------------------
 
--- Create a view named 'top_10_open_players_view' to display the top 10 open players by rating for the last month month.
+-- Create a view named 'top_10_open_players_view' to display the top 10 open players by rating for the last month.
+-- The view already exists, ranking MontlhyUpdates: it is dropped and created again on the leaderboard, as
+-- CREATE OR REPLACE VIEW cannot change the types of its columns (those of the leaderboard).
+DROP VIEW IF EXISTS top_10_open_players_view;
 CREATE VIEW top_10_open_players_view AS
-WITH top_10_players AS ( 
-    -- Define a Common Table Expression (CTE) to calculate the rankings of players for last date.
-    SELECT 
-        mu.*,  -- Select all columns from the MontlhyUpdates table.
-        p.name,  -- Add the player's name from the players table.
-        ROW_NUMBER() OVER (
-            PARTITION BY mu.ongoing_date  -- Partition by the ongoing_date to calculate rank per month.
-            ORDER BY mu.rating DESC       -- Rank players by their rating in descending order.
-        ) AS rank
-    FROM MontlhyUpdates mu
-    LEFT JOIN players p ON mu.ID = p.ID  -- Join the MontlhyUpdates table with players to get player names.
-    WHERE 
-        -- Group_index = 'O' AND  -- Filter for players in the Open category ('O').
-        FED NOT IN ('NON', 'FID')  -- Exclude federations 'NON' (non-existent) and 'FID' (FIDE).
-        AND activity_status = 'a'  -- Include only active players ('a').
-		AND ongoing_date = (select max(ongoing_date)from MontlhyUpdates mu )
-        )
 SELECT
-    t.name,  -- Select the player's name from the CTE.
-    t.rating,  -- Select the player's rating.
-    t.fed,
-    t.ongoing_date  -- Select the date of the update.
-FROM top_10_players t
-LEFT JOIN countries c ON t.fed = c.code  -- Optionally join with the countries table to add country metadata.
-WHERE t.rank <= 10  -- Filter the top 10 players for each date based on their ranking.
-ORDER BY t.ongoing_date ASC;  -- Order the results by date in ascending order.
+    l.name,  -- Select the player's name.
+    l.rating,  -- Select the player's rating.
+    l.fed,
+    l.ongoing_date  -- Select the date of the update.
+FROM leaderboard l
+WHERE l.scope = 'global'
+AND l.rank <= 10
+AND l.ongoing_date = (SELECT MAX(ongoing_date) FROM leaderboard)  -- Last month, read from the primary key.
+ORDER BY l.ongoing_date ASC, l.rank ASC;
 
 -----------------------------------------------------------------
 -- top_10_open_players_over_time_view
 -----------------------------------------------------------------
 
 -- Create a view named 'top_10_open_players_over_time_view' to display the top 10 open players by rating for each month.
+-- Dropped and created again on the leaderboard, as the view above.
+DROP VIEW IF EXISTS top_10_open_players_over_time_view;
 CREATE VIEW top_10_open_players_over_time_view AS
-WITH top_10_players AS ( 
-    -- Define a Common Table Expression (CTE) to calculate the rankings of players for each date.
-    SELECT 
-        mu.*,  -- Select all columns from the MontlhyUpdates table.
-        p.name,  -- Add the player's name from the players table.
-        ROW_NUMBER() OVER (
-            PARTITION BY mu.ongoing_date  -- Partition by the ongoing_date to calculate rank per month.
-            ORDER BY mu.rating DESC       -- Rank players by their rating in descending order.
-        ) AS rank
-    FROM MontlhyUpdates mu
-    LEFT JOIN players p ON mu.ID = p.ID  -- Join the MontlhyUpdates table with players to get player names.
-    WHERE 
-        -- Group_index = 'O' AND  -- Filter for players in the Open category ('O').
-        FED NOT IN ('NON', 'FID')  -- Exclude federations 'NON' (non-existent) and 'FID' (FIDE).
-        AND activity_status = 'a'  -- Include only active players ('a').
-		)
 SELECT
-    t.name,  -- Select the player's name from the CTE.
-    t.rating,  -- Select the player's rating.
-    t.fed,
-    t.ongoing_date  -- Select the date of the update.
-FROM top_10_players t
-LEFT JOIN countries c ON t.fed = c.code  -- Optionally join with the countries table to add country metadata.
-WHERE t.rank <= 10  -- Filter the top 10 players for each date based on their ranking.
-ORDER BY t.ongoing_date ASC;  -- Order the results by date in ascending order.
-
+    l.name,  -- Select the player's name.
+    l.rating,  -- Select the player's rating.
+    l.fed,
+    l.ongoing_date,  -- Select the date of the update.
+    l.id  -- FIDE id, players are told apart by id in the bar chart race (names are not unique).
+FROM leaderboard l
+WHERE l.scope = 'global'
+AND l.rank <= 10
+ORDER BY l.ongoing_date ASC, l.rank ASC;  -- Order the results by date in ascending order.
 
 -----------------------------------------------------------------------------
--- Function get_last_month
+-- Table montlhyupdate_open_players_with_age_group
 -----------------------------------------------------------------------------
--- Create a function named 'get_last_month' that returns an integer value.
-CREATE FUNCTION get_last_month()
-    RETURNS INT  -- Specifies that the function will return an integer.
-    LANGUAGE plpgsql  -- Defines the function's language as PL/pgSQL.
-	AS
-	$$
-	DECLARE
-    	last_month INTEGER;  -- Declare a variable to store the result (last month's value).
-	BEGIN
-	    -- Extract the month from the maximum 'Ongoing_date' in the 'MonthlyUpdates' table.
-	    SELECT 
-	        EXTRACT(MONTH FROM MAX(mu.Ongoing_date))  -- Get the month part of the latest date.
-	    INTO last_month  -- Store the result in the 'last_month' variable.
-	    FROM MontlhyUpdates mu;  -- Query the 'MonthlyUpdates' table.
-	    
-	    -- Return the value of 'last_month'.
-	    RETURN last_month;
-	END;
-	$$;
 
------------------------------------------------------------------------------
--- Function get_last_YEAR
------------------------------------------------------------------------------
--- Create a function named 'get_last_year' that returns an integer value.
-CREATE FUNCTION get_last_year()
-    RETURNS INT  -- Specifies that the function will return an integer.
-    LANGUAGE plpgsql  -- Defines the function's language as PL/pgSQL.
-	AS
-	$$
-	DECLARE
-    	last_year INTEGER;  -- Declare a variable to store the result (last month's value).
-	BEGIN
-	    -- Extract the month from the maximum 'Ongoing_date' in the 'MonthlyUpdates' table.
-	    SELECT 
-	        EXTRACT(YEAR FROM MAX(mu.Ongoing_date))  -- Get the month part of the latest date.
-	    INTO last_year  -- Store the result in the 'last_month' variable.
-	    FROM MontlhyUpdates mu;  -- Query the 'MonthlyUpdates' table.
-	    
-	    -- Return the value of 'last_month'.
-	    RETURN last_year;
-	END;
-	$$;
-
------------------------------------------------------------------------------
--- Materialized view montlhyupdate_open_players_with_age_group_mv
------------------------------------------------------------------------------
-
-CREATE MATERIALIZED VIEW montlhyupdate_open_players_with_age_group_mv AS
+-- MontlhyUpdates rows with the age and the age category of the player at that month.
+-- The age only depends on ongoing_date and players.b_day, so the monthly update appends
+-- the new month (append_players_with_age_group) instead of recomputing the history.
+-- rebuild_players_with_age_group (python -m monthly_update rebuild-age-groups) rebuilds it
+-- next to the live table if needed.
+-- It replaces the materialized view montlhyupdate_open_players_with_age_group_mv: the table is
+-- created and filled, the materialized view is dropped, then the indexes are created (they
+-- take the names of the indexes of the materialized view).
+CREATE TABLE montlhyupdate_open_players_with_age_group AS
 SELECT 
     mu.*,
     EXTRACT(YEAR FROM mu.ongoing_date) - p.b_day AS age,
@@ -127,8 +121,170 @@ SELECT
         ELSE 'More than 66'
     END AS age_category
 FROM montlhyupdates mu
-LEFT JOIN players p on mu.ID = p.ID
+LEFT JOIN players p on mu.ID = p.ID;
 --WHERE mu.group_index='O';
 
-CREATE INDEX idx_o_rating ON montlhyupdate_open_players_with_age_group_mv (rating);
-CREATE INDEX idx_o_ongoing_date ON montlhyupdate_open_players_with_age_group_mv (ongoing_date);
\ No newline at end of file
+DROP MATERIALIZED VIEW IF EXISTS montlhyupdate_open_players_with_age_group_mv;
+
+CREATE INDEX idx_o_rating ON montlhyupdate_open_players_with_age_group (rating);
+CREATE INDEX idx_o_ongoing_date ON montlhyupdate_open_players_with_age_group (ongoing_date);
+
+-----------------------------------------------------------------------------
+-- Table dataset_metadata
+-----------------------------------------------------------------------------
+
+-- Single-row table describing the data currently loaded, maintained by the monthly
+-- update (update_dataset_metadata). The app uses (latest_date, load_counter) as the
+-- version of its cached query results and filters on the snapshot dates with
+-- "ongoing_date = ANY(:snapshot_dates)", which can use the indexes on ongoing_date.
+CREATE TABLE dataset_metadata (
+    id INT PRIMARY KEY DEFAULT 1 CHECK (id = 1),  -- Only one row is allowed.
+    snapshot_dates DATE[] NOT NULL DEFAULT '{}',  -- Every ongoing_date loaded, ascending.
+    latest_date DATE,  -- Latest ongoing_date loaded in MontlhyUpdates.
+    latest_month INT,  -- Month of latest_date.
+    latest_year INT,  -- Year of latest_date.
+    load_counter BIGINT NOT NULL DEFAULT 0,  -- Number of loads so far.
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()  -- Time of the last load.
+);
+
+INSERT INTO dataset_metadata (id, snapshot_dates, latest_date, latest_month, latest_year)
+SELECT 1,
+    ARRAY_AGG(DISTINCT ongoing_date ORDER BY ongoing_date),
+    MAX(ongoing_date),
+    EXTRACT(MONTH FROM MAX(ongoing_date)),
+    EXTRACT(YEAR FROM MAX(ongoing_date))
+FROM MontlhyUpdates;
+
+-----------------------------------------------------------------------------
+-- Function get_last_month
+-----------------------------------------------------------------------------
+-- Return the month of the latest snapshot. It reads dataset_metadata instead of
+-- scanning MontlhyUpdates, and is STABLE so it is evaluated once per query.
+-- OR REPLACE: it replaces the PL/pgSQL version already in the database.
+CREATE OR REPLACE FUNCTION get_last_month()
+    RETURNS INT
+    LANGUAGE sql
+    STABLE
+    AS
+    $$
+    SELECT latest_month FROM dataset_metadata;
+    $$;
+
+-----------------------------------------------------------------------------
+-- Function get_last_YEAR
+-----------------------------------------------------------------------------
+-- Return the year of the latest snapshot, read from dataset_metadata.
+CREATE OR REPLACE FUNCTION get_last_year()
+    RETURNS INT
+    LANGUAGE sql
+    STABLE
+    AS
+    $$
+    SELECT latest_year FROM dataset_metadata;
+    $$;
+
+-----------------------------------------------------------------------------
+-- Table player_filter_cube
+-----------------------------------------------------------------------------
+
+-- Number of players per month and per combination of the filters of the app.
+-- The percentage charts of the Outlook, Continent Analysis and Comparison Tool pages
+-- sum this table instead of scanning the player-month history. The monthly update
+-- recomputes the rows of the new month (refresh_filter_cube).
+CREATE TABLE player_filter_cube (
+    ongoing_date DATE NOT NULL,
+    fed VARCHAR(3),
+    continent VARCHAR(20),
+    sex VARCHAR(1),
+    activity_status VARCHAR(1),
+    title_group VARCHAR(12),  -- 'GM', 'NT' or 'other_titles', as in the Title filter.
+    age_category VARCHAR(12),
+    rating_bucket INT,  -- Rating rounded down to a multiple of 100.
+    player_count INT NOT NULL
+);
+
+CREATE INDEX idx_cube_ongoing_date ON player_filter_cube (ongoing_date);
+
+-- Initial load of the whole history.
+INSERT INTO player_filter_cube (ongoing_date, fed, continent, sex, activity_status,
+                                title_group, age_category, rating_bucket, player_count)
+SELECT
+    muomv.ongoing_date,
+    muomv.fed,
+    c.continent,
+    p.sex,
+    muomv.activity_status,
+    CASE
+        WHEN muomv.title = 'GM' THEN 'GM'
+        WHEN muomv.title = 'NT' THEN 'NT'
+        WHEN muomv.title IN ('CM','FM','IM','WCM','WFM','WGM','WH','WIM') THEN 'other_titles'
+    END AS title_group,
+    muomv.age_category,
+    CAST(FLOOR(muomv.rating / 100) * 100 AS INT) AS rating_bucket,
+    COUNT(*) AS player_count
+FROM montlhyupdate_open_players_with_age_group muomv
+LEFT JOIN players p ON muomv.ID = p.ID
+LEFT JOIN countries c ON muomv.fed = c.code
+GROUP BY 1, 2, 3, 4, 5, 6, 7, 8;
+
+-----------------------------------------------------------------------------
+-- Table rating_sketch
+-----------------------------------------------------------------------------
+
+-- Histogram of the ratings (bins of 10 points) per month and per combination of the
+-- filters of the app. Histograms can be summed, so the median of any selection is
+-- read from the merged histogram instead of sorting the ratings of every group; it is
+-- off by less than one bin. The monthly update recomputes the rows of the new month
+-- (refresh_rating_sketch).
+CREATE TABLE rating_sketch (
+    ongoing_date DATE NOT NULL,
+    fed VARCHAR(3),
+    sex VARCHAR(1),
+    activity_status VARCHAR(1),
+    title VARCHAR(3),
+    age_category VARCHAR(12),
+    rating_bin INT NOT NULL,  -- Rating rounded down to a multiple of 10.
+    player_count INT NOT NULL
+);
+
+CREATE INDEX idx_sketch_ongoing_date ON rating_sketch (ongoing_date);
+CREATE INDEX idx_sketch_fed ON rating_sketch (fed);
+
+-- Initial load of the whole history.
+INSERT INTO rating_sketch (ongoing_date, fed, sex, activity_status,
+                           title, age_category, rating_bin, player_count)
+SELECT
+    muomv.ongoing_date,
+    muomv.fed,
+    p.sex,
+    muomv.activity_status,
+    muomv.title,
+    muomv.age_category,
+    CAST(FLOOR(muomv.rating / 10) * 10 AS INT) AS rating_bin,
+    COUNT(*) AS player_count
+FROM montlhyupdate_open_players_with_age_group muomv
+LEFT JOIN players p ON muomv.ID = p.ID
+GROUP BY 1, 2, 3, 4, 5, 6, 7;
+
+-----------------------------------------------------------------------------
+-- Table etl_runs
+-----------------------------------------------------------------------------
+
+-- One row per run of the monthly update: the FIDE list it read (and the hash of its
+-- content), the month of the list, how long each stage took and how many rows were
+-- written. A run whose list was already loaded with the same content stops at once.
+CREATE TABLE etl_runs (
+    id SERIAL PRIMARY KEY,
+    source_file TEXT NOT NULL,
+    source_hash VARCHAR(64) NOT NULL,  -- SHA-256 of the FIDE list.
+    snapshot_date DATE NOT NULL,
+    top_k INT NOT NULL,  -- Number of players kept per federation.
+    forced BOOLEAN NOT NULL DEFAULT FALSE,
+    status VARCHAR(9) NOT NULL,  -- 'running', 'succeeded' or 'failed'.
+    stage_durations JSONB NOT NULL DEFAULT '{}',  -- Seconds per stage.
+    row_counts JSONB NOT NULL DEFAULT '{}',  -- Rows written per table.
+    started_at TIMESTAMP NOT NULL DEFAULT now(),
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX idx_etl_runs_source_hash ON etl_runs (source_hash);
@@ -2,13 +2,26 @@ import pandas as pd
 import numpy as np
 #from dotenv import load_dotenv
 #import os
-from sqlalchemy import create_engine
+import threading
+import json
+import functools
+import inspect
+import hashlib
+import datetime
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, fields, replace
+from sqlalchemy import create_engine, text, bindparam
+from sqlalchemy.engine import Engine
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql.elements import TextClause
 import plotly.express as px
 import plotly.graph_objects as go
-from typing import Optional, Union
-from typing import Optional, Dict
+import plotly.io as pio
+from typing import Optional, Union, Dict, Tuple, Any, Callable
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 #load_dotenv()
 ###################################################
@@ -31,22 +44,190 @@ def get_connection_url() -> str:
 
     return connection_string   
 
-@st.cache_data
-def load_data(query: str) -> pd.DataFrame:
+# Pool settings, they can be overridden from the Streamlit secrets
+DB_POOL_SIZE = 5
+DB_MAX_OVERFLOW = 5
+DB_POOL_TIMEOUT = 30
+DB_POOL_RECYCLE = 1800
+
+@st.cache_resource
+def get_engine() -> Engine:
+    """
+    Create the SQLAlchemy engine shared by every query of the app.
+
+    The engine (and its connection pool) is created once per process, so cache misses
+    of `load_data` reuse open connections instead of paying a new TCP/TLS handshake.
+    Connections are checked with a pre-ping before use and recycled periodically, since
+    Cloud SQL closes idle connections.
+    Returns:
+        Engine: The pooled SQLAlchemy engine.
+    """
+    pool_size = int(st.secrets.get("DB_POOL_SIZE", DB_POOL_SIZE))
+    engine = create_engine(
+        get_connection_url(),
+        pool_size=pool_size,
+        max_overflow=int(st.secrets.get("DB_MAX_OVERFLOW", DB_MAX_OVERFLOW)),
+        pool_timeout=int(st.secrets.get("DB_POOL_TIMEOUT", DB_POOL_TIMEOUT)),
+        pool_recycle=int(st.secrets.get("DB_POOL_RECYCLE", DB_POOL_RECYCLE)),
+        pool_pre_ping=True,
+    )
+    # Open the pool connections in the background so the first queries of the app
+    # do not wait for the handshakes one after another
+    threading.Thread(target=warm_up_engine, args=(engine, pool_size), daemon=True).start()
+
+    return engine
+
+def warm_up_engine(engine: Engine, connections: int) -> None:
+    """
+    Open `connections` connections at once, one thread each, and give them back to the
+    pool, so they are already established when the pages start querying the database.
+    Args:
+        engine (Engine): The pooled engine to warm up.
+        connections (int): Number of connections to open.
+    """
+    opened, errors = [], []
+    with ThreadPoolExecutor(max_workers=max(1, connections)) as executor:
+        for future in [executor.submit(engine.connect) for _ in range(connections)]:
+            try:
+                opened.append(future.result())
+            except SQLAlchemyError as e:
+                errors.append(e)
+    # Every connection is held until all are open, so the pool cannot hand the same one twice
+    for conn in opened:
+        conn.close()
+    if errors:
+        print(f"Connection pool warm up failed for {len(errors)} connections: {errors[0]}")
+    if opened:
+        print(f"Connection pool warmed up with {len(opened)} connections")
+
+def statement_cache_key(statement: TextClause) -> Tuple[str, Tuple]:
+    """
+    Return the cache key of a parameterized statement: its SQL text plus its bound values,
+    with the arrays as tuples. The values come from a normalized FilterSpec, so the same
+    logical selection always produces the same key.
+    """
+    params = statement.compile().params
+    # Array values (snapshot dates, quantiles) are bound as lists, the key needs them hashable
+    return statement.text, tuple(sorted((name, tuple(value) if isinstance(value, (list, np.ndarray)) else value)
+                                        for name, value in params.items()))
+
+###################################################
+# Dataset version
+###################################################
+
+# How often the app checks whether the monthly update loaded new data
+DATASET_VERSION_CHECK_SECONDS = 300
+# Number of recently used queries refreshed in the background when the data changes
+RECENT_QUERIES_TO_REFRESH = 200
+# Entries of previous versions are not used anymore, they expire with the time to live
+CACHE_TTL_SECONDS = 7 * 24 * 3600
+CACHE_MAX_ENTRIES = 2000
+
+def probe_dataset_version() -> str:
+    """
+    Read the version of the data from the dataset_metadata table, which the monthly update
+    maintains: the latest ongoing_date plus a counter incremented on every load.
+    Returns:
+        str: The dataset version, e.g. '2025-03-01#42'.
+    Raises:
+        RuntimeError: If the database connection cannot be established or the query fails.
+    """
+    query = "SELECT latest_date, load_counter FROM dataset_metadata"
+    try:
+        with get_engine().connect() as conn:
+            row = conn.execute(text(query)).one()
+    except SQLAlchemyError as e:
+        raise RuntimeError(f"Database connection or query execution failed: {e}")
+    return f"{row.latest_date}#{row.load_counter}"
+
+class DatasetVersion:
+    """
+    Version of the data served by this process.
+
+    The version is folded into the cache keys of load_data, so a monthly update only
+    makes the previous entries unreachable instead of dropping the whole cache. The
+    database is probed at most every `check_interval` seconds, in the background. When
+    the version changes, the queries used recently are run again for the new version
+    while the readers keep getting the previous (stale) results, and the new version is
+    served once they are cached (stale-while-revalidate).
+    """
+
+    def __init__(self, check_interval: int = DATASET_VERSION_CHECK_SECONDS):
+        self.check_interval = check_interval
+        self.current = None
+        self._checked_at = 0.0
+        self._revalidating = False
+        self._lock = threading.Lock()
+        self._recent_queries = OrderedDict()
+
+    def get(self) -> str:
+        """Return the version to serve, starting a background check when one is due."""
+        with self._lock:
+            now = time.monotonic()
+            check_due = now - self._checked_at >= self.check_interval and not self._revalidating
+            if check_due:
+                self._checked_at = now
+                self._revalidating = self.current is not None
+
+        if self.current is None:
+            self.current = probe_dataset_version()
+        elif check_due:
+            threading.Thread(target=self._revalidate, daemon=True).start()
+
+        return self.current
+
+    def track(self, query: Union[str, TextClause]) -> None:
+        """Remember a query so it is refreshed when a new version is loaded."""
+        key = query if isinstance(query, str) else statement_cache_key(query)
+        with self._lock:
+            self._recent_queries[key] = query
+            self._recent_queries.move_to_end(key)
+            while len(self._recent_queries) > RECENT_QUERIES_TO_REFRESH:
+                self._recent_queries.popitem(last=False)
+
+    def _revalidate(self) -> None:
+        try:
+            latest = probe_dataset_version()
+            if latest != self.current:
+                print(f"Dataset version changed from {self.current} to {latest}, refreshing the cache...")
+                with self._lock:
+                    queries = list(self._recent_queries.values())
+                for query in queries:
+                    _load_data(query, latest)
+                self.current = latest
+                print(f"{len(queries)} queries refreshed for dataset version {latest}")
+        except RuntimeError as e:
+            print(f"Dataset version check failed: {e}")
+        finally:
+            self._revalidating = False
+
+@st.cache_resource
+def get_dataset_version() -> DatasetVersion:
+    """Return the DatasetVersion shared by all the sessions of the process."""
+    return DatasetVersion()
+
+def load_data(query: Union[str, TextClause]) -> pd.DataFrame:
     """
-    Test the connection to the database, then execute a SQL query and return the results as a pandas DataFrame.
+    Execute a SQL query on the shared connection pool and return the results as a pandas DataFrame.
+    Results are cached per dataset version.
     Args:
-        query (str): The SQL query to execute.
+        query (Union[str, TextClause]): The SQL query to execute, plain or with bound parameters.
     Returns:
         pd.DataFrame: Query results as a DataFrame.
     Raises:
         RuntimeError: If the database connection cannot be established or the query fails.
     """
+    dataset_version = get_dataset_version()
+    version = dataset_version.get()
+    dataset_version.track(query)
+    
+    return _load_data(query, version)
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES, hash_funcs={TextClause: statement_cache_key})
+def _load_data(query: Union[str, TextClause], version: str) -> pd.DataFrame:
     try:
-        # Create the engine and execute the query
-        engine = create_engine(get_connection_url())
-        with engine.connect() as conn:
-            print("Connection successful!")
+        # Borrow a connection from the pool and execute the query
+        with get_engine().connect() as conn:
             # Execute the query
             df = pd.read_sql_query(query, conn)
             
@@ -57,43 +238,275 @@ def load_data(query: str) -> pd.DataFrame:
     except SQLAlchemyError as e:
         raise RuntimeError(f"Database connection or query execution failed: {e}")
 
+# Number of queries of a batch run at the same time, each one holds a connection of the pool
+QUERY_WORKERS = DB_POOL_SIZE
+
+@st.cache_resource
+def get_query_executor() -> ThreadPoolExecutor:
+    """
+    Create the thread pool shared by the sessions of the process to run the queries of
+    load_data_batch. It is not larger than the connection pool, so the queries of a batch
+    do not queue for connections.
+    """
+    workers = int(st.secrets.get("QUERY_WORKERS", QUERY_WORKERS))
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="load_data")
+
+def load_data_batch(queries: Dict[str, Union[str, TextClause]]) -> Dict[str, pd.DataFrame]:
+    """
+    Execute several SQL queries at the same time and return their results together, so a
+    page waits for its slowest query instead of the sum of its queries. The results are
+    cached as with load_data, so the cached queries return at once and only the others
+    reach the database, each one on its own connection of the pool.
+    Args:
+        queries (Dict[str, Union[str, TextClause]]): The queries to execute, by name.
+    Returns:
+        Dict[str, pd.DataFrame]: The results of the queries, by the same names.
+    Raises:
+        RuntimeError: If the database connection cannot be established or a query fails.
+    """
+    dataset_version = get_dataset_version()
+    version = dataset_version.get()
+    for query in queries.values():
+        dataset_version.track(query)
+
+    if len(queries) <= 1:
+        return {name: _load_data(query, version) for name, query in queries.items()}
+
+    # The worker threads run inside the session of the page, as load_data would
+    ctx = get_script_run_ctx()
+    def run_query(query: Union[str, TextClause]) -> pd.DataFrame:
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return _load_data(query, version)
+
+    futures = {name: get_query_executor().submit(run_query, query) for name, query in queries.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+###################################################
+# Figure cache
+###################################################
+
+# Size of the serialized figures kept by the process, it can be overridden from the Streamlit secrets
+FIGURE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Budget of the JSON of one figure, sent to the browser on every rerun, so the charts keep their
+# size flat as months are added
+FIGURE_JSON_MAX_BYTES = 256 * 1024
+# Levels of detail tried by build_within_budget, a builder shows about 1/detail of its frames or points
+FIGURE_DETAIL_LEVELS = (1, 2, 4, 8, 16)
+
+class FigureCache:
+    """
+    Figures already built by the chart builders, kept as Plotly JSON and shared by the
+    sessions of the process. The least recently used figures are evicted once the JSON
+    kept exceeds `max_bytes`.
+    """
+
+    def __init__(self, max_bytes: int = FIGURE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.largest = {}
+        self.overruns = {}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record_size(self, chart: str, size: int) -> None:
+        """Remember the largest JSON built by a chart builder."""
+        with self._lock:
+            self.largest[chart] = max(size, self.largest.get(chart, 0))
+
+    def record_overrun(self, chart: str) -> None:
+        """Count a figure of a chart builder still over FIGURE_JSON_MAX_BYTES with the least detail."""
+        with self._lock:
+            self.overruns[chart] = self.overruns.get(chart, 0) + 1
+
+    def get(self, key: Tuple) -> Optional[str]:
+        """Return the JSON of a figure, None if it is not cached."""
+        with self._lock:
+            figure_json = self._entries.get(key)
+            if figure_json is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return figure_json
+
+    def put(self, key: Tuple, figure_json: str) -> None:
+        """Keep the JSON of a figure, evicting the least recently used ones to stay under max_bytes."""
+        size = len(figure_json)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= len(self._entries.pop(key))
+            self._entries[key] = figure_json
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the number of figures, bytes, hits and misses of the cache, the largest figure
+        and the number of figures over budget per chart.
+        """
+        with self._lock:
+            return {'figures': len(self._entries), 'bytes': self.bytes, 'hits': self.hits, 'misses': self.misses,
+                    'largest': dict(self.largest), 'overruns': dict(self.overruns)}
+
+@st.cache_resource
+def get_figure_cache() -> FigureCache:
+    """Return the FigureCache shared by all the sessions of the process."""
+    return FigureCache(int(st.secrets.get("FIGURE_CACHE_MAX_BYTES", FIGURE_CACHE_MAX_BYTES)))
+
+def figure_cache_key_part(value: Any) -> Any:
+    """
+    Return a hashable fingerprint of an argument of a chart builder. Queries are reduced to
+    their SQL text and bound values (the normalized filters), frames to a hash of their content.
+    """
+    if isinstance(value, TextClause):
+        return statement_cache_key(value)
+    if isinstance(value, pd.DataFrame):
+        digest = hashlib.sha256(repr(list(value.dtypes.items())).encode())
+        try:
+            digest.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+        except TypeError:
+            # Columns holding lists (the histograms of the rating summaries) cannot be hashed
+            digest.update(value.to_json(orient='split', date_format='iso').encode())
+        return digest.hexdigest()
+    if isinstance(value, dict):
+        return tuple((k, figure_cache_key_part(v)) for k, v in sorted(value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(figure_cache_key_part(v) for v in value)
+    return repr(value)
+
+def build_within_budget(builder: Callable[..., go.Figure],
+                        args: tuple = (),
+                        kwargs: Optional[dict] = None,
+                        max_bytes: int = FIGURE_JSON_MAX_BYTES) -> Tuple[go.Figure, str]:
+    """
+    Build a figure whose JSON fits in max_bytes. A builder taking a `detail` argument is built
+    again with the levels of FIGURE_DETAIL_LEVELS (fewer frames or points) until its figure fits.
+    A figure still over the budget with the least detail is logged and returned as it is, the
+    page shows it rather than failing (cached_figure counts it in the FigureCache overruns).
+    Args:
+        builder (Callable[..., go.Figure]): The chart builder, not wrapped by cached_figure.
+        args (tuple): Positional arguments of the builder.
+        kwargs (Optional[dict]): Keyword arguments of the builder.
+        max_bytes (int): Budget of the JSON of the figure.
+    Returns:
+        Tuple[go.Figure, str]: The figure and its JSON.
+    """
+    kwargs = kwargs or {}
+    levels = FIGURE_DETAIL_LEVELS if 'detail' in inspect.signature(builder).parameters else (None,)
+    for detail in levels:
+        fig = builder(*args, **kwargs) if detail is None else builder(*args, detail=detail, **kwargs)
+        figure_json = pio.to_json(fig, validate=False)
+        if len(figure_json) <= max_bytes:
+            if detail is not None and detail > 1:
+                print(f"The {builder.__name__} figure is built with detail {detail} "
+                      f"to fit in {max_bytes} bytes ({len(figure_json)} bytes)")
+            return fig, figure_json
+    print(f"The {builder.__name__} figure is {len(figure_json)} bytes with the least detail, "
+          f"over the budget of {max_bytes} bytes")
+    return fig, figure_json
+
+def check_figure_budget(cache: Optional[FigureCache] = None, max_bytes: int = FIGURE_JSON_MAX_BYTES) -> None:
+    """
+    Check that every figure built so far by the chart builders fits in the budget, from the
+    sizes recorded by the FigureCache. Meant for a smoke run over the pages after a change of
+    the charts or a load of new months.
+    Args:
+        cache (Optional[FigureCache]): The cache holding the sizes, the one of the process by default.
+        max_bytes (int): Budget of the JSON of one figure.
+    Raises:
+        RuntimeError: If the JSON of a figure was over the budget.
+    """
+    stats = (cache or get_figure_cache()).stats()
+    over = {chart: size for chart, size in stats['largest'].items() if size > max_bytes}
+    if over:
+        raise RuntimeError(f"Figures over the budget of {max_bytes} bytes: "
+                           + ", ".join(f"{chart} ({size} bytes)" for chart, size in sorted(over.items())))
+
+def cached_figure(builder: Callable[..., go.Figure]) -> Callable[..., go.Figure]:
+    """
+    Serve the figures of a chart builder from the FigureCache, keyed by the chart type, the
+    dataset version and the arguments of the builder. On a hit the figure is rebuilt from its
+    JSON without validation, instead of running the builder (pandas reshaping, Plotly Express
+    and the validation of every property) again. On a miss the figure is built within
+    FIGURE_JSON_MAX_BYTES (build_within_budget).
+    """
+    @functools.wraps(builder)
+    def wrapper(*args, **kwargs) -> go.Figure:
+        key = (builder.__name__, get_dataset_version().get(),
+               figure_cache_key_part(args), figure_cache_key_part(kwargs))
+        cache = get_figure_cache()
+        figure_json = cache.get(key)
+        if figure_json is not None:
+            return go.Figure(json.loads(figure_json), _validate=False)
+
+        fig, figure_json = build_within_budget(builder, args, kwargs)
+        cache.record_size(builder.__name__, len(figure_json))
+        if len(figure_json) > FIGURE_JSON_MAX_BYTES:
+            cache.record_overrun(builder.__name__)
+        cache.put(key, figure_json)
+        return fig
+
+    return wrapper
+
+def get_dataset_metadata() -> Dict[str, Any]:
+    """
+    Read the snapshot dates, the latest month and the latest year of the loaded data from
+    the dataset_metadata table, which the monthly update maintains.
+    Returns:
+        Dict[str, Any]: 'snapshot_dates' (tuple of datetime.date, ascending), 'latest_month'
+            and 'latest_year' (int).
+    """
+    query = "SELECT snapshot_dates, latest_month, latest_year FROM dataset_metadata"
+    row = load_data(query).iloc[0]
+    return {'snapshot_dates': tuple(sorted(row['snapshot_dates'])),
+            'latest_month': int(row['latest_month']),
+            'latest_year': int(row['latest_year'])}
+
+def latest_month_snapshot_dates() -> Tuple[datetime.date, ...]:
+    """Return the snapshots taken in the latest month of each year (one per year)."""
+    metadata = get_dataset_metadata()
+    return tuple(date for date in metadata['snapshot_dates'] if date.month == metadata['latest_month'])
+
 ###################################################
 # queries
 ###################################################   
 
-def get_main_query(filters:list) -> str:
+def get_main_query(filters: "FilterSpec") -> TextClause:
     
     # Base query components
     with_clause = """
     WITH pre_aggregations AS (
         SELECT 
-            muomv.ongoing_date,
-            COUNT(*) AS total_players,
-            COUNT(CASE WHEN sex = 'M' THEN 1 END) AS total_men,
-            COUNT(CASE WHEN sex = 'F' THEN 1 END) AS total_women,
-            COUNT(CASE WHEN c.continent = 'Asia' THEN 1 END) AS total_Asia,
-            COUNT(CASE WHEN c.continent = 'Oceania' THEN 1 END) AS total_Oceania,
-            COUNT(CASE WHEN c.continent = 'Africa' THEN 1 END) AS total_Africa,
-            COUNT(CASE WHEN c.continent = 'Europe' THEN 1 END) AS total_Europe,
-            COUNT(CASE WHEN c.continent = 'Americas' THEN 1 END) AS total_Americas,  
-            COUNT(CASE WHEN muomv.title IN ('CM','FM','IM','WCM','WFM','WGM','WH','WIM')  THEN 1 END)  AS total_other_titles,
-            COUNT(CASE WHEN muomv.title = 'GM' THEN 1 END)  AS total_GM,
-            COUNT(CASE WHEN muomv.title = 'NT' THEN 1 END)  AS total_NT,    
-            COUNT(CASE WHEN muomv.activity_status = 'a' THEN 1 END)  AS total_active_players,
-            COUNT(CASE WHEN muomv.activity_status = 'i' THEN 1 END) AS total_inactive_players,    
-            COUNT(CASE WHEN muomv.age_category = 'Less than 19' THEN 1 END)  AS total_less_than_19,
-            COUNT(CASE WHEN muomv.age_category = '19-30' THEN 1 END) AS total_19_to_30,
-            COUNT(CASE WHEN muomv.age_category = '31-40' THEN 1 END) AS total_31_to_40,
-            COUNT(CASE WHEN muomv.age_category = '41-50' THEN 1 END) AS total_41_to_50,
-            COUNT(CASE WHEN muomv.age_category = '51-65' THEN 1 END) AS total_51_to_65,
-            COUNT(CASE WHEN muomv.age_category = 'More than 66' THEN 1 END)  AS total_more_than_66
-        FROM   montlhyupdate_open_players_with_age_group_mv muomv
-        LEFT JOIN players p ON muomv.ID = p.ID
-        LEFT JOIN countries c ON muomv.fed = c.code
-    """
-    with_clause += " WHERE " + " AND ".join(filters)
-    with_clause += """
-    GROUP BY ongoing_date
+            pfc.ongoing_date,
+            SUM(pfc.player_count) AS total_players,
+            SUM(CASE WHEN pfc.sex = 'M' THEN pfc.player_count ELSE 0 END) AS total_men,
+            SUM(CASE WHEN pfc.sex = 'F' THEN pfc.player_count ELSE 0 END) AS total_women,
+            SUM(CASE WHEN pfc.continent = 'Asia' THEN pfc.player_count ELSE 0 END) AS total_Asia,
+            SUM(CASE WHEN pfc.continent = 'Oceania' THEN pfc.player_count ELSE 0 END) AS total_Oceania,
+            SUM(CASE WHEN pfc.continent = 'Africa' THEN pfc.player_count ELSE 0 END) AS total_Africa,
+            SUM(CASE WHEN pfc.continent = 'Europe' THEN pfc.player_count ELSE 0 END) AS total_Europe,
+            SUM(CASE WHEN pfc.continent = 'Americas' THEN pfc.player_count ELSE 0 END) AS total_Americas,  
+            SUM(CASE WHEN pfc.title_group = 'other_titles' THEN pfc.player_count ELSE 0 END)  AS total_other_titles,
+            SUM(CASE WHEN pfc.title_group = 'GM' THEN pfc.player_count ELSE 0 END)  AS total_GM,
+            SUM(CASE WHEN pfc.title_group = 'NT' THEN pfc.player_count ELSE 0 END)  AS total_NT,    
+            SUM(CASE WHEN pfc.activity_status = 'a' THEN pfc.player_count ELSE 0 END)  AS total_active_players,
+            SUM(CASE WHEN pfc.activity_status = 'i' THEN pfc.player_count ELSE 0 END) AS total_inactive_players,    
+            SUM(CASE WHEN pfc.age_category = 'Less than 19' THEN pfc.player_count ELSE 0 END)  AS total_less_than_19,
+            SUM(CASE WHEN pfc.age_category = '19-30' THEN pfc.player_count ELSE 0 END) AS total_19_to_30,
+            SUM(CASE WHEN pfc.age_category = '31-40' THEN pfc.player_count ELSE 0 END) AS total_31_to_40,
+            SUM(CASE WHEN pfc.age_category = '41-50' THEN pfc.player_count ELSE 0 END) AS total_41_to_50,
+            SUM(CASE WHEN pfc.age_category = '51-65' THEN pfc.player_count ELSE 0 END) AS total_51_to_65,
+            SUM(CASE WHEN pfc.age_category = 'More than 66' THEN pfc.player_count ELSE 0 END)  AS total_more_than_66
+        FROM   player_filter_cube pfc
+        LEFT JOIN countries c ON pfc.fed = c.code
+        WHERE {where}
+    GROUP BY pfc.ongoing_date
     )
     """    
     # Final SELECT statement
@@ -121,79 +534,236 @@ def get_main_query(filters:list) -> str:
     FROM pre_aggregations
     ORDER BY ongoing_date ASC
     """    
-    return query
+    return filter_statement(query, filters, columns=CUBE_FILTER_COLUMNS)
 
-def get_rating_query(filters:list) -> str:
+def get_rating_query(filters: "FilterSpec") -> TextClause:
+    """
+    Build the query summarising the rating distribution of each month: number of players,
+    mean, min, max, quantiles and a histogram with bins of RATING_HISTOGRAM_BIN_WIDTH
+    points. The violin charts draw their densities from this summary instead of
+    receiving every individual rating.
+    Args:
+        filters (FilterSpec): The selection to apply.
+    Returns:
+        TextClause: One row per month with the columns date, n, mean, min, max,
+            quantiles (RATING_SUMMARY_QUANTILES), bins and bin_counts.
+    """
 
     query_rating = """
-        SELECT muomv.ongoing_date as date,
-    muomv.rating
-    FROM montlhyupdate_open_players_with_age_group_mv muomv
-    LEFT JOIN players p ON muomv.ID = p.ID
-    LEFT JOIN countries c ON muomv.fed = c.code
+    WITH ratings AS (
+        SELECT muomv.ongoing_date,
+            muomv.rating
+        FROM montlhyupdate_open_players_with_age_group muomv
+        LEFT JOIN players p ON muomv.ID = p.ID
+        LEFT JOIN countries c ON muomv.fed = c.code
+        WHERE {where}
+    ),
+    summary AS (
+        SELECT ongoing_date,
+            COUNT(*) AS n,
+            CAST(AVG(rating) AS FLOAT) AS mean,
+            MIN(rating) AS min,
+            MAX(rating) AS max,
+            PERCENTILE_CONT(CAST(:quantiles AS FLOAT[])) WITHIN GROUP (ORDER BY rating) AS quantiles
+        FROM ratings
+        GROUP BY ongoing_date
+    ),
+    histogram AS (
+        SELECT ongoing_date,
+            ARRAY_AGG(rating_bin ORDER BY rating_bin) AS bins,
+            ARRAY_AGG(bin_count ORDER BY rating_bin) AS bin_counts
+        FROM (
+            SELECT ongoing_date,
+                CAST(FLOOR(rating / :bin_width) * :bin_width AS INT) AS rating_bin,
+                COUNT(*) AS bin_count
+            FROM ratings
+            GROUP BY 1, 2
+        ) bins
+        GROUP BY ongoing_date
+    )
+    SELECT s.ongoing_date AS date,
+        s.n,
+        s.mean,
+        s.min,
+        s.max,
+        s.quantiles,
+        h.bins,
+        h.bin_counts
+    FROM summary s
+    JOIN histogram h ON h.ongoing_date = s.ongoing_date
+    ORDER BY s.ongoing_date ASC
+    """
+
+    return filter_statement(query_rating,
+                            filters,
+                            bin_width=RATING_HISTOGRAM_BIN_WIDTH,
+                            quantiles=list(RATING_SUMMARY_QUANTILES))
 
+def exact_medians(exact: Optional[bool] = None) -> bool:
     """
-    query_rating += " WHERE " + " AND ".join(filters)
-    
-    query_rating += " ORDER BY muomv.ongoing_date ASC"
+    Whether the medians are computed exactly with PERCENTILE_CONT instead of being read
+    from rating_sketch. Set EXACT_MEDIANS in the Streamlit secrets to check the sketch.
+    Args:
+        exact (Optional[bool]): Choice of the caller, it takes precedence over the secrets.
+    Returns:
+        bool: True to compute the medians exactly.
+    """
+    if exact is not None:
+        return exact
+    return bool(st.secrets.get("EXACT_MEDIANS", False))
 
-    return query_rating
+def sketch_median_query(groups: Dict[str, str]) -> str:
+    """
+    Build a query returning, per group, the median rating merged from the rating_sketch
+    histograms with the number of GMs and titled players. The median is interpolated
+    linearly inside the bin holding the middle player, so it is off by less than
+    RATING_HISTOGRAM_BIN_WIDTH points.
+    Args:
+        groups (Dict[str, str]): Output column of each grouping expression, e.g.
+            {'date': 'rs.ongoing_date'}.
+    Returns:
+        str: The query, with the `{where}` placeholder and the :bin_width parameter
+            left to filter_statement.
+    """
+    aliases = ", ".join(f'"{alias}"' for alias in groups)
+    select_groups = ",\n            ".join(f'{expression} AS "{alias}"' for alias, expression in groups.items())
+    group_by = ", ".join(groups.values())
 
-def get_continent_query_for_bubble_chart(continent:str) -> str:
-    
-    query = f"""
-    SELECT 
-    c.country,    
-    c.subregion,
-    mu.Ongoing_date AS "date",    
-    COUNT(CASE WHEN mu.title != 'NT' THEN 1 END) AS "count of titled players",
-    PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY mu.rating) AS "median of rating",
-    COUNT(CASE WHEN mu.title = 'GM' THEN 1 END) AS "count of Gm"
-    FROM montlhyupdates mu
-    LEFT JOIN countries c ON mu.fed = c.code    
-    WHERE continent = '{continent}'
-    
-    GROUP BY c.country, mu.Ongoing_date, c.continent, c.subregion
-    ORDER BY mu.Ongoing_date ASC,"median of rating" DESC
+    return f"""
+    WITH cells AS (
+        SELECT
+            {select_groups},
+            rs.rating_bin,
+            SUM(rs.player_count) AS player_count,
+            SUM(CASE WHEN rs.title = 'GM' THEN rs.player_count ELSE 0 END) AS gm_count,
+            SUM(CASE WHEN rs.title != 'NT' THEN rs.player_count ELSE 0 END) AS titled_count
+        FROM rating_sketch rs
+        LEFT JOIN countries c ON rs.fed = c.code
+        WHERE {{where}}
+        GROUP BY {group_by}, rs.rating_bin
+    ),
+    cumulative AS (
+        SELECT cells.*,
+            SUM(player_count) OVER (PARTITION BY {aliases} ORDER BY rating_bin) AS cumulative_count,
+            SUM(player_count) OVER (PARTITION BY {aliases}) AS total_count,
+            SUM(gm_count) OVER (PARTITION BY {aliases}) AS total_gm,
+            SUM(titled_count) OVER (PARTITION BY {aliases}) AS total_titled
+        FROM cells
+    )
+    SELECT
+        {aliases},
+        CAST(total_titled AS BIGINT) AS "count of titled players",
+        CAST(total_gm AS BIGINT) AS "count of Gm",
+        CAST(rating_bin + :bin_width * (total_count / 2.0 - (cumulative_count - player_count)) / player_count
+             AS FLOAT) AS "median of rating"
+    FROM cumulative
+    -- The bin holding the middle player
+    WHERE cumulative_count >= total_count / 2.0
+    AND cumulative_count - player_count < total_count / 2.0
+    """
+
+def get_landing_query(exact: Optional[bool] = None) -> TextClause:
+    """
+    Build the query of the landing page: median rating, number of GMs and of titled players
+    per country and month.
+    Args:
+        exact (Optional[bool]): Compute the medians exactly, see exact_medians.
+    Returns:
+        TextClause: The query.
+    """
+    if exact_medians(exact):
+        query = """
+        SELECT 
+        c.country,
+        c.continent,
+        mu.Ongoing_date AS "date",
+        COUNT(CASE WHEN mu.title = 'GM' THEN 1 END) AS "count of Gm",
+        COUNT(CASE WHEN mu.title != 'NT' THEN 1 END) AS "count of titled players",
+        PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY mu.rating) AS "median of rating"
+        FROM MontlhyUpdates mu
+        LEFT JOIN countries c ON mu.fed = c.code    
+        WHERE FED not in :excluded_feds
+        GROUP BY c.country, mu.Ongoing_date, c.continent
+        ORDER BY mu.Ongoing_date asc,"median of rating" DESC
+        """
+        return text(query).bindparams(bindparam('excluded_feds', value=EXCLUDED_FEDS, expanding=True))
 
+    query = sketch_median_query({'country': 'c.country',
+                                 'continent': 'c.continent',
+                                 'date': 'rs.ongoing_date'}) + """
+    ORDER BY "date" ASC, "median of rating" DESC
     """
+    filters = FilterSpec(excluded_feds=EXCLUDED_FEDS)
+    return filter_statement(query, filters, columns=SKETCH_FILTER_COLUMNS, bin_width=RATING_HISTOGRAM_BIN_WIDTH)
+
+def get_continent_query_for_bubble_chart(continent: str, exact: Optional[bool] = None) -> TextClause:
     
-    return query
+    if exact_medians(exact):
+        query = """
+        SELECT 
+        c.country,    
+        c.subregion,
+        mu.Ongoing_date AS "date",    
+        COUNT(CASE WHEN mu.title != 'NT' THEN 1 END) AS "count of titled players",
+        PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY mu.rating) AS "median of rating",
+        COUNT(CASE WHEN mu.title = 'GM' THEN 1 END) AS "count of Gm"
+        FROM montlhyupdates mu
+        LEFT JOIN countries c ON mu.fed = c.code    
+        WHERE continent = :continent
+        
+        GROUP BY c.country, mu.Ongoing_date, c.continent, c.subregion
+        ORDER BY mu.Ongoing_date ASC,"median of rating" DESC
 
-def get_continent_query_for_choropleth(continent:str) -> str:
-    query = f"""
+        """
+        return text(query).bindparams(continent=continent)
+
+    query = sketch_median_query({'country': 'c.country',
+                                 'subregion': 'c.subregion',
+                                 'date': 'rs.ongoing_date'}) + """
+    ORDER BY "date" ASC, "median of rating" DESC
+    """
+    filters = FilterSpec(continents=(continent,))
+    return filter_statement(query, filters, columns=SKETCH_FILTER_COLUMNS, bin_width=RATING_HISTOGRAM_BIN_WIDTH)
+
+def get_continent_query_for_choropleth(continent:str) -> TextClause:
+    query = """
     SELECT 
     c.country,     
     PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY muomv.rating) AS "median of rating"
-    FROM montlhyupdate_open_players_with_age_group_mv muomv
+    FROM montlhyupdate_open_players_with_age_group muomv
     LEFT JOIN countries c ON muomv.fed = c.code    
-    WHERE muomv.Ongoing_date = (select MAX(mu.Ongoing_date) from MontlhyUpdates mu)
-    AND continent = '{continent}'    
+    WHERE muomv.Ongoing_date = :latest_date
+    AND continent = :continent    
     GROUP BY c.country, muomv.Ongoing_date
     ORDER BY muomv.Ongoing_date ASC,"median of rating" DESC
 
 """
-    return query
+    latest_date = get_dataset_metadata()['snapshot_dates'][-1]
+    return text(query).bindparams(continent=continent, latest_date=latest_date)
 
-def get_country_query_for_bubble_chart(filters:list) -> str:
+def get_country_query_for_bubble_chart(filters: "FilterSpec", exact: Optional[bool] = None) -> TextClause:
     
-    query = f"""
+    if not exact_medians(exact):
+        query = sketch_median_query({'country': 'c.country', 'date': 'rs.ongoing_date'}) + """
+        ORDER BY "date" ASC, "median of rating" DESC
+        """
+        return filter_statement(query, filters, columns=SKETCH_FILTER_COLUMNS, bin_width=RATING_HISTOGRAM_BIN_WIDTH)
+
+    query = """
     SELECT 
     c.country,
     muomv.Ongoing_date AS "date",    
     COUNT(CASE WHEN muomv.title != 'NT' THEN 1 END) AS "count of titled players",
     PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY muomv.rating) AS "median of rating",
     COUNT(CASE WHEN muomv.title = 'GM' THEN 1 END) AS "count of Gm"
-    FROM montlhyupdate_open_players_with_age_group_mv muomv
+    FROM montlhyupdate_open_players_with_age_group muomv
     LEFT JOIN countries c ON muomv.fed = c.code
-    LEFT JOIN players p ON muomv.ID = p.ID"""
-    query += " WHERE " + " AND ".join(filters)    
-    query += """
-    
+    LEFT JOIN players p ON muomv.ID = p.ID
+    WHERE {where}
     GROUP BY c.country, muomv.Ongoing_date
     ORDER BY muomv.Ongoing_date ASC,"median of rating" DESC
     """
-    return query
+    return filter_statement(query, filters)
 
 def get_list_countries() -> list:
     query = """
@@ -208,33 +778,30 @@ def get_list_countries() -> list:
     
     return df['country'].tolist()
 
-def get_country_query_for_comparison_tool(filters:list) -> str:
+def get_country_query_for_comparison_tool(filters: "FilterSpec") -> TextClause:
     # Base query components
     with_clause = """
     WITH pre_aggregations AS (
         SELECT 
-            muomv.ongoing_date,
-            COUNT(*) AS total_players,
-            COUNT(CASE WHEN sex = 'M' THEN 1 END) AS total_men,
-            COUNT(CASE WHEN sex = 'F' THEN 1 END) AS total_women,                       
-            COUNT(CASE WHEN muomv.title IN ('CM','FM','IM','WCM','WFM','WGM','WH','WIM')  THEN 1 END)  AS total_other_titles,
-            COUNT(CASE WHEN muomv.title = 'GM' THEN 1 END)  AS total_GM,
-            COUNT(CASE WHEN muomv.title = 'NT' THEN 1 END)  AS total_NT,    
-            COUNT(CASE WHEN muomv.activity_status = 'a' THEN 1 END)  AS total_active_players,
-            COUNT(CASE WHEN muomv.activity_status = 'i' THEN 1 END) AS total_inactive_players,    
-            COUNT(CASE WHEN muomv.age_category = 'Less than 19' THEN 1 END)  AS total_less_than_19,
-            COUNT(CASE WHEN muomv.age_category = '19-30' THEN 1 END) AS total_19_to_30,
-            COUNT(CASE WHEN muomv.age_category = '31-40' THEN 1 END) AS total_31_to_40,
-            COUNT(CASE WHEN muomv.age_category = '41-50' THEN 1 END) AS total_41_to_50,
-            COUNT(CASE WHEN muomv.age_category = '51-65' THEN 1 END) AS total_51_to_65,
-            COUNT(CASE WHEN muomv.age_category = 'More than 66' THEN 1 END)  AS total_more_than_66
-        FROM   montlhyupdate_open_players_with_age_group_mv muomv
-        LEFT JOIN players p ON muomv.ID = p.ID
-        LEFT JOIN countries c ON muomv.fed = c.code
-    """
-    with_clause += " WHERE " + " AND ".join(filters)
-    with_clause += """
-    GROUP BY ongoing_date
+            pfc.ongoing_date,
+            SUM(pfc.player_count) AS total_players,
+            SUM(CASE WHEN pfc.sex = 'M' THEN pfc.player_count ELSE 0 END) AS total_men,
+            SUM(CASE WHEN pfc.sex = 'F' THEN pfc.player_count ELSE 0 END) AS total_women,                       
+            SUM(CASE WHEN pfc.title_group = 'other_titles' THEN pfc.player_count ELSE 0 END)  AS total_other_titles,
+            SUM(CASE WHEN pfc.title_group = 'GM' THEN pfc.player_count ELSE 0 END)  AS total_GM,
+            SUM(CASE WHEN pfc.title_group = 'NT' THEN pfc.player_count ELSE 0 END)  AS total_NT,    
+            SUM(CASE WHEN pfc.activity_status = 'a' THEN pfc.player_count ELSE 0 END)  AS total_active_players,
+            SUM(CASE WHEN pfc.activity_status = 'i' THEN pfc.player_count ELSE 0 END) AS total_inactive_players,    
+            SUM(CASE WHEN pfc.age_category = 'Less than 19' THEN pfc.player_count ELSE 0 END)  AS total_less_than_19,
+            SUM(CASE WHEN pfc.age_category = '19-30' THEN pfc.player_count ELSE 0 END) AS total_19_to_30,
+            SUM(CASE WHEN pfc.age_category = '31-40' THEN pfc.player_count ELSE 0 END) AS total_31_to_40,
+            SUM(CASE WHEN pfc.age_category = '41-50' THEN pfc.player_count ELSE 0 END) AS total_41_to_50,
+            SUM(CASE WHEN pfc.age_category = '51-65' THEN pfc.player_count ELSE 0 END) AS total_51_to_65,
+            SUM(CASE WHEN pfc.age_category = 'More than 66' THEN pfc.player_count ELSE 0 END)  AS total_more_than_66
+        FROM   player_filter_cube pfc
+        LEFT JOIN countries c ON pfc.fed = c.code
+        WHERE {where}
+    GROUP BY pfc.ongoing_date
     )
     """    
     # Final SELECT statement
@@ -257,7 +824,32 @@ def get_country_query_for_comparison_tool(filters:list) -> str:
     FROM pre_aggregations
     ORDER BY ongoing_date ASC
     """    
-    return query
+    return filter_statement(query, filters, columns=CUBE_FILTER_COLUMNS)
+
+def get_top_players_query(top_n: int = 5, scope: str = 'global', scope_value: str = 'world') -> TextClause:
+    """
+    Build the lookup of the top players of the latest month in the leaderboard table.
+    Args:
+        top_n (int): Number of players, at most the LEADERBOARD_TOP_N of the monthly update.
+        scope (str): 'global', 'continent' or 'federation'.
+        scope_value (str): 'world', the continent or the federation code.
+    Returns:
+        TextClause: The query returning id, name, rating and fed, best player first.
+    """
+    query = """
+    SELECT id,
+        name,
+        rating,
+        fed
+    FROM leaderboard
+    WHERE ongoing_date = :latest_date
+    AND scope = :scope
+    AND scope_value = :scope_value
+    AND rank <= :top_n
+    ORDER BY rank
+    """
+    latest_date = get_dataset_metadata()['snapshot_dates'][-1]
+    return text(query).bindparams(latest_date=latest_date, scope=scope, scope_value=scope_value, top_n=top_n)
 
 ###################################################
 # mesures
@@ -271,8 +863,9 @@ def get_min_rating(continent: Optional[str]=None) -> int:
     """
     
     if continent:
-        query += f""" LEFT JOIN countries c ON mu.fed = c.code
-                    WHERE continent = '{continent}';"""
+        query += """ LEFT JOIN countries c ON mu.fed = c.code
+                    WHERE continent = :continent;"""
+        query = text(query).bindparams(continent=continent)
     
     df = load_data(query)
     min_rating = df['min'].values[0]
@@ -286,26 +879,33 @@ def get_max_rating(continent: Optional[str]=None) -> int:
         FROM MontlhyUpdates mu        
     """
     if continent:
-        query += f""" LEFT JOIN countries c ON mu.fed = c.code
-                    WHERE continent = '{continent}';"""
+        query += """ LEFT JOIN countries c ON mu.fed = c.code
+                    WHERE continent = :continent;"""
+        query = text(query).bindparams(continent=continent)
                     
     df = load_data(query)
     max_rating = df['max'].values[0]
     
     return max_rating
 
-def get_average_of_median_rating_over_time(filters:list) -> int:
+def get_average_of_median_rating_query(filters: "FilterSpec", exact: Optional[bool] = None) -> TextClause:
     
+    if not exact_medians(exact):
+        query = """
+        SELECT 
+        ROUND(CAST(AVG("median of rating") AS numeric), 2) AS avg_median_rating
+        FROM (""" + sketch_median_query({'date': 'rs.ongoing_date'}) + """) preprocessing """
+        return filter_statement(query, filters, columns=SKETCH_FILTER_COLUMNS,
+                                bin_width=RATING_HISTOGRAM_BIN_WIDTH)
+
     with_clause = """
     WITH preprocessing as (
         SELECT muomv.ongoing_date as date,
         percentile_cont(0.5) WITHIN GROUP (order by muomv.rating) as median_rating
-    FROM montlhyupdate_open_players_with_age_group_mv muomv
+    FROM montlhyupdate_open_players_with_age_group muomv
     LEFT JOIN players p ON muomv.ID = p.ID
-    LEFT JOIN countries c ON muomv.fed = c.code """
-    
-    with_clause += " WHERE " + " AND ".join(filters)
-    with_clause += """
+    LEFT JOIN countries c ON muomv.fed = c.code
+    WHERE {where}
     GROUP BY muomv.ongoing_date
     )
     """ 
@@ -314,28 +914,36 @@ def get_average_of_median_rating_over_time(filters:list) -> int:
         ROUND(CAST(AVG(median_rating) AS numeric), 2) AS avg_median_rating
         FROM preprocessing """
         
-    df = load_data(query)
+    return filter_statement(query, filters)
+
+def get_average_of_median_rating_over_time(filters: "FilterSpec", exact: Optional[bool] = None) -> int:
+    
+    df = load_data(get_average_of_median_rating_query(filters, exact))
     average_of_median_rating_over_time = df['avg_median_rating'].values[0]
     
     return average_of_median_rating_over_time
 
-def get_count_unique_countries(filters:list) -> int:
+def get_count_unique_countries_query(filters: "FilterSpec") -> TextClause:
     query = """
         SELECT
     count(distinct country) as unique_countries
     FROM countries c 
-    RIGHT JOIN montlhyupdate_open_players_with_age_group_mv muomv ON c.code = muomv.fed
+    RIGHT JOIN montlhyupdate_open_players_with_age_group muomv ON c.code = muomv.fed
     LEFT JOIN players p ON muomv.ID = p.ID
+    WHERE {where}
     """
-    filters.append("FED not in ('NON','FID')")
-    query += " WHERE " + " AND ".join(filters)
+    filters = replace(filters, excluded_feds=filters.excluded_feds + EXCLUDED_FEDS)
     
-    df = load_data(query)
+    return filter_statement(query, filters)
+
+def get_count_unique_countries(filters: "FilterSpec") -> int:
+    
+    df = load_data(get_count_unique_countries_query(filters))
     count_unique_countries = df['unique_countries'].values[0]
     
     return count_unique_countries
 
-def get_metrics_comparison(query: str,
+def get_metrics_comparison(query: TextClause,
                            first_country: str,
                            second_country: str):
 
@@ -372,33 +980,50 @@ def get_metrics_comparison(query: str,
             first_country_count_titled_players, first_country_median_rating, first_country_count_gms,
             second_country_count_titled_players, second_country_median_rating, second_country_count_gms)
 
-def get_avg_rating_player_current_year(player_selected:str) -> pd.DataFrame:
-    query = f"""
-    SELECT avg(rating)
-    FROM montlhyupdates m 
-    WHERE m.id = (SELECT id
-                    FROM players p 
-                WHERE p.name = '{player_selected}') AND
-        EXTRACT(year from ongoing_date) = (SELECT get_last_year())
-    """
-    df = load_data(query=query)
-    return df
-
-def get_avg_games_played_monthly(player_selected:str) -> pd.DataFrame:    
-    query= f"""
-    SELECT avg(number_of_games)
-    FROM montlhyupdates m 
-    WHERE m.id = (select id
-				from players p 
-			where p.name = '{player_selected}')
-    """
-    df = load_data(query=query)
-    return df
+def get_player_profile(player_id: str) -> pd.DataFrame:
+    """
+    Fetch the monthly series of a player with the aggregates shown on the Top 5 page, in one
+    query on the (id, ongoing_date) primary key of montlhyupdates.
+    Args:
+        player_id (str): FIDE id of the player.
+    Returns:
+        pd.DataFrame: One row per month with the columns date, fed, rating, number_of_games,
+            avg_rating_current_year and avg_games_monthly (the same on every row).
+    """
+    query = text("""
+    SELECT
+        m.ongoing_date AS date,
+        m.fed,
+        m.rating,
+        m.number_of_games,
+        AVG(m.rating) FILTER (WHERE m.ongoing_date >= :year_start) OVER () AS avg_rating_current_year,
+        AVG(m.number_of_games) OVER () AS avg_games_monthly
+    FROM montlhyupdates m
+    WHERE m.id = :player_id
+    ORDER BY m.ongoing_date
+    """)
+    latest_year = get_dataset_metadata()['latest_year']
+    query = query.bindparams(player_id=player_id, year_start=datetime.date(latest_year, 1, 1))
+    return load_data(query=query)
+
+def get_avg_rating_player_current_year(profile: pd.DataFrame) -> float:
+    return profile['avg_rating_current_year'].values[0]
+
+def get_avg_games_played_monthly(profile: pd.DataFrame) -> float:
+    return profile['avg_games_monthly'].values[0]
     
 ###################################################
 # Charts
 ###################################################
 
+# Months between two frames of the bubble charts on first paint, one frame per quarter
+BUBBLE_CHART_FIRST_PAINT_STEP = 3
+# Points of the density curve of each violin, fewer (not under the minimum) to fit the figure budget
+RATING_KDE_POINTS = 50
+RATING_KDE_MIN_POINTS = 10
+# Most months labelled on a date axis, beyond that a label every few months
+MAX_MONTH_TICKS = 60
+
 def customize_title_charts(
     text: str,
     y: float = 0.93,
@@ -443,57 +1068,157 @@ def customize_title_charts(
 
     return title
         
-@st.cache_data
+def format_month_axis(fig: go.Figure, dates: pd.Series, tickangle: int = 45) -> None:
+    """
+    Label the date axis with the months (YYYY-MM). Plotly places the ticks from the format
+    and the step, instead of receiving every date as tick values and again as tick labels,
+    and labels every few months once there are more than MAX_MONTH_TICKS months.
+    Args:
+        fig (go.Figure): The figure whose x axis is labelled.
+        dates (pd.Series): The dates drawn.
+        tickangle (int): Angle of the labels.
+    """
+    step = max(1, -(-pd.Series(dates).nunique() // MAX_MONTH_TICKS))
+    fig.update_xaxes(tickformat="%Y-%m", dtick=f"M{step}", tickangle=tickangle)
+
+def decimate_months(dates: list, step: int) -> list:
+    """
+    Keep one month out of step, counting back from the latest month so it is always kept.
+    Args:
+        dates (list): The months, sorted.
+        step (int): Months between two kept months, 1 keeps them all.
+    Returns:
+        list: The kept months, sorted.
+    """
+    return dates[::-1][::max(1, step)][::-1]
+
+def decimate_frame(df: pd.DataFrame, detail: int) -> pd.DataFrame:
+    """
+    Keep the rows of one month out of detail (decimate_months), for the chart builders drawing
+    one point or bar per month.
+    Args:
+        df (pd.DataFrame): The data of the chart, with a 'date' column.
+        detail (int): Level of detail set by build_within_budget, 1 keeps every month.
+    Returns:
+        pd.DataFrame: The rows of the kept months.
+    """
+    if detail <= 1:
+        return df
+    return df[df["date"].isin(decimate_months(sorted(df["date"].unique()), detail))]
+
+@cached_figure
 def bubble_chart(
-    query: str,  # SQL query to fetch data
+    query: Union[str, TextClause],  # SQL query to fetch data
     color_column: str,  # Column to use for color encoding
-    text: str    # Text to customize the chart title
-) -> px.scatter:  # Returns a Plotly scatter plot object with animation
+    text: str,    # Text to customize the chart title
+    frame_step: int = 1,  # Months between two frames, BUBBLE_CHART_FIRST_PAINT_STEP for quarterly frames
+    detail: int = 1  # Level of detail set by build_within_budget, frame_step is multiplied by it
+) -> go.Figure:  # Returns a Plotly scatter plot object with animation
+    """
+    Animated bubble chart of the countries over the months. The traces (one per color) carry the
+    style and the country names once, the frames only carry the positions and sizes of each month.
+    """
 
     # Fetch data using the query and load it into a DataFrame
     df = load_data(query)
 
     # Convert the 'date' column to datetime format and then to "YYYY-MM" string format
     df['date'] = df["date"].dt.strftime("%Y-%m")
+    dates = decimate_months(sorted(df['date'].unique()), frame_step * detail)
+    df = df[df['date'].isin(dates)]
 
     # Define a custom color sequence for the chart
     custom_color_sequence = [ "cornflowerblue","darkkhaki","maroon", "olivedrab", "chocolate"]
-    # Create an animated scatter plot using Plotly
-    fig = px.scatter(
-        df,
-        y="count of Gm",         # X-axis: count of title players
-        x="median of rating",               # Y-axis: median of player ratings
-        animation_frame="date",             # Frames for animation are based on 'date'
-        animation_group="country",          # Groups animation transitions by 'country'
-        size="count of titled players",                 # Size of bubbles corresponds to the count of Grandmasters
-        hover_name="country",               # Hover displays the country name
-        color=color_column,                  # Bubbles are colored based on the continent
-        range_x=[1500, 2700],               # Y-axis range
-        range_y=[-20, 110],                   # X-axis range
-        color_discrete_sequence=custom_color_sequence,  # Use the custom color sequence
-        width=800,                          # Width of the chart
-        height=400                          # Height of the chart
-    )
+    # Colors in order of appearance, as plotly express does
+    groups = list(df[color_column].unique())
+    # Bubble area proportional to the count of titled players, the biggest one 40px wide
+    sizeref = 2. * max(df["count of titled players"].max(), 1) / (40 ** 2)
+
+    # Each trace keeps its countries in the same order in every frame, so the frames don't repeat
+    # the names: a country missing from a month is a gap (null) in that frame
+    countries = {group: sorted(df.loc[df[color_column] == group, "country"].unique()) for group in groups}
+
+    def frame_values(values: np.ndarray) -> list:
+        return [None if pd.isna(v) else (int(v) if float(v).is_integer() else float(v)) for v in values]
+
+    # One row per month, one column per country
+    x, y, size = (df.pivot_table(index="date", columns="country", values=column, aggfunc="first")
+                    .reindex(dates)
+                  for column in ("median of rating", "count of Gm", "count of titled players"))
+
+    size = size.fillna(0)
+    columns = {group: (x[countries[group]].to_numpy(), y[countries[group]].to_numpy(),
+                       size[countries[group]].to_numpy()) for group in groups}
+
+    def month_traces(row: int) -> list:
+        # Data-only traces of a month, merged into the traces of the figure by the animation
+        return [dict(type='scatter',
+                     x=frame_values(columns[group][0][row]),
+                     y=frame_values(columns[group][1][row]),
+                     marker=dict(size=frame_values(columns[group][2][row])))
+                for group in groups]
+
+    frames = [dict(name=date, data=month_traces(row), traces=list(range(len(groups))))
+              for row, date in enumerate(dates)]
+
+    # The figure starts on the first month, the style of the bubbles is only set here. The frames
+    # are built from plain values, the validation of thousands of points would double the time.
+    fig = go.Figure(frames=frames, _validate=False)
+    for i, (group, trace) in enumerate(zip(groups, frames[0]['data'] if frames else [])):
+        fig.add_trace(go.Scatter(
+            x=trace['x'],
+            y=trace['y'],
+            customdata=countries[group],
+            name=str(group),
+            legendgroup=str(group),
+            mode='markers',
+            marker=dict(size=trace['marker']['size'],
+                        color=custom_color_sequence[i % len(custom_color_sequence)],
+                        sizemode='area', sizeref=sizeref),
+            hovertemplate=("<b>%{customdata}</b><br><br>median of rating=%{x}<br>count of Gm=%{y}"
+                           "<br>count of titled players=%{marker.size}<extra></extra>")))
+
+    def frame_args(duration: int) -> dict:
+        return dict(frame=dict(duration=duration, redraw=False),
+                    transition=dict(duration=duration),
+                    mode='immediate', fromcurrent=True)
 
-       
     fig.update_layout(
+        xaxis=dict(range=[1500, 2700], title="median of rating"),   # X-axis range
+        yaxis=dict(range=[-20, 110], title="count of Gm"),          # Y-axis range
+        legend=dict(title=color_column, itemsizing='constant'),
+        width=800,                          # Width of the chart
+        height=400,                         # Height of the chart
         title=customize_title_charts(text=text),  # Title is dynamically customized using 'text'
         font=dict(
             family="Courier New, monospace",
-            size=12)
+            size=12),
+        updatemenus=[dict(type='buttons',
+                          direction='left',
+                          x=0.1, y=0, xanchor='right', yanchor='top',
+                          pad=dict(r=10, t=70),
+                          showactive=False,
+                          buttons=[dict(label='▶', method='animate', args=[None, frame_args(500)]),
+                                   dict(label='◼', method='animate', args=[[None], frame_args(0)])])],
+        sliders=[dict(active=0,
+                      x=0.1, y=0, len=0.9, xanchor='left', yanchor='top',
+                      pad=dict(b=10, t=60),
+                      currentvalue=dict(prefix='date='),
+                      steps=[dict(label=date, method='animate', args=[[date], frame_args(0)])
+                             for date in dates])]
     )
-    
+
     # Return the completed chart
     return fig
 
+@cached_figure
 def gender_bar_chart(
     df:pd.DataFrame,
     text:str,
-    subtitle: dict) -> go.Figure:
+    subtitle: dict,
+    detail: int = 1) -> go.Figure:  # Level of detail set by build_within_budget, one month out of detail is drawn
 
-    # Generate the tick values and labels
-    tick_vals = df["date"]
-    tick_labels = df["date"].dt.strftime("%Y-%m")
+    df = decimate_frame(df, detail)
 
     # Create the figure
     fig_gender = go.Figure()
@@ -501,7 +1226,7 @@ def gender_bar_chart(
     # Add the first bar trace (e.g., Men) with custom color
     fig_gender.add_trace(go.Bar(
         x=df["date"],
-        y=df["percentage_men"],
+        y=df["percentage_men"].round(4),
         name="Men",
         marker_color="cadetblue"  # Custom color
     ))
@@ -509,7 +1234,7 @@ def gender_bar_chart(
     # Add the second bar trace (e.g., Women) with custom color
     fig_gender.add_trace(go.Bar(
         x=df["date"],
-        y=df["percentage_women"],
+        y=df["percentage_women"].round(4),
         name="Women",
         marker_color="goldenrod"  # Custom color
     ))
@@ -531,23 +1256,19 @@ def gender_bar_chart(
             size=12)
         )
 
-    # Update x-axis to display custom tick labels
-    fig_gender.update_xaxes(
-        tickvals=tick_vals,
-        ticktext=tick_labels,
-        tickangle=45  # Rotate labels for better readability
-    )
+    # Label the months on the x-axis
+    format_month_axis(fig_gender, df["date"])
 
     return fig_gender
 
+@cached_figure
 def activity_status_bar_chart(
     df: pd.DataFrame,
     text: str,
-    subtitle: dict)-> go.Figure:
-    
-    # Generate the tick values and labels
-    tick_vals = df["date"]
-    tick_labels = df["date"].dt.strftime("%Y-%m")
+    subtitle: dict,
+    detail: int = 1)-> go.Figure:  # Level of detail set by build_within_budget, one month out of detail is drawn
+
+    df = decimate_frame(df, detail)
 
     # Create the figure
     fig_status_activity = go.Figure()
@@ -579,20 +1300,20 @@ def activity_status_bar_chart(
             family="Courier New, monospace",
             size=12)
     )
-    # Update x-axis to display custom tick labels
-    fig_status_activity.update_xaxes(
-        tickvals=tick_vals,
-        ticktext=tick_labels,
-        tickangle=45  # Rotate labels for better readability
-    )
+    # Label the months on the x-axis
+    format_month_axis(fig_status_activity, df["date"])
     
     return fig_status_activity
 
+@cached_figure
 def continents_line_chart(
     df: pd.DataFrame,
     #selected_continents: list,
     text: str,
-    subtitle: dict)-> go.Figure:
+    subtitle: dict,
+    detail: int = 1)-> go.Figure:  # Level of detail set by build_within_budget, one month out of detail is drawn
+
+    df = decimate_frame(df, detail)
 
     # option_continents = ['Oceania', 'Africa', 'Europe', 'Americas', 'Asia']
     
@@ -604,23 +1325,19 @@ def continents_line_chart(
     
     # df = df[columns_to_consider]
     
-    # Generate the tick values and labels
-    tick_vals = df["date"]
-    tick_labels = df["date"].dt.strftime("%Y-%m")
-
     fig_continents = go.Figure()
 
 #if 'Europe' in selected_continents:
     # Add the first bar trace (e.g., percentage_from_31_to_40)
     fig_continents.add_trace(go.Scatter(x=df["date"],
-                            y=df["percentage_europe"],
+                            y=df["percentage_europe"].round(4),
                             name="Europe",
                             marker_color="cornflowerblue")) # royalblue
 
 #if 'Asia' in selected_continents:
     # Add the first bar trace (e.g., percentage_asia)
     fig_continents.add_trace(go.Scatter(x=df["date"],
-                            y=df["percentage_asia"],
+                            y=df["percentage_asia"].round(4),
                             name="Asia",
                             marker_color="olivedrab")) # mediumaquamarine
     
@@ -628,14 +1345,14 @@ def continents_line_chart(
 
     # Add the first bar trace (e.g., percentage_from_41_to_50)
     fig_continents.add_trace(go.Scatter(x=df["date"],
-                            y=df["percentage_americas"],
+                            y=df["percentage_americas"].round(4),
                             name="Americas",
                             marker_color="maroon"))# gold                      #here
 
 #if 'Oceania' in selected_continents:
     # Add the first bar trace (e.g., percentage_from_19_to_30)
     fig_continents.add_trace(go.Scatter(x=df["date"],
-                            y=df["percentage_oceania"],
+                            y=df["percentage_oceania"].round(4),
                             name="Oceania",
                             marker_color="chocolate")) #coral
 
@@ -643,7 +1360,7 @@ def continents_line_chart(
 
     # Add the first bar trace (e.g., percentage_from_31_to_40)
     fig_continents.add_trace(go.Scatter(x=df["date"],
-                            y=df["percentage_africa"],
+                            y=df["percentage_africa"].round(4),
                             name="Africa",
                             marker_color= "darkkhaki"))
 
@@ -662,19 +1379,19 @@ def continents_line_chart(
             family="Courier New, monospace",
             size=12)           
     )
-    fig_continents.update_xaxes(
-        tickvals=tick_vals,
-        ticktext=tick_labels,
-        tickangle=45  # Rotate labels for better readability
-    )
+    format_month_axis(fig_continents, df["date"])
 
     return fig_continents
 
+@cached_figure
 def title_line_chart(
     df: pd.DataFrame,
     selected_title: list,
     text: str,
-    subtitle: dict)-> go.Figure:
+    subtitle: dict,
+    detail: int = 1)-> go.Figure:  # Level of detail set by build_within_budget, one month out of detail is drawn
+
+    df = decimate_frame(df, detail)
 
     option_title = ['GM', 'NT', 'other_titles']
     
@@ -686,30 +1403,26 @@ def title_line_chart(
     
     df = df[columns_to_consider]
     
-    # Generate the tick values and labels
-    tick_vals = df["date"]
-    tick_labels = df["date"].dt.strftime("%Y-%m")
-
     fig_title = go.Figure()
 
     if 'GM' in selected_title:
         
         fig_title.add_trace(go.Scatter(x=df["date"],
-                                y=df["percentage_gm"],
+                                y=df["percentage_gm"].round(4),
                                 name="Grandmaster",
                                 marker_color="tan")) # royalblue
 
     if 'other_titles' in selected_title:
         
         fig_title.add_trace(go.Scatter(x=df["date"],
-                                y=df["percentage_other_titles"],
+                                y=df["percentage_other_titles"].round(4),
                                 name="Other Titles",
                                 marker_color="darkslategrey")) # mediumaquamarine
         
     if 'NT' in selected_title:
 
         fig_title.add_trace(go.Scatter(x=df["date"],
-                                y=df["percentage_nt"],
+                                y=df["percentage_nt"].round(4),
                                 name="No Title",
                                 marker_color="sienna"))# gold                    #here
 
@@ -728,11 +1441,7 @@ def title_line_chart(
             family="Courier New, monospace",
             size=12)           
     )
-    fig_title.update_xaxes(
-        tickvals=tick_vals,
-        ticktext=tick_labels,
-        tickangle=45  # Rotate labels for better readability
-    )
+    format_month_axis(fig_title, df["date"])
     
     fig_title.update_yaxes(
         tickvals=[0, 0.2, 0.4, 0.6, 0.8,1],
@@ -744,14 +1453,16 @@ def title_line_chart(
 
     return fig_title
 
+@cached_figure
 def age_group_heat_map(
     df: pd.DataFrame,
     values_group_age: list,
     text: str,
-    subtitle: dict)-> go.Figure:
+    subtitle: dict,
+    detail: int = 1)-> go.Figure:  # Level of detail set by build_within_budget, one month out of detail is drawn
 
+    df = decimate_frame(df, detail).copy()
     df["date"] = pd.to_datetime(df["date"])
-    df["date"].dt.strftime("%Y-%m")
 
     z_data = np.array([
         df["percentage_less_than_19"],
@@ -762,25 +1473,14 @@ def age_group_heat_map(
         df["percentage_more_than_66"],
     ])
 
-    # Create annotations for each cell in the heatmap
-    annotations = []
-    for i, row in enumerate(z_data):
-        for j, value in enumerate(row):
-            annotations.append(
-                dict(
-                    x=df["date"][j],
-                    y=values_group_age[i],                
-                    text=f"{value*100:.1f}%",  # Format annotation with percentage
-                    showarrow=False,
-                    font=dict(size=10, color="white" if value*100 > 28 else "black")  # Dynamic text color
-                )
-            )
-
-    # Create the annotated heatmap
+    # Create the annotated heatmap, the percentage of each cell is written by Plotly from
+    # the template (in white on the dark cells)
     fig_title = go.Figure(data=go.Heatmap(
         x=df["date"],
         y=values_group_age,
-        z=z_data,
+        z=z_data.round(4),
+        texttemplate="%{z:.1%}",
+        textfont=dict(size=10),
         colorscale="Blues",
         colorbar_title="(%)",
     ))
@@ -797,30 +1497,116 @@ def age_group_heat_map(
             family="Courier New, monospace",
             size=12)           
     )
+    format_month_axis(fig_title, df["date"])
 
     return fig_title
 
+def rating_kde(bins: list, bin_counts: list, iqr: float, points: int = RATING_KDE_POINTS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Estimate the density of a rating distribution from its histogram, with a gaussian
+    kernel and Silverman's bandwidth as Plotly does for its violins.
+    Args:
+        bins (list): Lower bound of each histogram bin.
+        bin_counts (list): Number of players in each bin.
+        iqr (float): Interquartile range of the ratings.
+        points (int): Number of points of the estimated curve.
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The ratings and their density.
+    """
+    centers = np.asarray(bins, dtype=float) + RATING_HISTOGRAM_BIN_WIDTH / 2
+    counts = np.asarray(bin_counts, dtype=float)
+    n = counts.sum()
+    mean = (centers * counts).sum() / n
+    std = np.sqrt((counts * (centers - mean) ** 2).sum() / n)
+    spread = min(std, iqr / 1.349) if iqr > 0 else std
+    bandwidth = max(0.9 * spread * n ** -0.2, RATING_HISTOGRAM_BIN_WIDTH / 2)
+    ratings = np.linspace(centers[0] - 2 * bandwidth, centers[-1] + 2 * bandwidth, points)
+    kernel = np.exp(-0.5 * ((ratings[:, None] - centers[None, :]) / bandwidth) ** 2)
+    density = (kernel * counts).sum(axis=1) / (n * bandwidth * np.sqrt(2 * np.pi))
+    return ratings, density
+
+def violin_half_width(dates: pd.Series) -> pd.Timedelta:
+    """
+    Return the widest a half violin can be drawn without overlapping the next month.
+    """
+    gaps = pd.Series(dates.sort_values().unique()).diff().dropna()
+    gap = gaps.min() if not gaps.empty else pd.Timedelta(days=30)
+    return gap * 0.4
+
+def violin_points(detail: int) -> int:
+    """Number of points of the outline of a violin at a level of detail of build_within_budget."""
+    return max(RATING_KDE_MIN_POINTS, RATING_KDE_POINTS // detail)
+
+def add_rating_distribution_traces(fig: go.Figure,
+                                   df: pd.DataFrame,
+                                   name: str,
+                                   side: str,
+                                   color: str,
+                                   half_width: pd.Timedelta,
+                                   points: int = RATING_KDE_POINTS) -> None:
+    """
+    Draw one half violin per month from the rating summaries of get_rating_query.
+    Args:
+        fig (go.Figure): The figure to draw on.
+        df (pd.DataFrame): Rating summaries, one row per month.
+        name (str): Legend entry of the violins.
+        side (str): 'negative' to draw on the left of each month, 'positive' on the right.
+        color (str): Color of the violins.
+        half_width (pd.Timedelta): Width of the widest point of each violin.
+        points (int): Number of points of the outline of each violin.
+    """
+    sign = -1 if side == 'negative' else 1
+    x_violins, y_violins, x_means, y_means = [], [], [], []
+
+    for row in df.itertuples(index=False):
+        ratings, density = rating_kde(row.bins, row.bin_counts, row.quantiles[3] - row.quantiles[1], points=points)
+        offsets = pd.TimedeltaIndex(sign * half_width * (density / density.max())).round('s')
+        x_violins += [row.date] * len(ratings) + list(row.date + offsets[::-1]) + [None]
+        y_violins += list(ratings.round(1)) + list(ratings[::-1].round(1)) + [None]
+        mean_offset = (sign * half_width * (np.interp(row.mean, ratings, density) / density.max())).round('s')
+        x_means += [row.date, row.date + mean_offset, None]
+        y_means += [row.mean, row.mean, None]
+
+    fig.add_trace(go.Scatter(x=x_violins, y=y_violins,
+                             mode='lines', fill='toself',
+                             line=dict(color=color, width=1),
+                             legendgroup=name, name=name,
+                             hoverinfo='skip'))
+    fig.add_trace(go.Scatter(x=x_means, y=y_means,
+                             mode='lines',
+                             line=dict(color=color, width=1),
+                             legendgroup=name, showlegend=False,
+                             hoverinfo='skip'))
+
+    quantiles = np.array(df['quantiles'].tolist(), dtype=float).reshape(-1, len(RATING_SUMMARY_QUANTILES))
+    fig.add_trace(go.Scatter(x=df['date'], y=quantiles[:, 2],
+                             mode='markers',
+                             marker=dict(color=color, size=5),
+                             legendgroup=name, showlegend=False, name=name,
+                             customdata=np.column_stack([df['n'], df['mean'], df['min'], df['max'],
+                                                         quantiles[:, 1], quantiles[:, 3]]),
+                             hovertemplate=("median: %{y:.0f}<br>"
+                                            "mean: %{customdata[1]:.0f}<br>"
+                                            "q1: %{customdata[4]:.0f}  q3: %{customdata[5]:.0f}<br>"
+                                            "min: %{customdata[2]}  max: %{customdata[3]}<br>"
+                                            "players: %{customdata[0]}")))
+
+@cached_figure
 def rating_violin_chart(df: pd.DataFrame,
     text: str,
-    subtitle: dict)-> go.Figure:
+    subtitle: dict,
+    detail: int = 1)-> go.Figure:
 
     # Example: Ensure your 'date' column is in the correct format
     df["date"] = pd.to_datetime(df["date"])
 
-    # Generate the tick values and labels
-    #tick_vals = df["date"]
-    tick_labels = df["date"].dt.strftime("%Y-%m").unique()
-
     fig_rating = go.Figure()
 
-    fig_rating.add_trace(go.Violin(x=df['date'],
-                            y=df['rating'],
-                            legendgroup='Yes', scalegroup='Yes', name='Yes',
-                            side='negative', #positive
-                            line_color='teal')
-                )
+    add_rating_distribution_traces(fig_rating, df,
+                                   name='Yes', side='negative', color='teal',
+                                   half_width=violin_half_width(df['date']),
+                                   points=violin_points(detail))
 
-    fig_rating.update_traces(meanline_visible=True)
     fig_rating.update_layout(
         
         xaxis_title="Date",
@@ -832,15 +1618,9 @@ def rating_violin_chart(df: pd.DataFrame,
             subtitle=subtitle),
         font=dict(
             family="Courier New, monospace",
-            size=12),
-        violingap=0.25,
-        violinmode='overlay')
+            size=12))
 
-    fig_rating.update_xaxes(
-        tickvals=tick_labels,
-        ticktext=tick_labels,
-        tickangle=75  # Rotate labels for better readability
-    )
+    format_month_axis(fig_rating, df["date"], tickangle=75)
     
     return fig_rating
 
@@ -924,38 +1704,29 @@ def get_five_figures(df: pd.DataFrame,
     
     return fig_gender, fig_status_activity, fig_title, fig_age, fig_rating
 
+@cached_figure
 def rating_violin_chart_for_comparison_tool(first_country: str,
                                             second_country: str,
                                             df_first_country: pd.DataFrame,
                                             df_second_country: pd.DataFrame,
                                             text: str,
-                                            subtitle: dict)-> go.Figure:
+                                            subtitle: dict,
+                                            detail: int = 1)-> go.Figure:
 
     # Example: Ensure your 'date' column is in the correct format
     df_first_country["date"] = pd.to_datetime(df_first_country["date"])
     df_second_country["date"] = pd.to_datetime(df_second_country["date"])
-    # Generate the tick values and labels
-    #tick_vals = df["date"]
-    tick_labels = df_first_country["date"].dt.strftime("%Y-%m").unique()
-    
-    
     fig_rating = go.Figure()
 
-    fig_rating.add_trace(go.Violin(x=df_first_country['date'],
-                            y=df_first_country['rating'],
-                            legendgroup=first_country, scalegroup=first_country, name=first_country,
-                            side='negative',
-                            line_color='teal')
-                )
-    
-    fig_rating.add_trace(go.Violin(x=df_second_country['date'],
-                            y=df_second_country['rating'],
-                            legendgroup=second_country, scalegroup=second_country, name=second_country,
-                            side='positive',
-                            line_color='indigo')
-                )
-
-    fig_rating.update_traces(meanline_visible=True)
+    half_width = violin_half_width(pd.concat([df_first_country["date"], df_second_country["date"]]))
+
+    add_rating_distribution_traces(fig_rating, df_first_country,
+                                   name=first_country, side='negative', color='teal',
+                                   half_width=half_width, points=violin_points(detail))
+    add_rating_distribution_traces(fig_rating, df_second_country,
+                                   name=second_country, side='positive', color='indigo',
+                                   half_width=half_width, points=violin_points(detail))
+
     fig_rating.update_layout(
         
         xaxis_title="Date",
@@ -967,19 +1738,14 @@ def rating_violin_chart_for_comparison_tool(first_country: str,
             subtitle=subtitle),
         font=dict(
             family="Courier New, monospace",
-            size=12),
-        violingap=0.25,
-        violinmode='overlay')
+            size=12))
 
-    fig_rating.update_xaxes(
-        tickvals=tick_labels,
-        ticktext=tick_labels,
-        tickangle=45  # Rotate labels for better readability
-    )
+    format_month_axis(fig_rating, df_first_country["date"])
     
     return fig_rating
 
 def variation_rating_player_line_chart(player_selected:str,
+                                       profile:pd.DataFrame,
                                        text:str,
                                        subtitle:dict) -> go.Figure:    
     if player_selected == False:
@@ -987,21 +1753,9 @@ def variation_rating_player_line_chart(player_selected:str,
     
     else:
         
-        query=f"""
-        SELECT
-            fed,
-            rating,
-            ongoing_date as date 
-        FROM montlhyupdates m 
-        WHERE m.id = (select id
-                        from players p 
-                    where p.name = '{player_selected}')
-        ORDER BY ongoing_date
-        """
-        df = load_data(query)
+        df = profile[['fed', 'rating', 'date']].copy()
         
-        query_last_month = """SELECT get_last_month()"""
-        last_month = load_data(query_last_month)['get_last_month'].values[0]
+        last_month = get_dataset_metadata()['latest_month']
         if last_month < 10:
             last_month = '-0'+str(last_month)+'-'
         df['date']=df['date'].astype('str')
@@ -1045,6 +1799,7 @@ def variation_rating_player_line_chart(player_selected:str,
     return fig_rating
 
 def variation_games_played_line_chart(player_selected:str,
+                                       profile:pd.DataFrame,
                                        text:str,
                                        subtitle:dict
                                        ) -> go.Figure:    
@@ -1054,32 +1809,21 @@ def variation_games_played_line_chart(player_selected:str,
         
     else:
         
-        query_last_month = """SELECT get_last_month()"""
-        last_month = load_data(query_last_month)['get_last_month'].values[0]
+        last_month = get_dataset_metadata()['latest_month']
                 
-        query=f"""
-        SELECT
-            SUM(number_of_games) AS total_games,
-            CASE
-                WHEN EXTRACT(MONTH FROM ongoing_date) >= {last_month + 1} THEN EXTRACT(YEAR FROM ongoing_date)
-                ELSE EXTRACT(YEAR FROM ongoing_date) - 1
-            END AS years
-        FROM montlhyupdates m
-        WHERE m.id = (
-            SELECT id
-            FROM players p
-            WHERE p.name = '{player_selected}'
-        )
-        GROUP BY years
-        ORDER BY years;
-        """
+        # Years running from the month after the latest one
+        first_month = int(last_month) + 1
+        dates = pd.to_datetime(profile['date'])
+        years = dates.dt.year.where(dates.dt.month >= first_month, dates.dt.year - 1)
+        df = (profile.assign(years=years)
+              .groupby('years', as_index=False)
+              .agg(total_games=('number_of_games', 'sum')))
         if last_month == 1:
             last_month = 12
         else:
             last_month = last_month - 1
         
         
-        df = load_data(query)
         df['years']=df['years'].apply(lambda x: int(x))
         
         fig_games = go.Figure()
@@ -1120,6 +1864,86 @@ def variation_games_played_line_chart(player_selected:str,
     return fig_games
 
 
+# Path of the rankings of the bar chart race, written by the monthly update
+BAR_CHART_RACE_PAYLOAD_PATH = 'bar_chart_race_video/top_players_over_time.json'
+BAR_CHART_RACE_COLORS = px.colors.qualitative.Dark24
+
+@st.cache_data
+def load_bar_chart_race_payload(path: str = BAR_CHART_RACE_PAYLOAD_PATH) -> Optional[dict]:
+    """
+    Load the rankings of the top players over time saved by the monthly update.
+    Args:
+        path (str): Path of the JSON file.
+    Returns:
+        Optional[dict]: The dates, ids, names, feds, top (indexes of the players by month) and
+            ratings, None if the file does not exist.
+    """
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+def bar_chart_race_chart(payload: dict,
+                         n_bars: int,
+                         text: str,
+                         subtitle: dict) -> go.Figure:
+    """
+    Animate the top n_bars players of each month with Plotly frames, with play/pause buttons and a
+    slider to move through the months.
+    Args:
+        payload (dict): The rankings loaded by load_bar_chart_race_payload.
+        n_bars (int): Number of players shown.
+        text (str): Title of the chart.
+        subtitle (dict): Subtitle of the chart.
+    Returns:
+        go.Figure: The animated bar chart.
+    """
+    names, feds = payload['names'], payload['feds']
+    ratings = [month[:n_bars] for month in payload['ratings']]
+
+    def month_bars(top: list, month_ratings: list) -> go.Bar:
+        return go.Bar(x=month_ratings,
+                      y=list(range(len(top))),
+                      orientation='h',
+                      text=[f"{names[i]} ({feds[i]})" for i in top],
+                      textposition='inside',
+                      insidetextanchor='start',
+                      marker_color=[BAR_CHART_RACE_COLORS[i % len(BAR_CHART_RACE_COLORS)] for i in top],
+                      hovertemplate='%{text}<br>Rating: %{x}<extra></extra>')
+
+    frames = [go.Frame(data=[month_bars(top[:n_bars], month_ratings)], name=date)
+              for date, top, month_ratings in zip(payload['dates'], payload['top'], ratings)]
+
+    fig = go.Figure(data=frames[-1].data, frames=frames)
+
+    # Same axes for all the months, so the bars move instead of the axes
+    lowest = min(min(month) for month in ratings)
+    highest = max(max(month) for month in ratings)
+    def frame_args(duration: int) -> dict:
+        return dict(frame=dict(duration=duration, redraw=True),
+                    transition=dict(duration=duration * 0.6, easing='linear'),
+                    mode='immediate')
+
+    fig.update_layout(
+        height=150 + 45 * n_bars,
+        title=customize_title_charts(text=text, subtitle=subtitle),
+        font=dict(family="Courier New, monospace", size=12),
+        xaxis=dict(range=[lowest - 50, highest + 10], title='Rating'),
+        yaxis=dict(range=[n_bars - 0.5, -0.5], showticklabels=False),
+        updatemenus=[dict(type='buttons',
+                          direction='left',
+                          x=0, y=-0.15, xanchor='left', yanchor='top',
+                          buttons=[dict(label='▶ Play', method='animate', args=[None, frame_args(500)]),
+                                   dict(label='❚❚ Pause', method='animate', args=[[None], frame_args(0)])])],
+        sliders=[dict(active=len(frames) - 1,
+                      x=0.2, y=-0.1, len=0.8,
+                      currentvalue=dict(prefix='Month: '),
+                      steps=[dict(label=frame.name, method='animate', args=[[frame.name], frame_args(0)])
+                             for frame in frames])]
+    )
+    return fig
+
 ###################################################
 # Filters
 ###################################################
@@ -1253,9 +2077,13 @@ def filter_age_group():
     
     return option_map_age, age_header, selected_age
 
-def filter_rating(min_rating:int, max_rating:int):
+def filter_rating(min_rating:int, max_rating:int, container: Any = st.sidebar):
+    """
+    Rating range slider, in the sidebar by default. Fragments cannot write to the sidebar,
+    they pass container=st to draw it in their own body.
+    """
     
-    rating_header = st.sidebar.markdown("""
+    rating_header = container.markdown("""
     <style>
     #rating-header {
         margin-bottom: -100px; /* Adjust the negative value to reduce space */
@@ -1264,9 +2092,13 @@ def filter_rating(min_rating:int, max_rating:int):
     <h3 id="rating-header">Rating (Elo range)</h3>
     """, unsafe_allow_html=True)
     
-    slider_rating = st.sidebar.slider(
+    # Align the range on the rating buckets of the cube, both bounds are included
+    min_rating = int(min_rating) // RATING_BUCKET_WIDTH * RATING_BUCKET_WIDTH
+    max_rating = -(-int(max_rating) // RATING_BUCKET_WIDTH) * RATING_BUCKET_WIDTH
+    
+    slider_rating = container.slider(
         label="Rating Range",
-        step=100,
+        step=RATING_BUCKET_WIDTH,
         value=[min_rating,max_rating],
         min_value=min_rating,
         max_value=max_rating,
@@ -1275,130 +2107,221 @@ def filter_rating(min_rating:int, max_rating:int):
     
     return rating_header, slider_rating
 
-def filters_for_comparison_tool(country: str,
-                                selected_gender: list,
-                                selected_activity_Status: list,
-                                selected_title: list,
-                                selected_age: list) -> list:
-    
-    filters = ["EXTRACT(MONTH FROM muomv.ongoing_date) = (SELECT get_last_month())",f"c.country = '{country}'"]
-    
-    if selected_gender:
-        
-        if len(selected_gender) > 1:
-        
-            filters.append(f"sex in {tuple(selected_gender)}")
-            
-        else:
-            filters.append(f"sex in ('{selected_gender[0]}')")
+OTHER_TITLES = ('CM','FM','IM','WCM','WFM','WGM','WH','WIM')
+EXCLUDED_FEDS = ('FID', 'NON')
+# Width of the rating buckets of player_filter_cube, the rating filter moves by this step
+RATING_BUCKET_WIDTH = 100
+# Width of the histogram bins of rating_sketch and of the rating summaries drawn by the
+# violin charts. Medians read from the sketch are off by less than one bin.
+RATING_HISTOGRAM_BIN_WIDTH = 10
+RATING_SUMMARY_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+# Columns the filters apply to in the queries over the players-with-age-group view
+FILTER_COLUMNS = {
+    'ongoing_date': 'muomv.ongoing_date',
+    'fed': 'muomv.fed',
+    'country': 'c.country',
+    'continent': 'c.continent',
+    'sex': 'p.sex',
+    'activity_status': 'muomv.activity_status',
+    'title': 'muomv.title',
+    'age_category': 'muomv.age_category',
+    'rating': 'muomv.rating',
+}
+
+# Columns the filters apply to in the queries over player_filter_cube. The cube stores the
+# title option of the sidebar (title_group) and the rating bucket instead of the rating.
+CUBE_FILTER_COLUMNS = {
+    'ongoing_date': 'pfc.ongoing_date',
+    'fed': 'pfc.fed',
+    'country': 'c.country',
+    'continent': 'pfc.continent',
+    'sex': 'pfc.sex',
+    'activity_status': 'pfc.activity_status',
+    'title_group': 'pfc.title_group',
+    'age_category': 'pfc.age_category',
+    'rating_bucket': 'pfc.rating_bucket',
+}
+
+# Columns the filters apply to in the queries over rating_sketch. The sketch stores the
+# rating bin instead of the rating, the rating bounds are multiples of the bin width.
+SKETCH_FILTER_COLUMNS = {
+    'ongoing_date': 'rs.ongoing_date',
+    'fed': 'rs.fed',
+    'country': 'c.country',
+    'continent': 'c.continent',
+    'sex': 'rs.sex',
+    'activity_status': 'rs.activity_status',
+    'title': 'rs.title',
+    'age_category': 'rs.age_category',
+    'rating': 'rs.rating_bin',
+}
+
+@dataclass(frozen=True)
+class FilterSpec:
+    """
+    Selection of the filters of a page, normalized so that the same logical selection
+    always gives the same SQL text, the same bound values and the same cache key.
+
+    Every selection is stored sorted and without duplicates. An empty selection means
+    the dimension is not filtered.
+
+    Attributes:
+        countries (tuple): Country names (countries.country).
+        continents (tuple): Continent names (countries.continent).
+        sex (tuple): Gender codes ('F', 'M').
+        activity_status (tuple): Activity status codes ('a', 'i').
+        titles (tuple): Title options of the sidebar ('GM', 'NT', 'other_titles').
+        age_categories (tuple): Age categories of the players-with-age-group view.
+        rating_range (Optional[tuple]): Lower and upper bound of the rating, both included.
+            The queries over the cube widen it to whole rating buckets.
+        excluded_feds (tuple): Federation codes to leave out.
+        snapshot_dates (tuple): Snapshots (ongoing_date) to keep, all of them when empty.
+    """
+    countries: Tuple[str, ...] = ()
+    continents: Tuple[str, ...] = ()
+    sex: Tuple[str, ...] = ()
+    activity_status: Tuple[str, ...] = ()
+    titles: Tuple[str, ...] = ()
+    age_categories: Tuple[str, ...] = ()
+    rating_range: Optional[Tuple[int, int]] = None
+    excluded_feds: Tuple[str, ...] = ()
+    snapshot_dates: Tuple[datetime.date, ...] = ()
+
+    def __post_init__(self):
+        for field in fields(self):
+            value = getattr(self, field.name)
+            if field.name == 'rating_range':
+                if value is not None:
+                    object.__setattr__(self, field.name, (int(value[0]), int(value[1])))
+            else:
+                object.__setattr__(self, field.name, tuple(sorted(set(value))))
 
-    if selected_activity_Status:
-        
-        if len(selected_activity_Status) > 1:
-        
-            filters.append(f"activity_status in {tuple(selected_activity_Status)}")
-            
-        else:
-            filters.append(f"activity_status in ('{selected_activity_Status[0]}')")
-        
-    other_titles_list = ['CM','FM','IM','WCM','WFM','WGM','WH','WIM'] 
-            
-    if selected_title:
-        
-        if 'other_titles' in selected_title:
-            
-            if len(selected_title) == 1:
-                    
-                filters.append(f"title in {tuple(other_titles_list)}")
+    @property
+    def cache_key(self) -> str:
+        """Stable hash of the selection, the same across processes and reruns."""
+        return hashlib.sha1(repr(tuple(getattr(self, f.name) for f in fields(self))).encode()).hexdigest()
 
-            else:
-                option_to_consider_title = [i for i in selected_title if i != 'other_titles']
-                option_to_consider_title.extend(other_titles_list)
-                
-                filters.append(f"title in {tuple(option_to_consider_title)}")
-                
+    def title_values(self) -> Tuple[str, ...]:
+        """Expand the 'other_titles' option into the titles it stands for."""
+        values = set(self.titles) - {'other_titles'}
+        if 'other_titles' in self.titles:
+            values.update(OTHER_TITLES)
+        return tuple(sorted(values))
+
+    def compile(self, columns: Optional[Dict[str, str]] = None) -> Tuple[str, Dict[str, Any]]:
+        """
+        Compile the selection into a SQL condition with bound parameters.
+        Args:
+            columns (Optional[Dict[str, str]]): Qualified column of each filtered dimension,
+                FILTER_COLUMNS by default.
+        Returns:
+            Tuple[str, Dict[str, Any]]: The condition (without the WHERE keyword) and the
+                values of its parameters.
+        """
+        columns = columns or FILTER_COLUMNS
+        conditions, params = [], {}
+
+        if self.snapshot_dates:
+            # A plain comparison on the column, so the indexes on ongoing_date can be used
+            conditions.append(f"{columns['ongoing_date']} = ANY(:snapshot_dates)")
+            params['snapshot_dates'] = list(self.snapshot_dates)
+
+        # The cube stores the title options, the other relations the titles themselves
+        if 'title_group' in columns:
+            title_column, titles = 'title_group', self.titles
         else:
-            
-            if len(selected_title) > 1:
-        
-                filters.append(f"title in {tuple(selected_title)}")
-            
+            title_column, titles = 'title', self.title_values()
+
+        for name, column, values in (('countries', 'country', self.countries),
+                                     ('continents', 'continent', self.continents),
+                                     ('sex', 'sex', self.sex),
+                                     ('activity_status', 'activity_status', self.activity_status),
+                                     ('titles', title_column, titles),
+                                     ('age_categories', 'age_category', self.age_categories)):
+            if values:
+                conditions.append(f"{columns[column]} IN :{name}")
+                params[name] = values
+
+        if self.excluded_feds:
+            conditions.append(f"{columns['fed']} NOT IN :excluded_feds")
+            params['excluded_feds'] = self.excluded_feds
+
+        if self.rating_range:
+            min_rating, max_rating = self.rating_range
+            if 'rating_bucket' in columns:
+                # The cube only knows the buckets: keep every bucket the range overlaps,
+                # from the bucket of the lower bound to the bucket of the upper bound
+                conditions.append(f"{columns['rating_bucket']} >= :min_rating "
+                                  f"AND {columns['rating_bucket']} < :max_rating")
+                params['min_rating'] = min_rating // RATING_BUCKET_WIDTH * RATING_BUCKET_WIDTH
+                params['max_rating'] = (max_rating // RATING_BUCKET_WIDTH + 1) * RATING_BUCKET_WIDTH
             else:
-                filters.append(f"title in ('{selected_title[0]}')")
+                conditions.append(f"{columns['rating']} BETWEEN :min_rating AND :max_rating")
+                params['min_rating'], params['max_rating'] = min_rating, max_rating
 
-    if selected_age:
-        
-        if len(selected_age) > 1:
-        
-            filters.append(f"age_category in {tuple(selected_age)}")
-            
-        else:
-            filters.append(f"age_category in ('{selected_age[0]}')")     
+        return " AND ".join(conditions) or "TRUE", params
+
+def filter_statement(query: str,
+                     filters: FilterSpec,
+                     columns: Optional[Dict[str, str]] = None,
+                     **extra_params: Any) -> TextClause:
+    """
+    Build the statement of a query whose WHERE condition is the `{where}` placeholder,
+    binding the values of the filters as parameters.
+    Args:
+        query (str): SQL query containing the `{where}` placeholder.
+        filters (FilterSpec): The selection to apply.
+        columns (Optional[Dict[str, str]]): Qualified column of each filtered dimension.
+        **extra_params: Other parameters used by the query outside of the filters.
+    Returns:
+        TextClause: The statement with its parameters bound.
+    """
+    condition, params = filters.compile(columns)
+    params.update(extra_params)
+    statement = text(query.replace("{where}", condition))
+    return statement.bindparams(*[
+        bindparam(name, value=value, expanding=isinstance(value, tuple))
+        for name, value in params.items()
+    ])
+
+def build_filters(selected_gender: list,
+                  selected_activity_Status: list,
+                  selected_title: list,
+                  selected_age: list,
+                  **kwargs) -> FilterSpec:
+    """
+    Build the FilterSpec of the sidebar selection. Extra keyword arguments (countries,
+    continents, rating_range, ...) are passed to FilterSpec. Unless `snapshot_dates` is
+    given, only the snapshots of the latest month of each year are kept.
+    """
+    if 'snapshot_dates' not in kwargs:
+        kwargs['snapshot_dates'] = latest_month_snapshot_dates()
+    return FilterSpec(sex=selected_gender or (),
+                      activity_status=selected_activity_Status or (),
+                      titles=selected_title or (),
+                      age_categories=selected_age or (),
+                      **kwargs)
 
-    return filters
+def filters_for_comparison_tool(country: str,
+                                selected_gender: list,
+                                selected_activity_Status: list,
+                                selected_title: list,
+                                selected_age: list) -> FilterSpec:
+    
+    return build_filters(selected_gender, selected_activity_Status, selected_title, selected_age,
+                         countries=(country,))
 
 def filters_for_metrics_comparison_tool(first_country: str,
                                         second_country: str,
                                         selected_gender: list,
                                         selected_activity_Status: list,
                                         selected_title: list,
-                                        selected_age: list) -> list:
+                                        selected_age: list) -> FilterSpec:
     
-    filters = [f"country in ('{first_country}','{second_country}')"]
-    
-    if selected_gender:
-        
-        if len(selected_gender) > 1:
-        
-            filters.append(f"sex in {tuple(selected_gender)}")
-            
-        else:
-            filters.append(f"sex in ('{selected_gender[0]}')")
-
-    if selected_activity_Status:
-        
-        if len(selected_activity_Status) > 1:
-        
-            filters.append(f"activity_status in {tuple(selected_activity_Status)}")
-            
-        else:
-            filters.append(f"activity_status in ('{selected_activity_Status[0]}')")
-        
-    other_titles_list = ['CM','FM','IM','WCM','WFM','WGM','WH','WIM'] 
-            
-    if selected_title:
-        
-        if 'other_titles' in selected_title:
-            
-            if len(selected_title) == 1:
-                    
-                filters.append(f"title in {tuple(other_titles_list)}")
-
-            else:
-                option_to_consider_title = [i for i in selected_title if i != 'other_titles']
-                option_to_consider_title.extend(other_titles_list)
-                
-                filters.append(f"title in {tuple(option_to_consider_title)}")
-                
-        else:
-            
-            if len(selected_title) > 1:
-        
-                filters.append(f"title in {tuple(selected_title)}")
-            
-            else:
-                filters.append(f"title in ('{selected_title[0]}')")
-
-    if selected_age:
-        
-        if len(selected_age) > 1:
-        
-            filters.append(f"age_category in {tuple(selected_age)}")
-            
-        else:
-            filters.append(f"age_category in ('{selected_age[0]}')")     
-
-    return filters
+    return build_filters(selected_gender, selected_activity_Status, selected_title, selected_age,
+                         countries=(first_country, second_country),
+                         snapshot_dates=())
 
 ####################################################
 # Structure
@@ -1408,7 +2331,8 @@ def create_placeholder_for_continent_analysis(selected_gender: list,
                                               selected_activity_Status: list,
                                               selected_title: list,
                                               selected_age:list,
-                                              filters: list,
+                                              average_of_median_rating_over_time: float,
+                                              count_unique_countries: int,
                                               fig_gender: go.Figure,
                                               fig_status_activity: go.Figure,
                                               fig_title: go.Figure,
@@ -1440,7 +2364,7 @@ def create_placeholder_for_continent_analysis(selected_gender: list,
                 f"""
                 <div style="border: 2px solid #ccc; border-radius: 10px; padding: 0px;  margin: 25px; text-align: center;">
                     <h4>Average of median rating over time</h4>
-                    <p style="font-size: 20px;">{get_average_of_median_rating_over_time(filters=filters)}</p>
+                    <p style="font-size: 20px;">{average_of_median_rating_over_time}</p>
                 </div>
                 """,
                 unsafe_allow_html=True)
@@ -1452,7 +2376,7 @@ def create_placeholder_for_continent_analysis(selected_gender: list,
                 f"""
                 <div style="border: 2px solid #ccc; border-radius: 10px; padding: 0px; margin: 25px; text-align: center;">
                     <h4>Total Countries considered</h4>
-                    <p style="font-size: 20px;">{get_count_unique_countries(filters=filters)}</p>
+                    <p style="font-size: 20px;">{count_unique_countries}</p>
                 </div>
                 """,
                 unsafe_allow_html=True)
@@ -1461,6 +2385,35 @@ def create_placeholder_for_continent_analysis(selected_gender: list,
         
         st.plotly_chart(fig_rating, use_container_width=True)    
 
+def bubble_chart_frame_step(key: str) -> int:
+    """
+    Toggle of a bubble chart between one frame per quarter, drawn first, and one frame per month.
+    Args:
+        key (str): Key of the toggle, unique in the page.
+    Returns:
+        int: The frame_step of bubble_chart.
+    """
+    monthly = st.toggle("Every month", key=key,
+                        help="Animate every month instead of one month per quarter")
+    return 1 if monthly else BUBBLE_CHART_FIRST_PAINT_STEP
+
+@st.fragment
+def lazy_expander(label: str, icon: str, key: str, render: Callable[..., None], **kwargs) -> None:
+    """
+    Section opened with a toggle, drawn as a fragment. Its content (queries and charts) is
+    only computed once it is opened, and opening it or using its widgets reruns this section
+    instead of the whole page.
+    Args:
+        label (str): Label of the toggle.
+        icon (str): Icon shown before the label.
+        key (str): Key of the toggle, unique in the page.
+        render (Callable[..., None]): Draws the content, called with kwargs.
+        **kwargs: The data the content depends on.
+    """
+    if st.toggle(f"{icon} {label}", key=key):
+        with st.container(border=True):
+            render(**kwargs)
+
 
 
 